@@ -2,7 +2,6 @@ import streamlit as st
 import json
 import os
 import tempfile
-import config
 
 from ocr_extraction import extract_text_from_pdf
 from parse_ocr_to_json import (
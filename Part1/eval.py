@@ -3,7 +3,7 @@ import logging
 import os
 from typing import Dict, Any
 from ocr_extraction import extract_text_from_pdf
-from parse_ocr_to_json import generate_json_from_text
+from parse_ocr_to_json import generate_json_from_text, FORM_EXTRACTION_PROMPT
 
 
 def flatten_json(nested: Dict[str, Any], parent_key: str = '', sep: str = '.') -> Dict[str, str]:
@@ -83,6 +83,9 @@ def run_evaluation(form_file: str, ground_truth_file: str, report_file: str):
          2. Calls GPT to extract the JSON structure.
          3. Loads the ground truth JSON.
          4. Generates an evaluation report and saves it to a file.
+
+       The report records the extraction prompt's version id and its cached-token
+       ratio so far in this run, so results of different prompt versions are not mixed.
        """
     logging.info(f"Processing form: {form_file}")
     # Step 1: Run OCR on the form
@@ -100,10 +103,13 @@ def run_evaluation(form_file: str, ground_truth_file: str, report_file: str):
 
     # Step 4: Evaluate the extraction result
     report = evaluate_extraction_result(predicted_json, ground_truth)
+    report["prompt_version"] = FORM_EXTRACTION_PROMPT.version_id
+    report["prompt_cache"] = FORM_EXTRACTION_PROMPT.cache_stats()
 
     # Print evaluation report to console
     print("\nEvaluation Summary:")
     print(json.dumps(report["summary"], indent=2, ensure_ascii=False))
+    print(f"Prompt: {report['prompt_version']} (cached prompt tokens so far: {report['prompt_cache']['cached_ratio']:.0%})")
     print("\nField-level Analysis:")
     for field, status, pred_val, true_val in report["details"]:
         print(f"{status} - {field}:\n    expected: {true_val}\n    got:      {pred_val}\n")
@@ -1,30 +1,18 @@
 import os
+import sys
 import logging
-from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.core.credentials import AzureKeyCredential
-from dotenv import load_dotenv
 import time
 
+# The shared settings and Azure clients live in common/ at the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.clients import get_document_intelligence_client
+
 POLLING_INTERVAL = 1
 MAX_ATTEMPTS = 10
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Load API credentials from .env
-load_dotenv()
-
-AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT")
-AZURE_DOCUMENT_INTELLIGENCE_KEY = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_KEY")
-
-# Ensure API keys are loaded correctly
-if not AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT or not AZURE_DOCUMENT_INTELLIGENCE_KEY:
-    raise ValueError("API Key or Endpoint not found. Check your .env file!")
-
-# Initialize the Azure Document Intelligence client
-client = DocumentIntelligenceClient(AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT,
-                                    AzureKeyCredential(AZURE_DOCUMENT_INTELLIGENCE_KEY))
-
 def extract_text_from_pdf(file_path):
     """
         Extracts text from a given PDF or image using Azure Document Intelligence.
@@ -34,7 +22,8 @@ def extract_text_from_pdf(file_path):
     try:
         logging.info(f"Processing file: {file_path}")
         with open(file_path, "rb") as file:
-            poller = client.begin_analyze_document("prebuilt-layout", file)
+            # The process-wide client (created on first use) keeps its connections warm across files
+            poller = get_document_intelligence_client().begin_analyze_document("prebuilt-layout", file)
 
         attempts = 0
         while not poller.done():
@@ -1,19 +1,22 @@
-from openai import AzureOpenAI
-import config
+import os
+import sys
 import json
 import logging
 import re
 from ocr_extraction import extract_text_from_pdf  # Import OCR function
 
+# The shared settings, Azure clients and rate limiter live in common/ at the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common import RateLimitedClient, PRIORITY_BATCH, PromptTemplate, register, settings
+from common.clients import get_openai_client
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
-    api_key=config.AZURE_OPENAI_API_KEY,
-    api_version=config.AZURE_OPENAI_API_VERSION,
-    azure_endpoint=config.AZURE_OPENAI_ENDPOINT
-)
+# The process-wide pooled Azure OpenAI client, created on first use. Form extraction is
+# batch work: when the deployment's budget (AZURE_RATE_LIMITS) is short it waits behind
+# interactive chat and intake calls.
+client = RateLimitedClient(get_openai_client, PRIORITY_BATCH)
 
 # JSON template (Hebrew) defining fields to extract from the National Insurance form.
 json_template_he = {
@@ -77,6 +80,25 @@ field_translation_map = {
     "מהות התאונה": "natureOfAccident",
     "אבחנות רפואיות": "medicalDiagnoses"
 }
+
+# The instructions and the JSON schema are the fixed opening of every extraction
+# request and the OCR text comes last. The prefix is ~400 tokens, below the 1024 Azure
+# needs before it caches a prefix, so the cached-token ratio logged below stays 0.
+# Bump the version when changing the wording; the version id goes into eval reports.
+FORM_EXTRACTION_PROMPT = register(PromptTemplate(
+    "form_extraction",
+    1,
+    system=(
+        "You are a JSON extraction expert. "
+        "You extract structured data from OCR text of a National Insurance Institute form, "
+        "possibly in Hebrew or English.\n\n"
+        "Extract the fields and format them into valid JSON:\n"
+        f"{json.dumps(json_template_he, indent=2, ensure_ascii=False)}\n\n"
+        "If any field is missing, return an empty string.\n"
+        "Respond ONLY with the JSON object (no explanations)."
+    ),
+    user="Here is the extracted text:\n{ocr_text}",
+))
 def clean_text(text: str) -> str:
     """
     Cleans up extracted text by removing extra spaces, newlines, and special characters.
@@ -134,31 +156,16 @@ def generate_json_from_text(ocr_text: str, word_confidences) -> dict:
       Returns extracted data in Hebrew (for UI mapping).
       """
 
-    prompt = f"""
-    You are an expert in extracting structured data from OCR text.
-    The following text was extracted from a National Insurance Institute form, possibly in Hebrew or English.
-
-    Please extract the fields and format them into valid JSON:
-    {json.dumps(json_template_he, indent=2, ensure_ascii=False)}
-
-    If any field is missing, return an empty string.
-
-    Here is the extracted text:
-    {clean_text(ocr_text)}
-
-    Respond ONLY with the JSON object (no explanations).
-    """
-
     try:
         response = client.chat.completions.create(
-            model=config.AZURE_OPENAI_DEPLOYMENT,
-            messages=[
-                {"role": "system", "content": "You are a JSON extraction expert."},
-                {"role": "user", "content": prompt},
-            ],
+            model=settings.AZURE_OPENAI_DEPLOYMENT,
+            messages=FORM_EXTRACTION_PROMPT.messages(ocr_text=clean_text(ocr_text)),
             temperature=0.0,
             max_tokens=1000
         )
+        usage = FORM_EXTRACTION_PROMPT.record_usage(response)
+        if usage is not None:
+            logging.info(f"Extraction prompt {FORM_EXTRACTION_PROMPT.version_id}: {usage[1]} of {usage[0]} prompt tokens cached")
 
         # Extract the assistant's text (JSON) from the response
         json_output = response.choices[0].message.content
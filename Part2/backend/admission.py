@@ -0,0 +1,56 @@
+import asyncio
+import logging
+from fastapi import HTTPException
+
+
+class AdmissionLimiter:
+    """
+    Bounds how many requests run an upstream LLM call at the same time.
+
+    Up to `max_concurrent` requests proceed; up to `max_waiting` more wait at most
+    `wait_timeout` seconds for a slot. Anything beyond that is rejected at once with
+    HTTP 503 and a Retry-After header, so overload fails fast instead of piling up
+    in the event loop.
+    """
+
+    def __init__(self, max_concurrent, max_waiting, wait_timeout, retry_after=1):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.waiting = 0
+        self.in_flight = 0
+
+    def _reject(self, reason):
+        logging.warning(f"Rejecting request: {reason} (in flight: {self.in_flight}, waiting: {self.waiting})")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please retry shortly",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    async def acquire(self):
+        """Waits for a slot or raises HTTPException(503)."""
+        if self.in_flight + self.waiting >= self.max_concurrent + self.max_waiting:
+            self._reject("admission queue full")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.wait_timeout)
+        except asyncio.TimeoutError:
+            self._reject("timed out waiting for a slot")
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
@@ -0,0 +1,44 @@
+from telemetry import Counter, Histogram
+
+REQUEST_LATENCY = Histogram(
+    "chat_http_request_duration_seconds",
+    "Time to produce the HTTP response (for /chat/stream: until streaming starts).",
+    ["endpoint", "method"],
+)
+REQUESTS = Counter("chat_http_requests_total", "HTTP requests by endpoint and status code.", ["endpoint", "status"])
+STAGE_LATENCY = Histogram(
+    "chat_stage_duration_seconds",
+    "Time spent per request stage (embedding, search, rewrite, prompt_build, llm).",
+    ["stage"],
+)
+LLM_TOKENS = Counter(
+    "chat_llm_tokens_total",
+    "LLM tokens by kind (prompt/completion); estimated locally when a stream reports no usage.",
+    ["kind", "source"],
+)
+CHAT_ERRORS = Counter("chat_errors_total", "Failed chat requests by health fund and reason.", ["hmo", "reason"])
+COALESCED_CALLS = Counter(
+    "chat_coalesced_total",
+    "Requests served by an identical upstream call already in flight (chat, chat_stream, embedding).",
+    ["call"],
+)
+EVENT_LOOP_LAG = Histogram(
+    "chat_event_loop_lag_seconds",
+    "How late the event loop resumed a task sleeping for EVENT_LOOP_LAG_INTERVAL.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+PROMPT_TOKENS = Counter(
+    "chat_prompt_tokens_total",
+    "Prompt tokens reported by Azure per prompt version, split into cached (served from the prompt cache) or not.",
+    ["prompt_version", "cached"],
+)
+
+
+def record_prompt_usage(prompt, response):
+    """Adds a call's reported prompt usage to the prompt's cache stats and to PROMPT_TOKENS."""
+    usage = prompt.record_usage(response)
+    if usage is not None:
+        prompt_tokens, cached_tokens = usage
+        PROMPT_TOKENS.inc(cached_tokens, prompt_version=prompt.version_id, cached="true")
+        PROMPT_TOKENS.inc(prompt_tokens - cached_tokens, prompt_version=prompt.version_id, cached="false")
+    return usage
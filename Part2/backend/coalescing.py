@@ -0,0 +1,177 @@
+import os
+import sys
+import asyncio
+import hashlib
+import json
+import logging
+
+# The retrieval package lives in Part2/; set up its path here too, so this module
+# imports on its own and not only after main.py's path setup
+_PART2_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _PART2_DIR not in sys.path:
+    sys.path.append(_PART2_DIR)
+from retrieval.text_utils import normalize_text
+
+
+def chat_key(question, user_info, language, context, conversation_history=(), conversation_summary="",
+             prompt_version=""):
+    """
+    Key under which identical chat requests are coalesced: the normalized question,
+    the user's plan, age and gender, the answer language, the prompt version and a hash of everything
+    else in the prompt (knowledge snippet, conversation memory).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(context.encode("utf-8"))
+    digest.update(json.dumps([list(conversation_history), conversation_summary], ensure_ascii=False).encode("utf-8"))
+    return (
+        " ".join(normalize_text(question, fold_finals=False).split()),
+        user_info.get("hmo_name", ""),
+        user_info.get("insurance_tier", ""),
+        str(user_info.get("age", "")),
+        user_info.get("gender", ""),
+        language,
+        prompt_version,
+        digest.hexdigest(),
+    )
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls with the same key: the first caller starts the
+    call, later callers with the same key await the same task, and all of them get
+    its result (or its exception). The key is forgotten as soon as the call finishes,
+    so nothing is cached beyond the calls already in flight.
+
+    The call runs as its own task, so a caller that disconnects does not cancel it
+    for the others.
+    """
+
+    def __init__(self, on_shared=None):
+        self._calls = {}
+        self.on_shared = on_shared
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        elif self.on_shared is not None:
+            self.on_shared()
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class SharedStream:
+    """
+    One upstream stream of text deltas replayed to any number of subscribers. Each
+    subscriber gets every delta from the start, so it can join while the stream is
+    already running. The upstream is closed early only when every subscriber that
+    joined has left.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.ready = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Condition()
+        self._task = None
+
+    def start(self, open_fn, on_finished):
+        self._task = asyncio.ensure_future(self._run(open_fn))
+        self._task.add_done_callback(lambda task: on_finished())
+
+    async def _run(self, open_fn):
+        try:
+            deltas = await open_fn()
+        except asyncio.CancelledError:
+            self.ready.cancel()
+            raise
+        except Exception as e:
+            self.ready.set_exception(e)
+            # Retrieved by the waiting callers; avoids "exception was never retrieved" otherwise
+            self.ready.exception()
+            return
+        self.ready.set_result(None)
+        completed = False
+        try:
+            async for delta in deltas:
+                self.parts.append(delta)
+                async with self._changed:
+                    self._changed.notify_all()
+            completed = True
+        except Exception as e:
+            self.error = e
+        finally:
+            if not completed and self.error is None:
+                self.error = RuntimeError("Upstream stream was closed early")
+            self.done = True
+            await deltas.aclose()
+            async with self._changed:
+                self._changed.notify_all()
+
+    def join(self):
+        self.subscribers += 1
+
+    def leave(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done and self._task is not None:
+            logging.info("All listeners left, closing the upstream stream")
+            self._task.cancel()
+
+    async def deltas(self):
+        """Yields the deltas from the start; raises the upstream error if the stream failed midway."""
+        position = 0
+        while True:
+            while position < len(self.parts):
+                yield self.parts[position]
+                position += 1
+            if self.done:
+                break
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.done or len(self.parts) > position)
+        if self.error is not None:
+            raise self.error
+
+
+class StreamSingleFlight:
+    """
+    SingleFlight for streamed calls: requests with the same key share one upstream
+    stream for as long as it is running. `open_fn` must return an async iterator of
+    text deltas; errors raised while opening it reach every waiting caller.
+    """
+
+    def __init__(self, on_shared=None):
+        self._streams = {}
+        self.on_shared = on_shared
+
+    async def open(self, key, open_fn):
+        """
+        Returns:
+            SharedStream: The opened stream, joined on behalf of the caller, who must
+                call `leave()` when done with it.
+        """
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = self._streams[key] = SharedStream()
+            stream.start(open_fn, lambda: self._forget(key, stream))
+        elif self.on_shared is not None:
+            self.on_shared()
+        await asyncio.shield(stream.ready)
+        stream.join()
+        return stream
+
+    def _forget(self, key, stream):
+        if self._streams.get(key) is stream:
+            del self._streams[key]
+
+    def __len__(self):
+        return len(self._streams)
@@ -0,0 +1,173 @@
+import os
+import sys
+import weakref
+import logging
+
+# The retrieval package lives in Part2/ and the shared prompt registry in common/ at
+# the repo root; set up their paths here too, so this module imports on its own and
+# not only after main.py's path setup
+for _path in (
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..")),
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")),
+):
+    if _path not in sys.path:
+        sys.path.append(_path)
+from retrieval.text_utils import tokenize, estimate_tokens, truncate_to_tokens
+from common import PromptTemplate, register
+from chat_metrics import record_prompt_usage
+
+# A question opening with one of these words, or containing one of the references
+# below, leans on earlier turns, unless it names a service itself
+FOLLOW_UP_OPENERS = {
+    "and", "also", "same", "then", "ומה", "ואם", "ומי", "וכמה", "ובשביל", "ולגבי", "גם", "ואיך",
+}
+FOLLOW_UP_REFERENCES = {
+    "it", "that", "this", "those", "them", "there", "same", "זה", "זאת", "הזה", "הזאת", "אותו", "אותה", "שם",
+}
+# English names of knowledge base services (the knowledge base itself is in Hebrew,
+# so its own service names only cover Hebrew questions)
+SERVICE_TERMS_EN = {
+    "dental", "dentist", "teeth", "tooth", "filling", "fillings", "crown", "crowns", "implant", "implants",
+    "braces", "orthodontics", "orthodontic", "canal", "eye", "eyes", "vision", "glasses", "lenses", "contacts",
+    "optometry", "pregnancy", "pregnant", "birth", "prenatal", "ultrasound", "acupuncture", "homeopathy",
+    "chiropractic", "chiropractor", "reflexology", "shiatsu", "naturopathy", "smoking", "nutrition", "diet",
+    "dietitian", "diabetes", "stress", "workshop", "workshops", "exercise", "speech", "stuttering", "hearing",
+    "swallowing", "voice", "genetic", "cosmetic", "alternative", "complementary",
+}
+# Words of the Hebrew service names too generic to make a question self-contained
+GENERIC_SERVICE_WORDS = {
+    "טיפול", "טיפולי", "טיפולים", "בדיקות", "אבחון", "ניהול", "מיוחדים", "נכונה", "הפרעות", "בהפרעות", "מערכות",
+    "וטיפול", "בילדים", "רפואה",
+}
+# Hebrew prefixes ("in", "the", "and", "that", "to", "from", "like") glued to a word
+HEBREW_PREFIXES = "בהושלמכ"
+MIN_SERVICE_TERM_CHARS = 3
+REWRITE_MAX_TOKENS = 80
+# The rewrite prompt sees at most this much of the conversation memory
+REWRITE_TURNS = 3
+REWRITE_SUMMARY_TOKENS = 200
+REWRITE_PROMPT = register(PromptTemplate(
+    "rewrite",
+    1,
+    system=(
+        "You rewrite the user's last question into a standalone search query about Israeli health fund "
+        "services, using the earlier conversation to resolve references such as 'and for silver?' or 'how "
+        "much does it cost?'. Keep the language of the question. Output only the rewritten query."
+    ),
+    user="{conversation}\n\nLast question: {question}",
+))
+
+
+_service_terms = weakref.WeakKeyDictionary()
+
+
+def service_terms(snapshot):
+    """
+    Words naming a service in the snapshot's table records (services and topics),
+    plus the English service names; computed once per snapshot.
+    """
+    terms = _service_terms.get(snapshot)
+    if terms is None:
+        names = {
+            name
+            for record in snapshot.kb.values() if record["metadata"].get("type") == "table"
+            for name in (record["metadata"]["service"], record["metadata"]["topic"])
+        }
+        terms = frozenset(
+            word for name in names for word in tokenize(name, fold_finals=False)
+            if len(word) >= MIN_SERVICE_TERM_CHARS and word not in GENERIC_SERVICE_WORDS
+        ) | SERVICE_TERMS_EN
+        _service_terms[snapshot] = terms
+    return terms
+
+
+def _names_service(words, terms):
+    return any(
+        word in terms or (word[:1] in HEBREW_PREFIXES and word[1:] in terms)
+        for word in words
+    )
+
+
+def is_follow_up(question, terms=SERVICE_TERMS_EN):
+    """
+    Cheap check for a question that depends on earlier turns: it opens with a
+    follow-up word or refers back ("it", "זה", ...), and names no service of its own
+    (`terms`, e.g. from service_terms()). "And for silver?" is a follow-up; "is it
+    free for dental checkups?" is not, as it names what it asks about.
+    """
+    words = tokenize(question, fold_finals=False)
+    if not words:
+        return False
+    refers_back = words[0] in FOLLOW_UP_OPENERS or any(word in FOLLOW_UP_REFERENCES for word in words)
+    return refers_back and not _names_service(words, terms)
+
+
+def format_history(conversation_history, conversation_summary, answer_max_tokens):
+    """Renders the summary and recent turns as plain text for the rewrite prompt."""
+    lines = []
+    if conversation_summary:
+        lines.append(f"Earlier: {truncate_to_tokens(conversation_summary, REWRITE_SUMMARY_TOKENS)}")
+    for turn in conversation_history[-REWRITE_TURNS:]:
+        lines.append(f"User: {turn.get('user', '')}")
+        lines.append(f"Assistant: {truncate_to_tokens(turn.get('bot', ''), answer_max_tokens)}")
+    return "\n".join(lines)
+
+
+async def rewrite_follow_up(async_client, deployment, question, conversation_history, conversation_summary,
+                            answer_max_tokens):
+    """
+    Rewrites a follow-up into a standalone retrieval query with a short LLM call.
+    Falls back to prefixing the previous question if the call fails.
+
+    Returns:
+        str: The query to embed for retrieval.
+    """
+    history_text = format_history(conversation_history, conversation_summary, answer_max_tokens)
+    try:
+        response = await async_client.chat.completions.create(
+            model=deployment,
+            messages=REWRITE_PROMPT.messages(conversation=history_text, question=question),
+            temperature=0,
+            max_tokens=REWRITE_MAX_TOKENS,
+        )
+        record_prompt_usage(REWRITE_PROMPT, response)
+        rewritten = response.choices[0].message.content.strip()
+        if rewritten:
+            return rewritten
+    except Exception as e:
+        logging.warning(f"Follow-up rewrite failed, using the previous question as context: {e}")
+    previous = conversation_history[-1].get("user", "") if conversation_history else ""
+    return f"{previous} {question}".strip()
+
+
+def history_messages(conversation_history, conversation_summary, token_budget, answer_max_tokens):
+    """
+    Turns the client's conversation memory into chat messages that fit `token_budget`.
+
+    The newest turns are kept first (assistant answers cut to `answer_max_tokens`);
+    older turns and then the summary are dropped once the budget is used up.
+
+    Returns:
+        list: Messages to place between the system prompt and the current question.
+    """
+    turns = []
+    used = 0
+    for turn in reversed(conversation_history):
+        user_text = turn.get("user", "")
+        bot_text = truncate_to_tokens(turn.get("bot", ""), answer_max_tokens)
+        cost = estimate_tokens(user_text) + estimate_tokens(bot_text)
+        if used + cost > token_budget:
+            break
+        turns.insert(0, ({"role": "user", "content": user_text}, {"role": "assistant", "content": bot_text}))
+        used += cost
+
+    messages = []
+    header = "Summary of the earlier conversation:\n"
+    summary_budget = token_budget - used - estimate_tokens(header)
+    if conversation_summary and summary_budget > 0:
+        summary = truncate_to_tokens(conversation_summary, summary_budget)
+        if summary:
+            messages.append({"role": "system", "content": header + summary})
+    for user_message, assistant_message in turns:
+        messages.extend([user_message, assistant_message])
+    return messages
@@ -0,0 +1,79 @@
+import asyncio
+
+_END = object()
+
+
+async def _pump(open_fn, queue, opened):
+    """Opens one stream and moves its deltas into `queue`, ending with _END or the error."""
+    try:
+        deltas = await open_fn()
+    except Exception as e:
+        # The future is already cancelled if the merged stream was abandoned while opening
+        if not opened.done():
+            opened.set_exception(e)
+        return
+    if not opened.done():
+        opened.set_result(None)
+    try:
+        async for delta in deltas:
+            queue.put_nowait(delta)
+        queue.put_nowait(_END)
+    except Exception as e:
+        queue.put_nowait(e)
+    finally:
+        await deltas.aclose()
+
+
+async def open_sections(sections):
+    """
+    Opens several streams of text deltas concurrently and merges them into one
+    answer, section after section.
+
+    Every section streams from the start, but its deltas are relayed only once the
+    sections before it have finished; by then they are mostly buffered already, so
+    the merged answer takes about as long as its slowest section rather than the sum.
+    Errors raised while opening any section (e.g. admission 503s) are raised here,
+    after the sections that did open are closed again.
+
+    Args:
+        sections (list): (heading, open_fn) tuples; `open_fn` returns an async
+            iterator of text deltas and the heading is yielded before its section.
+
+    Returns:
+        An async generator of text deltas; closing it closes every section.
+    """
+    loop = asyncio.get_running_loop()
+    parts = []
+    for heading, open_fn in sections:
+        queue, opened = asyncio.Queue(), loop.create_future()
+        parts.append((heading, queue, asyncio.ensure_future(_pump(open_fn, queue, opened)), opened))
+
+    def close():
+        for _, _, task, _ in parts:
+            task.cancel()
+
+    try:
+        results = await asyncio.gather(*(opened for _, _, _, opened in parts), return_exceptions=True)
+    except BaseException:
+        close()
+        raise
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        close()
+        raise errors[0]
+
+    async def merged():
+        try:
+            for position, (heading, queue, _, _) in enumerate(parts):
+                yield f"\n\n{heading}\n\n" if position else f"{heading}\n\n"
+                while True:
+                    item = await queue.get()
+                    if item is _END:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    yield item
+        finally:
+            close()
+
+    return merged()
@@ -1,96 +1,685 @@
 # backend/main.py
 import os
+import sys
+import json
+import time
+import asyncio
+import itertools
 import uvicorn
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import FastAPI, Request, HTTPException
-from pydantic import BaseModel
-from openai import AzureOpenAI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from openai import RateLimitError
 from dotenv import load_dotenv
 import logging
-import config  # This file holds configuration constants such as the Azure OpenAI deployment name
+from admission import AdmissionLimiter
+
+# The retrieval package is shared with the frontend and lives in Part2/; the
+# Azure OpenAI rate limiter is shared with Part1 and lives in common/ at the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from retrieval import KnowledgeBaseIndexer, semantic_search_knowledge_base, get_embedding, get_embeddings, embedding_flight
+from retrieval import compare_plans, comparison_table, plan_context, plan_label
+from retrieval.text_utils import truncate_to_tokens, estimate_tokens
+from retrieval.kb_parser import HMO_NAMES
+from telemetry import Tracer, render_metrics, watch_event_loop_lag, TRACEPARENT_HEADER, configure_logging, clip
+from conversation import is_follow_up, rewrite_follow_up, history_messages, service_terms
+from coalescing import SingleFlight, StreamSingleFlight, chat_key
+from fan_out import open_sections
+from common import RateLimitedClient, RateLimitWaitTimeout, PRIORITY_CHAT, PRIORITY_BATCH, PromptTemplate, register, settings
+from common.clients import get_openai_client, get_async_openai_client, aclose_async_clients
+from chat_metrics import (
+    REQUEST_LATENCY, REQUESTS, STAGE_LATENCY, LLM_TOKENS, CHAT_ERRORS, COALESCED_CALLS, EVENT_LOOP_LAG,
+    record_prompt_usage,
+)
 
 # Load environment variables from a .env file
 load_dotenv()
-# Configure logging to include the timestamp, level, and message for debugging purposes
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+# Logging is formatted and written on a background thread; LOG_ENV=production switches
+# to INFO-level JSON lines (see telemetry/logs.py for the per-environment settings)
+configure_logging("backend")
+
+# Knowledge base settings. The index is built once per worker process; the exact
+# float32 vectors used for rescoring are memory-mapped from KB_CACHE_DIR.
+KB_DIR = os.getenv("KB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "phase2_data"))
+KB_CACHE_DIR = os.getenv("KB_CACHE_DIR", ".kb_cache")
+KB_POLL_INTERVAL = float(os.getenv("KB_POLL_INTERVAL", "2"))
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "int8")
+EMBEDDING_RESCORE = os.getenv("EMBEDDING_RESCORE", "1") == "1"
+ANN_MIN_RECORDS = int(os.getenv("ANN_MIN_RECORDS", "2000"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+# Largest top_k a /search caller may ask for
+SEARCH_MAX_TOP_K = 50
+# Conversation memory in the prompt: at most HISTORY_TOKEN_BUDGET estimated tokens of
+# summary + recent turns, each earlier answer cut to HISTORY_ANSWER_MAX_TOKENS
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+HISTORY_ANSWER_MAX_TOKENS = int(os.getenv("HISTORY_ANSWER_MAX_TOKENS", "150"))
+# Rewrite follow-up questions ("and for silver?") into standalone retrieval queries
+REWRITE_FOLLOW_UPS = os.getenv("REWRITE_FOLLOW_UPS", "1") == "1"
+# Estimated-token budget of the knowledge snippet in the prompt (0 = whole top-k paragraphs)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Identical chat requests in flight at the same time share one completion
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "1") == "1"
+# The user details put in the prompt: coverage depends on the plan and on age and
+# gender (e.g. age limits, pregnancy services). Identifiers (name, ID, card number)
+# are left out, so coalesced requests from different users can share an answer safely.
+PROMPT_USER_FIELDS = ("gender", "age", "hmo_name", "insurance_tier")
+# Ask for token usage at the end of streamed answers (needs API version 2024-09-01 or
+# later), so streamed prompt and cached-prompt tokens are measured, not estimated
+STREAM_INCLUDE_USAGE = os.getenv("STREAM_INCLUDE_USAGE", "1") == "1"
+# Comparison questions (compare_hmos / compare_tiers): "table" answers every plan with
+# one prompt over a plan-by-service table; "fanout" answers the plans with concurrent
+# calls of COMPARE_SECTION_MAX_TOKENS each and merges them. Both retrieve only once.
+COMPARE_MODE = os.getenv("COMPARE_MODE", "table")
+COMPARE_MAX_PLANS = int(os.getenv("COMPARE_MAX_PLANS", "9"))
+COMPARE_SECTION_MAX_TOKENS = int(os.getenv("COMPARE_SECTION_MAX_TOKENS", "300"))
+
+# LLM concurrency per worker: at most LLM_MAX_CONCURRENCY chat completions in flight,
+# LLM_MAX_QUEUED more may wait up to LLM_QUEUE_TIMEOUT seconds, the rest get a 503.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_QUEUED = int(os.getenv("LLM_MAX_QUEUED", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Longest wait for the deployment's rate-limit budget (AZURE_RATE_LIMITS) before a 429
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+
+# How often (seconds) the event loop's responsiveness is sampled for chat_event_loop_lag_seconds
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.1"))
+
+# Spans of every request are appended here as JSON lines (empty disables the export)
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", os.path.join(".traces", "backend.jsonl"))
+
+# Uvicorn settings. Reload is a dev convenience and cannot be combined with workers.
+BACKEND_HOST = os.getenv("BACKEND_HOST", "0.0.0.0")
+BACKEND_PORT = int(os.getenv("BACKEND_PORT", "8000"))
+BACKEND_WORKERS = int(os.getenv("BACKEND_WORKERS", "1"))
+BACKEND_RELOAD = os.getenv("BACKEND_RELOAD", "1") == "1" and BACKEND_WORKERS == 1
+
+# The chat prompt opens with the same static instructions for every user; the plan,
+# snippet, question and answer language all go into the last message. The static
+# prefix is only ~160 tokens, below the 1024 Azure needs before it caches a prefix,
+# so chat calls get no cached tokens today. Bump the version when changing the wording.
+CHAT_PROMPT = register(PromptTemplate(
+    "chat",
+    1,
+    system=(
+        "You are a helpful chatbot that answers questions about Israeli health funds (Maccabi, Meuhedet, and Clalit). "
+        "Your response should be based on the provided knowledge base, which includes general information shared across all health funds, "
+        "followed by a table with specific details for each health fund and their respective insurance tiers. "
+        "The file will also include contact numbers for each health fund. "
+        "Always provide an answer based solely on the user's selected health fund and their insurance tier, "
+        "as given in User Info, and answer in the language requested with the question."
+    ),
+    user="User Info: {plan}\nRelevant Info:\n{context}\n\nUser Question: {question}\nAnswer in {language}.",
+))
+# Comparison answers in table mode: all compared plans in one compact prompt
+COMPARE_PROMPT = register(PromptTemplate(
+    "chat.compare",
+    1,
+    system=(
+        "You are a helpful chatbot that compares the coverage of Israeli health fund plans (Maccabi, Meuhedet, and Clalit "
+        "with their Gold, Silver and Bronze tiers). You get general information shared across all health funds and a table "
+        "with one row per service and one column per compared plan; a '-' cell means the knowledge base has no entry. "
+        "Answer solely from this information: start with a short markdown table of the services relevant to the question, "
+        "then summarize the main differences between the plans in one to three sentences. "
+        "Answer in the language requested with the question."
+    ),
+    user="User Info: {user}\nCompared plans: {plans}\nGeneral Info:\n{context}\n\nCoverage by plan:\n{table}\n\nUser Question: {question}\nAnswer in {language}.",
+))
+
+@asynccontextmanager
+async def lifespan(app):
+    """Builds the knowledge base index once per worker and watches KB_DIR for changes."""
+    kb_indexer.refresh()
+    kb_indexer.start()
+    lag_monitor = asyncio.create_task(watch_event_loop_lag(EVENT_LOOP_LAG.observe, EVENT_LOOP_LAG_INTERVAL))
+    yield
+    lag_monitor.cancel()
+    kb_indexer.stop()
+    await aclose_async_clients()
 
 # Create a FastAPI app instance. This is our stateless microservice.
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+tracer = Tracer("backend", TRACE_EXPORT_PATH)
+
+@contextmanager
+def stage(name, **attributes):
+    """Traces one stage of a request and records its duration in the stage histogram."""
+    with tracer.span(name, **attributes) as span:
+        yield span
+    STAGE_LATENCY.observe(span.duration, stage=name)
 
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+# Every request runs in a span that continues the caller's trace (W3C traceparent
+# header); the trace id is returned in X-Trace-Id.
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    start = time.perf_counter()
+    with tracer.span(f"{request.method} {request.url.path}", traceparent=request.headers.get(TRACEPARENT_HEADER)) as span:
+        response = await call_next(request)
+        span.set(status=response.status_code)
+    # Label by route template so unknown paths do not create new series
+    route = request.scope.get("route")
+    endpoint = route.path if route is not None else "other"
+    REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, method=request.method)
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    response.headers["X-Trace-Id"] = span.trace_id
+    return response
+
+# Azure OpenAI clients are the process-wide pooled clients from common.clients, created
+# on first use. Every call first waits for budget on the deployment's rate limiter:
+# question embeddings and chat run at chat priority, re-indexing the knowledge base
+# at batch priority.
+client = RateLimitedClient(get_openai_client, PRIORITY_CHAT, estimate_tokens, RATE_LIMIT_MAX_WAIT)
+indexing_client = RateLimitedClient(get_openai_client, PRIORITY_BATCH, estimate_tokens)
+# Async client for chat completions, so an in-flight LLM call does not block the
+# event loop. Its connection pool is sized to the admission limit.
+async_client = RateLimitedClient(
+    lambda: get_async_openai_client(
+        max_connections=LLM_MAX_CONCURRENCY, timeout=LLM_TIMEOUT, max_retries=LLM_MAX_RETRIES
+    ),
+    PRIORITY_CHAT,
+    estimate_tokens,
+    RATE_LIMIT_MAX_WAIT,
 )
+llm_admission = AdmissionLimiter(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUED, LLM_QUEUE_TIMEOUT)
+chat_flight = SingleFlight(on_shared=lambda: COALESCED_CALLS.inc(call="chat"))
+stream_flight = StreamSingleFlight(on_shared=lambda: COALESCED_CALLS.inc(call="chat_stream"))
+embedding_flight.on_shared = lambda: COALESCED_CALLS.inc(call="embedding")
 # Define the data model for the chat request payload using Pydantic.
 class ChatRequest(BaseModel):
     user_info: dict
     question: str
     language: str  # 'he' or 'en'
-    context: str = ""  # knowledge base snippet
-    conversation_history: list = []
+    context: str = ""  # knowledge base snippet; retrieved by the backend when empty
+    conversation_history: list = []  # recent turns: [{"user": ..., "bot": ...}]
+    conversation_summary: str = ""  # rolling summary of older turns, kept by the client
+    # Comparison mode: funds and/or tiers to compare with the user's own plan
+    compare_hmos: list = []
+    compare_tiers: list = []
+
+# Define the data model for the search request payload.
+class SearchRequest(BaseModel):
+    query: str
+    user_info: dict = {}
+    top_k: int = Field(RETRIEVAL_TOP_K, ge=1, le=SEARCH_MAX_TOP_K)
+
+kb_indexer = KnowledgeBaseIndexer(
+    KB_DIR,
+    lambda texts: get_embeddings(indexing_client, texts),
+    poll_interval=KB_POLL_INTERVAL,
+    storage_dtype=EMBEDDING_STORAGE_DTYPE,
+    rescore=EMBEDDING_RESCORE,
+    cache_dir=KB_CACHE_DIR,
+    ann_min_records=ANN_MIN_RECORDS,
+    ann_nprobe=ANN_NPROBE,
+)
+
+# Answer when retrieval finds nothing for the user's plan; GPT is not called, so it
+# cannot answer from general knowledge instead of the knowledge base
+NO_INFORMATION_ANSWERS = {
+    "en": "Sorry, I couldn't find relevant information in the knowledge base.",
+    "he": "מצטערים, לא מצאתי מידע רלוונטי במאגר הידע.",
+}
+
+class NoKnowledgeFound(Exception):
+    """Raised when retrieval returns no context for the question."""
+
+def no_information_answer(language):
+    return NO_INFORMATION_ANSWERS.get(language, NO_INFORMATION_ANSWERS["en"])
+
+def embed_question(question):
+    """The question's embedding; a 503 if it could not be embedded (API error or rate-limit wait timeout)."""
+    with stage("embedding"):
+        query_embedding = get_embedding(client, question)
+    if query_embedding is None:
+        raise HTTPException(status_code=503, detail="The knowledge base search is temporarily unavailable")
+    return query_embedding
+
+def retrieve_context(question, user_info, top_k=RETRIEVAL_TOP_K):
+    """Embeds the question and returns (snippet, sources, kb_version) for the user's plan."""
+    snapshot = kb_indexer.snapshot
+    query_embedding = embed_question(question)
+    with stage("search", kb_version=snapshot.version) as span:
+        snippet, sources = semantic_search_knowledge_base(
+            query_embedding,
+            snapshot,
+            top_k=top_k,
+            hmo_name=user_info.get("hmo_name"),
+            insurance_tier=user_info.get("insurance_tier"),
+            rescore=EMBEDDING_RESCORE,
+            query=question,
+            token_budget=CONTEXT_TOKEN_BUDGET,
+        )
+        span.set(sources=len(sources))
+    return snippet, sources, snapshot.version
+
+def retrieve_comparison(question, plans, top_k=RETRIEVAL_TOP_K):
+    """Embeds the question once and returns (compare_plans result, kb_version) for every plan."""
+    snapshot = kb_indexer.snapshot
+    query_embedding = embed_question(question)
+    with stage("search", kb_version=snapshot.version, plans=len(plans)) as span:
+        result = compare_plans(
+            query_embedding,
+            snapshot,
+            plans,
+            top_k=top_k,
+            rescore=EMBEDDING_RESCORE,
+            query=question,
+            token_budget=CONTEXT_TOKEN_BUDGET,
+        )
+        span.set(sources=len(result["sources"]), services=len(result["services"]))
+    return result, snapshot.version
 
 # Health-check endpoint to verify that the service is running.
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
+    return {"status": "ok", "knowledge_base": kb_indexer.status()}
 
-# Chat endpoint to process user queries.
-@app.post("/chat")
-async def chat(payload: ChatRequest):
-    logging.info(f"Received chat request: {payload.question[:500]}...")
-    logging.debug(f"Received knowledge snippet:\n{payload.context}")
-    logging.debug(f"conversation_history: {payload.conversation_history}")
+# Prometheus scrape endpoint: request/stage latency histograms, token and error counters.
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+# Search endpoint: returns the knowledge base snippet for a query and the user's plan.
+@app.post("/search")
+def search(payload: SearchRequest):
+    snippet, sources, kb_version = retrieve_context(payload.query, payload.user_info, payload.top_k)
+    return {"context": snippet, "sources": sources, "kb_version": kb_version}
+
+async def retrieval_query(payload: ChatRequest):
+    """The question to search with: follow-ups are rewritten into standalone questions."""
+    query = payload.question
+    if (
+        REWRITE_FOLLOW_UPS
+        and payload.conversation_history
+        and is_follow_up(payload.question, service_terms(kb_indexer.snapshot))
+    ):
+        async with llm_admission:
+            with stage("rewrite"):
+                query = await rewrite_follow_up(
+                    async_client,
+                    settings.AZURE_OPENAI_DEPLOYMENT,
+                    payload.question,
+                    payload.conversation_history,
+                    payload.conversation_summary,
+                    HISTORY_ANSWER_MAX_TOKENS,
+                )
+        logging.debug("Rewrote follow-up as: %s", clip(query))
+    return query
 
-    # Warn if no context (knowledge snippet) was provided
+async def prepare_chat(payload: ChatRequest):
+    """Fills in the knowledge snippet if needed and builds the messages sent to GPT."""
+    logging.info("Received chat request: %s", clip(payload.question))
+    logging.debug("Received knowledge snippet: %s", clip(payload.context))
+    logging.debug("Conversation history: %d turns", len(payload.conversation_history))
+
+    # Retrieve the knowledge snippet here unless the client already sent one
     if not payload.context or payload.context.strip() == "":
-        logging.warning("Warning: No knowledge snippet received!")
+        query = await retrieval_query(payload)
+        payload.context, sources, kb_version = await run_in_threadpool(
+            retrieve_context, query, payload.user_info
+        )
+        logging.debug("Retrieved sources from KB v%s: %s", kb_version, clip(sources))
+        if not payload.context:
+            logging.warning("No knowledge snippet found; answering without GPT")
+            raise NoKnowledgeFound()
+    elif CONTEXT_TOKEN_BUDGET:
+        # A snippet sent by the client is held to the same budget
+        payload.context = truncate_to_tokens(payload.context, CONTEXT_TOKEN_BUDGET)
 
-    # Build prompt
-    system_prompt = (
-        "You are a helpful chatbot that answers questions about Israeli health funds (Maccabi, Meuhedet, and Clalit). "
-        "Your response should be based on the provided knowledge base, which includes general information shared across all health funds, "
-        "followed by a table with specific details for each health fund and their respective insurance tiers. "
-        "The file will also include contact numbers for each health fund. "
-        f"Always provide an answer based solely on the user's selected health fund ({payload.user_info.get('hmo_name', '')}), "
-        f"and their insurance tier ({payload.user_info.get('insurance_tier', '')}). "
-        f"Answer in {'English' if payload.language == 'en' else 'Hebrew'}."
+    with stage("prompt_build") as span:
+        messages = build_messages(payload)
+        span.set(prompt_tokens_estimate=sum(estimate_tokens(m["content"]) for m in messages))
+    logging.debug("Prompt: %d messages", len(messages), extra={"prompt_tokens_estimate": span.attributes["prompt_tokens_estimate"]})
+    return messages
+
+def prompt_history(payload: ChatRequest):
+    # The backend stays stateless: the client sends its own bounded memory (rolling
+    # summary + last few turns), which is held to HISTORY_TOKEN_BUDGET here.
+    return history_messages(
+        payload.conversation_history,
+        payload.conversation_summary,
+        HISTORY_TOKEN_BUDGET,
+        HISTORY_ANSWER_MAX_TOKENS,
+    )
+
+def build_messages(payload: ChatRequest):
+    """Builds the messages sent to GPT: system prompt, conversation memory, snippet + question."""
+    plan = {field: payload.user_info.get(field, "") for field in PROMPT_USER_FIELDS}
+    return CHAT_PROMPT.messages(
+        history=prompt_history(payload),
+        plan=plan,
+        context=payload.context,
+        question=payload.question,
+        language="English" if payload.language == "en" else "Hebrew",
     )
 
-    messages = [{"role": "system", "content": system_prompt}]
+def _compared_values(own, requested, other_requested):
+    """The values of one plan dimension (funds or tiers) that a comparison covers."""
+    if len(requested) == 1 and len(other_requested) > 1:
+        # "Maccabi gold vs silver": a single fund next to several tiers (or the
+        # reverse) qualifies the question and replaces the user's own value
+        return requested
+    return [value for value in dict.fromkeys([own, *requested]) if value] or [own]
+
+def comparison_plans(payload: ChatRequest):
+    """
+    The (hmo_name, insurance_tier) plans a comparison request covers: every
+    combination of the requested funds / tiers, together with the user's own fund
+    and tier. Empty when the request is not a comparison (or names only one plan).
+    """
+    if not payload.compare_hmos and not payload.compare_tiers:
+        return []
+    plans = list(itertools.product(
+        _compared_values(payload.user_info.get("hmo_name"), payload.compare_hmos, payload.compare_tiers),
+        _compared_values(payload.user_info.get("insurance_tier"), payload.compare_tiers, payload.compare_hmos),
+    ))
+    if len(plans) > COMPARE_MAX_PLANS:
+        raise HTTPException(status_code=422, detail=f"At most {COMPARE_MAX_PLANS} plans can be compared")
+    return plans if len(plans) > 1 else []
+
+async def prepare_comparison(payload: ChatRequest, plans):
+    """
+    Retrieves once for all compared plans and builds the calls of the answer.
+
+    Returns:
+        tuple: (prompt template, list of (heading, messages)); a single call with
+            heading None in table mode, one call per plan in fanout mode.
+    """
+    logging.info("Received comparison request for %d plans: %s", len(plans), clip(payload.question))
+    # A snippet sent by the client is for the user's plan only, so it is not used here
+    query = await retrieval_query(payload)
+    result, kb_version = await run_in_threadpool(retrieve_comparison, query, plans)
+    logging.debug("Retrieved sources from KB v%s: %s", kb_version, clip(result["sources"]))
+    if not result["shared"] and not result["services"]:
+        logging.warning("No knowledge found for the compared plans; answering without GPT")
+        raise NoKnowledgeFound()
+    language = "English" if payload.language == "en" else "Hebrew"
+
+    with stage("prompt_build", plans=len(plans)) as span:
+        history = prompt_history(payload)
+        if COMPARE_MODE == "fanout":
+            prompt, sections = CHAT_PROMPT, []
+            for hmo_name, insurance_tier in plans:
+                label = plan_label(hmo_name, insurance_tier)
+                # Every section uses the regular chat prompt with this plan's slice of the context
+                sections.append((f"**{label}**", CHAT_PROMPT.messages(
+                    history=history,
+                    plan={
+                        **{field: payload.user_info.get(field, "") for field in PROMPT_USER_FIELDS},
+                        "hmo_name": hmo_name or "",
+                        "insurance_tier": insurance_tier or "",
+                    },
+                    context=plan_context(result, (hmo_name, insurance_tier)),
+                    question=f"{payload.question} (answer for {label} only)",
+                    language=language,
+                )))
+        else:
+            prompt = COMPARE_PROMPT
+            sections = [(None, COMPARE_PROMPT.messages(
+                history=history,
+                user={field: payload.user_info.get(field, "") for field in ("gender", "age")},
+                plans=", ".join(plan_label(*plan) for plan in plans),
+                context=result["shared"],
+                table=comparison_table(result),
+                question=payload.question,
+                language=language,
+            ))]
+        # Coalescing hashes the context; this covers the plans and every slice of the answer
+        payload.context = "\n\n".join([result["shared"], comparison_table(result)])
+        span.set(prompt_tokens_estimate=sum(estimate_tokens(m["content"]) for _, messages in sections for m in messages))
+    return prompt, sections
 
-    # Note: The conversation history is not added to the prompt to ensure statelessness
-    # and that each answer is based solely on the current query and provided context.
+def hmo_label(user_info):
+    """The health fund metric label: a known fund or "other", so client input cannot grow the label set."""
+    hmo_name = user_info.get("hmo_name")
+    return hmo_name if hmo_name in HMO_NAMES else "other"
 
-    logging.debug(f"Final messages sent to GPT:\n{messages}")
+def openai_error_to_http(e):
+    """Maps an error from the OpenAI client to the HTTPException returned to the caller."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, RateLimitError):
+        # Azure is throttling us; pass the back-off hint on to the client.
+        retry_after = e.response.headers.get("retry-after", "1") if e.response is not None else "1"
+        logging.warning(f"OpenAI rate limit hit, retry after {retry_after}s")
+        return HTTPException(status_code=429, detail="Rate limited, please retry", headers={"Retry-After": retry_after})
+    if isinstance(e, RateLimitWaitTimeout):
+        # Our own limiter found no budget in time; the call was never sent
+        logging.warning(f"{e}")
+        retry_after = str(max(1, round(e.retry_after)))
+        return HTTPException(status_code=429, detail="Rate limited, please retry", headers={"Retry-After": retry_after})
+    # Log any errors and return an HTTP 500 error to the client.
+    logging.error(f"Error calling OpenAI: {e}")
+    return HTTPException(status_code=500, detail="Failed to generate response")
 
-    # Add the context + last user question as a "user" role message
-    # (this ensures the model sees the snippet + user question up front)
-    context_message = (
-        f"User Info: {payload.user_info}\n"
-        f"Relevant Info:\n{payload.context}\n\n"
-        f"User Question: {payload.question}"
+def sse_event(data, event=None):
+    """Formats one server-sent event with a JSON payload."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def coalescing_key(payload: ChatRequest, prompt_version=CHAT_PROMPT.version_id):
+    """Key shared by identical requests, or a unique one when coalescing is off."""
+    if not COALESCE_REQUESTS:
+        return object()
+    return chat_key(
+        payload.question,
+        payload.user_info,
+        payload.language,
+        payload.context,
+        payload.conversation_history,
+        payload.conversation_summary,
+        prompt_version,
     )
-    messages.append({"role": "user", "content": context_message})
 
+def record_usage(response, prompt=CHAT_PROMPT, span=None):
+    """Counts the prompt / completion tokens Azure reported for a chat call; False if it reported none."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return False
+    LLM_TOKENS.inc(usage.prompt_tokens, kind="prompt", source="usage")
+    LLM_TOKENS.inc(usage.completion_tokens, kind="completion", source="usage")
+    _, cached_tokens = record_prompt_usage(prompt, response)
+    if span is not None:
+        span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens, cached_tokens=cached_tokens)
+    return True
+
+async def complete_chat(messages, prompt=CHAT_PROMPT, max_tokens=800):
+    """Sends the messages to the Azure OpenAI chat completions API and returns the answer text."""
+    async with llm_admission:
+        with stage("llm") as span:
+            response = await async_client.chat.completions.create(
+                model=settings.AZURE_OPENAI_DEPLOYMENT,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=max_tokens,
+            )
+            record_usage(response, prompt, span)
+    # Extract the answer text from the response.
+    return response.choices[0].message.content.strip()
+
+async def open_chat_stream(messages, prompt=CHAT_PROMPT, max_tokens=800):
+    """
+    Starts a streamed completion (after admission, so overload and rate limits surface
+    as 503/429 before any response is sent).
+
+    Returns:
+        An async generator of answer text deltas; it releases the admission slot when closed.
+    """
+    await llm_admission.acquire()
     try:
-        # Send the messages to the Azure OpenAI chat completions API.
-        response = client.chat.completions.create(
-            model=config.AZURE_OPENAI_DEPLOYMENT,
-            messages=messages,
-            temperature=0.3,
-            max_tokens=800,
-        )
-        # Extract the answer text from the response.
-        answer_text = response.choices[0].message.content.strip()
+        # The "llm" stage here is the time until the first streamed response
+        with stage("llm", stream=True):
+            stream = await async_client.chat.completions.create(
+                model=settings.AZURE_OPENAI_DEPLOYMENT,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=max_tokens,
+                stream=True,
+                **({"stream_options": {"include_usage": True}} if STREAM_INCLUDE_USAGE else {}),
+            )
+    except BaseException:
+        # Also on cancellation (client disconnect, a fan-out closed while opening), or the
+        # slot would never be released; from here on the generator below owns it
+        llm_admission.release()
+        raise
+
+    async def deltas():
+        parts = []
+        started = time.perf_counter()
+        reported = False
+        try:
+            async for chunk in stream:
+                # With include_usage the last chunk carries the usage and no choices
+                if getattr(chunk, "usage", None) is not None:
+                    reported = record_usage(chunk, prompt)
+                # Azure may send chunks without choices (e.g. content filter results)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+            STAGE_LATENCY.observe(time.perf_counter() - started, stage="llm_stream")
+            if not reported:
+                # No usage in the stream (older API versions), so tokens are estimated locally
+                LLM_TOKENS.inc(sum(estimate_tokens(m["content"]) for m in messages), kind="prompt", source="estimated")
+                LLM_TOKENS.inc(estimate_tokens("".join(parts)), kind="completion", source="estimated")
+        finally:
+            llm_admission.release()
+            await stream.close()
+
+    return deltas()
+
+async def complete_sections(sections, prompt):
+    """Answers the calls of a comparison concurrently and joins the sections in order."""
+    if len(sections) == 1 and sections[0][0] is None:
+        return await complete_chat(sections[0][1], prompt)
+    answers = await asyncio.gather(*(
+        complete_chat(messages, prompt, COMPARE_SECTION_MAX_TOKENS) for _, messages in sections
+    ))
+    return "\n\n".join(f"{heading}\n\n{answer}" for (heading, _), answer in zip(sections, answers))
+
+async def open_sections_stream(sections, prompt):
+    """Streams the calls of a comparison concurrently, merged into one answer in order."""
+    if len(sections) == 1 and sections[0][0] is None:
+        return await open_chat_stream(sections[0][1], prompt)
+    return await open_sections([
+        (heading, lambda messages=messages: open_chat_stream(messages, prompt, COMPARE_SECTION_MAX_TOKENS))
+        for heading, messages in sections
+    ])
+
+# Chat endpoint to process user queries.
+@app.post("/chat")
+async def chat(payload: ChatRequest):
+    try:
+        plans = comparison_plans(payload)
+        if plans:
+            prompt, sections = await prepare_comparison(payload, plans)
+            answer_text = await chat_flight.do(
+                coalescing_key(payload, f"{prompt.version_id}/{COMPARE_MODE}"),
+                lambda: complete_sections(sections, prompt),
+            )
+            logging.info("Generated comparison response")
+            return {
+                "answer": answer_text,
+                "prompt_version": prompt.version_id,
+                "compared": [plan_label(*plan) for plan in plans],
+            }
+        messages = await prepare_chat(payload)
+        # Concurrent identical questions (same plan, language and context) share one completion
+        answer_text = await chat_flight.do(coalescing_key(payload), lambda: complete_chat(messages))
         logging.info("Generated response")
-        return {"answer": answer_text}
+        return {"answer": answer_text, "prompt_version": CHAT_PROMPT.version_id}
 
+    except NoKnowledgeFound:
+        return {"answer": no_information_answer(payload.language), "prompt_version": None, "no_information": True}
     except Exception as e:
-        # Log any errors and return an HTTP 500 error to the client.
-        logging.error(f"Error calling OpenAI: {e}")
-        raise HTTPException(status_code=500, detail="Failed to generate response")
+        error = openai_error_to_http(e)
+        CHAT_ERRORS.inc(hmo=hmo_label(payload.user_info), reason=error.status_code)
+        raise error
+
+# Streaming variant of /chat: relays completion tokens as server-sent events.
+# Each token arrives as `data: {"delta": ...}`; the stream ends with an `event: done`
+# carrying the full answer, or an `event: error`. Comparison answers stream their
+# per-plan sections one after the other (fanout mode) or the one table answer.
+@app.post("/chat/stream")
+async def chat_stream(payload: ChatRequest):
+    hmo = hmo_label(payload.user_info)
+    done = {"prompt_version": CHAT_PROMPT.version_id}
+    try:
+        plans = comparison_plans(payload)
+        if plans:
+            prompt, sections = await prepare_comparison(payload, plans)
+            done = {"prompt_version": prompt.version_id, "compared": [plan_label(*plan) for plan in plans]}
+            key = coalescing_key(payload, f"{prompt.version_id}/{COMPARE_MODE}")
+
+            def open_fn():
+                return open_sections_stream(sections, prompt)
+        else:
+            messages = await prepare_chat(payload)
+            key = coalescing_key(payload)
+
+            def open_fn():
+                return open_chat_stream(messages)
+        # Identical questions in flight share one upstream stream; each response
+        # replays it from the first token
+        shared = await stream_flight.open(key, open_fn)
+    except NoKnowledgeFound:
+        answer = no_information_answer(payload.language)
+        return StreamingResponse(
+            iter([
+                sse_event({"delta": answer}),
+                sse_event({"answer": answer, "prompt_version": None, "no_information": True}, event="done"),
+            ]),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    except Exception as e:
+        error = openai_error_to_http(e)
+        CHAT_ERRORS.inc(hmo=hmo, reason=error.status_code)
+        raise error
+
+    left = False
+
+    async def leave_stream():
+        # Runs from the generator's finally or, if streaming never started, as a background task
+        nonlocal left
+        if not left:
+            left = True
+            shared.leave()
+
+    async def event_stream():
+        parts = []
+        try:
+            async for delta in shared.deltas():
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+            logging.info("Generated streamed response")
+            yield sse_event({"answer": "".join(parts).strip(), **done}, event="done")
+        except Exception as e:
+            logging.error(f"Error while streaming from OpenAI: {e}")
+            CHAT_ERRORS.inc(hmo=hmo, reason="stream")
+            yield sse_event({"detail": "Failed to generate response"}, event="error")
+        finally:
+            await leave_stream()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(leave_stream),
+    )
 
 # Run the application using Uvicorn if this file is executed directly.
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(
+        "main:app",
+        host=BACKEND_HOST,
+        port=BACKEND_PORT,
+        reload=BACKEND_RELOAD,
+        workers=BACKEND_WORKERS,
+    )
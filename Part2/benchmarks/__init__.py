@@ -0,0 +1,5 @@
+"""
+Offline benchmarks for Part2, run from the Part2 directory:
+`python -m benchmarks.retrieval_benchmark` measures retrieval quality and latency
+against a saved baseline.
+"""
@@ -0,0 +1,387 @@
+"""
+Load generator for the chat backend. It replays realistic /chat (or /chat/stream)
+payloads, built from the labeled benchmark questions with their users' health
+fund and tier, at open-loop Poisson arrival rates, one step per rate:
+
+    python -m benchmarks.load_test --start-stack --rates 5,10,20,40 --duration 20
+    python -m benchmarks.load_test --url http://localhost:8000 --rates 10 --stream
+
+With --start-stack it first starts the local Azure OpenAI stand-in
+(common.mock_azure) with the given --llm-* latency and error distribution, and a
+backend pointed at it, each in its own process, so the numbers show the backend's
+own limits rather than the Azure quota's.
+
+For every step it reports throughput, latency percentiles (and time to first
+token when streaming), errors by status and event-loop lag. The lag is sampled
+both in the generator, which must stay near zero for the numbers to be
+trustworthy, and in the backend (chat_event_loop_lag_seconds from /metrics; with
+several workers that is one worker's view).
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import logging
+import tempfile
+import subprocess
+from collections import Counter
+
+import httpx
+import numpy as np
+
+from retrieval.kb_parser import load_knowledge_base_dir
+from telemetry import watch_event_loop_lag
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(BENCHMARK_DIR, "..", "backend")
+REPO_ROOT = os.path.join(BENCHMARK_DIR, "..", "..")
+KB_DIR = os.path.join(BENCHMARK_DIR, "..", "frontend", "phase2_data")
+QUESTIONS_FILE = os.path.join(BENCHMARK_DIR, "retrieval_questions.json")
+
+LAG_METRIC = "chat_event_loop_lag_seconds"
+LAG_SAMPLE_INTERVAL = 0.05
+STACK_START_TIMEOUT = 120
+# A step counts as saturated when it falls this far behind the offered rate
+SATURATION_THROUGHPUT_RATIO = 0.9
+SATURATION_ERROR_RATE = 0.01
+
+
+def build_payloads(options):
+    """
+    /chat payloads from the benchmark questions. With --context inline each carries
+    its expected records as the knowledge snippet (the frontend's local mode);
+    otherwise the context is empty and the backend retrieves it.
+    """
+    with open(QUESTIONS_FILE, encoding="utf-8") as f:
+        questions = json.load(f)
+    kb = load_knowledge_base_dir(KB_DIR) if options.context == "inline" else {}
+    payloads = []
+    for i, question in enumerate(questions):
+        earlier = questions[i - options.history_turns:i] if options.history_turns else []
+        payloads.append({
+            "user_info": {
+                "first_name": "Load",
+                "last_name": "Test",
+                "hmo_name": question["hmo_name"],
+                "insurance_tier": question["insurance_tier"],
+            },
+            "question": question["question"],
+            "language": question["language"],
+            "context": "\n\n".join(kb[key]["text"] for key in question["expected"]) if kb else "",
+            "conversation_history": [
+                {"user": turn["question"], "bot": "Here is what your plan covers for that service."}
+                for turn in earlier
+            ],
+            "conversation_summary": "",
+        })
+    return payloads
+
+
+async def send(client, payload, options):
+    """
+    Sends one request.
+
+    Returns:
+        tuple: (status, latency in seconds, time to first token or None, completion
+            time). `status` is the HTTP status, or "timeout" / "connection" / "stream_error".
+    """
+    start = time.perf_counter()
+    first_token = None
+    try:
+        if options.stream:
+            async with client.stream("POST", "/chat/stream", json=payload) as response:
+                status = response.status_code
+                if status == 200:
+                    async for line in response.aiter_lines():
+                        if first_token is None and line.startswith("data:"):
+                            first_token = time.perf_counter() - start
+                        elif line.startswith("event: error"):
+                            status = "stream_error"
+                else:
+                    await response.aread()
+        else:
+            response = await client.post("/chat", json=payload)
+            status = response.status_code
+    except httpx.TimeoutException:
+        status = "timeout"
+    except httpx.HTTPError:
+        status = "connection"
+    done = time.perf_counter()
+    return status, done - start, first_token, done
+
+
+def parse_histogram(text, name):
+    """Cumulative bucket counts {le: count} of an unlabeled histogram in Prometheus text."""
+    buckets = {}
+    prefix = f'{name}_bucket{{le="'
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            bound, _, value = line[len(prefix):].partition('"} ')
+            buckets[float(bound)] = float(value)
+    return buckets
+
+
+def histogram_quantile_ms(before, after, q):
+    """
+    Upper bucket bound (ms) of quantile `q` of the observations made between two
+    scrapes; ">N" when it lies above the largest bucket.
+    """
+    bounds = sorted(after)
+    total = after.get(float("inf"), 0) - before.get(float("inf"), 0)
+    if not total:
+        return None
+    for bound in bounds:
+        if after[bound] - before.get(bound, 0) >= q * total:
+            return round(bound * 1000, 1) if bound != float("inf") else f">{bounds[-2] * 1000:g}"
+    return None
+
+
+async def scrape_lag(client):
+    try:
+        response = await client.get("/metrics")
+        return parse_histogram(response.text, LAG_METRIC)
+    except httpx.HTTPError:
+        return {}
+
+
+async def run_step(client, rate, payloads, options, seed):
+    """Offers `rate` requests per second for `options.duration` seconds and waits for all of them."""
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    client_lags = []
+    lag_watcher = asyncio.create_task(watch_event_loop_lag(client_lags.append, LAG_SAMPLE_INTERVAL))
+    lag_before = await scrape_lag(client)
+
+    tasks = []
+    dropped = 0
+    start = loop.time()
+    started = time.perf_counter()
+    next_at = start
+    while True:
+        next_at += rng.expovariate(rate)
+        if next_at - start >= options.duration:
+            break
+        await asyncio.sleep(max(0.0, next_at - loop.time()))
+        if sum(1 for task in tasks if not task.done()) >= options.max_in_flight:
+            dropped += 1
+            continue
+        payload = dict(rng.choice(payloads))
+        if options.unique:
+            # Defeats request coalescing, as if every user asked something different
+            payload["question"] = f"{payload['question']} ({len(tasks)})"
+        tasks.append(asyncio.create_task(send(client, payload, options)))
+    results = await asyncio.gather(*tasks)
+    elapsed = loop.time() - start
+
+    lag_watcher.cancel()
+    lag_after = await scrape_lag(client)
+    latencies = [latency for status, latency, _, _ in results if status == 200]
+    first_tokens = [ttft for status, _, ttft, _ in results if status == 200 and ttft is not None]
+    statuses = Counter(str(status) for status, _, _, _ in results)
+    errors = {status: count for status, count in statuses.items() if status != "200"}
+    # Successful completions per second while requests were arriving, leaving out the
+    # warm-up before answers start coming back (the median latency) and the drain
+    # after the last arrival; in steady state this matches the offered rate
+    done = [finished - started for status, _, _, finished in results if status == 200]
+    warm_up = float(np.median(latencies)) if latencies else 0.0
+    if warm_up < options.duration:
+        throughput = sum(1 for t in done if warm_up <= t <= options.duration) / (options.duration - warm_up)
+    else:
+        throughput = len(done) / elapsed
+    return {
+        "offered_rate": rate,
+        "sent": len(results),
+        "dropped": dropped,
+        "ok": len(done),
+        "throughput": round(throughput, 2),
+        "error_rate": round(sum(errors.values()) / len(results), 4) if results else 0.0,
+        "errors": errors,
+        "latency_ms": percentiles_ms(latencies),
+        "first_token_ms": percentiles_ms(first_tokens) if options.stream else None,
+        "client_loop_lag_ms": percentiles_ms(client_lags),
+        "backend_loop_lag_ms": {
+            "p50": histogram_quantile_ms(lag_before, lag_after, 0.5),
+            "p99": histogram_quantile_ms(lag_before, lag_after, 0.99),
+        } if lag_after else None,
+    }
+
+
+def percentiles_ms(values):
+    if not values:
+        return {"p50": None, "p90": None, "p99": None, "max": None}
+    values = np.asarray(values) * 1000
+    return {
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p90": round(float(np.percentile(values, 90)), 1),
+        "p99": round(float(np.percentile(values, 99)), 1),
+        "max": round(float(values.max()), 1),
+    }
+
+
+def is_saturated(step, slo_p99_ms):
+    p99 = step["latency_ms"]["p99"]
+    return (
+        step["throughput"] < SATURATION_THROUGHPUT_RATIO * step["offered_rate"]
+        or step["error_rate"] > SATURATION_ERROR_RATE
+        or step["dropped"] > 0
+        or (p99 is not None and p99 > slo_p99_ms)
+    )
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_stack(options, workdir):
+    """
+    Starts the Azure OpenAI stand-in and a backend pointed at it.
+
+    Returns:
+        tuple: (backend URL, list of the started processes)
+    """
+    stub_port, backend_port = _free_port(), _free_port()
+    log = open(os.path.join(workdir, "stack.log"), "w")
+    stub = subprocess.Popen(
+        [
+            sys.executable, "-m", "common.mock_azure", "--port", str(stub_port),
+            "--latency", str(options.llm_latency), "--latency-sigma", str(options.llm_latency_sigma),
+            "--embedding-latency", str(options.llm_embedding_latency),
+            "--error-rate", str(options.llm_error_rate), "--throttle-rate", str(options.llm_throttle_rate),
+        ],
+        cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT,
+    )
+    env = dict(
+        os.environ,
+        AZURE_OPENAI_ENDPOINT=f"http://127.0.0.1:{stub_port}",
+        AZURE_OPENAI_API_KEY="load-test",
+        AZURE_OPENAI_API_VERSION="2024-10-21",
+        AZURE_OPENAI_DEPLOYMENT="load-test-chat",
+        AZURE_EMBEDDING_DEPLOYMENT="load-test-embedding",
+        AZURE_RATE_LIMITS="",
+        BACKEND_HOST="127.0.0.1",
+        BACKEND_PORT=str(backend_port),
+        BACKEND_WORKERS=str(options.workers),
+        BACKEND_RELOAD="0",
+        KB_CACHE_DIR=os.path.join(workdir, "kb_cache"),
+        TRACE_EXPORT_PATH="",
+        LOG_ENV="production",
+        LOG_LEVEL="WARNING",
+    )
+    backend = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f"http://127.0.0.1:{backend_port}"
+    deadline = time.monotonic() + STACK_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if backend.poll() is not None or stub.poll() is not None:
+            break
+        try:
+            status = httpx.get(f"{url}/health", timeout=1).json()
+            if status["knowledge_base"]["version"] > 0:
+                return url, [backend, stub]
+        except (httpx.HTTPError, ValueError, KeyError):
+            pass
+        time.sleep(0.5)
+    for process in (backend, stub):
+        process.terminate()
+    raise RuntimeError(f"The backend did not start, see {log.name}")
+
+
+def print_report(steps, options):
+    ttft = " ttft p50/p99" if options.stream else ""
+    print(f"\n{'rate':>6} {'sent':>6} {'ok/s':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}{ttft:>14}"
+          f" {'lag cli/be p99':>15}  errors")
+    for step in steps:
+        latency = step["latency_ms"]
+        first = ""
+        if options.stream:
+            first = f"{step['first_token_ms']['p50'] or '-'}/{step['first_token_ms']['p99'] or '-'}".rjust(14)
+        backend_lag = (step["backend_loop_lag_ms"] or {}).get("p99")
+        lag = f"{step['client_loop_lag_ms']['p99'] or '-'}/{backend_lag if backend_lag is not None else '-'}"
+        errors = ", ".join(f"{status}: {count}" for status, count in sorted(step["errors"].items())) or "-"
+        if step["dropped"]:
+            errors += f", dropped: {step['dropped']}"
+        print(f"{step['offered_rate']:>6g} {step['sent']:>6} {step['throughput']:>8} "
+              + "".join(f"{latency[name] if latency[name] is not None else '-':>9}" for name in ("p50", "p90", "p99", "max"))
+              + f"{first} {lag:>15}  {errors}")
+    saturated = [step for step in steps if is_saturated(step, options.slo_p99_ms)]
+    if saturated:
+        best = max((step for step in steps if step not in saturated), key=lambda s: s["throughput"], default=None)
+        limit = f"; sustained up to {best['throughput']} req/s" if best else ""
+        print(f"Saturated from {saturated[0]['offered_rate']:g} req/s offered{limit} "
+              f"(p99 SLO {options.slo_p99_ms:g} ms, throughput below {SATURATION_THROUGHPUT_RATIO:.0%} of offered "
+              f"or errors above {SATURATION_ERROR_RATE:.0%})")
+    else:
+        print(f"No saturation up to {steps[-1]['offered_rate']:g} req/s")
+
+
+async def run(url, options):
+    payloads = build_payloads(options)
+    limits = httpx.Limits(max_connections=options.max_in_flight, max_keepalive_connections=options.max_in_flight)
+    async with httpx.AsyncClient(base_url=url, timeout=options.timeout, limits=limits) as client:
+        steps = []
+        for i, rate in enumerate(options.rates):
+            logging.info(f"Offering {rate:g} req/s for {options.duration:g}s")
+            steps.append(await run_step(client, rate, payloads, options, options.seed + i))
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test of the chat backend")
+    parser.add_argument("--url", default="http://localhost:8000", help="backend to test (ignored with --start-stack)")
+    parser.add_argument("--start-stack", action="store_true", help="start a mock Azure OpenAI and a backend using it")
+    parser.add_argument("--workers", type=int, default=1, help="backend workers with --start-stack")
+    parser.add_argument("--rates", default="5,10,20,40", help="comma-separated arrival rates (req/s), one step each")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per step")
+    parser.add_argument("--stream", action="store_true", help="use /chat/stream and measure time to first token")
+    parser.add_argument("--context", choices=("retrieve", "inline"), default="retrieve",
+                        help="let the backend retrieve the snippet, or send it with the question")
+    parser.add_argument("--history-turns", type=int, default=2, help="earlier turns sent as conversation memory")
+    parser.add_argument("--unique", action="store_true", help="make every question unique (no request coalescing)")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="client-side cap; arrivals beyond it are dropped")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--slo-p99-ms", type=float, default=5000, help="p99 latency above which a step counts as saturated")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="median mock LLM latency (s)")
+    parser.add_argument("--llm-embedding-latency", type=float, default=0.05, help="median mock embedding latency (s)")
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.4, help="log-normal spread of the mock latency")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of mock calls failing with a 500")
+    parser.add_argument("--llm-throttle-rate", type=float, default=0.0, help="share of mock calls throttled with a 429")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    options = parser.parse_args(argv)
+    options.rates = [float(rate) for rate in options.rates.split(",") if rate.strip()]
+
+    processes = []
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            url = options.url
+            if options.start_stack:
+                url, processes = start_stack(options, workdir)
+                logging.info(f"Backend on {url} using the mock Azure OpenAI")
+            steps = asyncio.run(run(url, options))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+
+    print_report(steps, options)
+    if options.output:
+        config = {key: value for key, value in vars(options).items() if key != "output"}
+        with open(options.output, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "steps": steps}, f, indent=2)
+            f.write("\n")
+        print(f"Report saved to {options.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    # One line per request would drown the report
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    sys.exit(main())
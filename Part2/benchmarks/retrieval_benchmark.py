@@ -0,0 +1,392 @@
+"""
+Retrieval quality and latency benchmark over the real knowledge base
+(frontend/phase2_data) and a labeled set of Hebrew and English questions
+(retrieval_questions.json), each mapped to the record keys it should retrieve
+for the asker's health fund and tier.
+
+    python -m benchmarks.retrieval_benchmark                    # stub embeddings vs. their baseline
+    python -m benchmarks.retrieval_benchmark --update-baseline  # accept the current results
+    python -m benchmarks.retrieval_benchmark --record benchmarks/embeddings.npz      # embed once with Azure
+    python -m benchmarks.retrieval_benchmark --embeddings benchmarks/embeddings.npz  # then replay offline
+
+It reports recall@k, MRR, p50/p99 search latency, index build time and memory, and
+exits with status 1 when a metric regresses past its tolerance, so changes to
+parsing, chunking, indexing or search can be gated on it.
+
+The default stub embeddings hash words and character trigrams, so they are
+deterministic and need no network, but only match questions lexically: English
+questions against the Hebrew knowledge base score near zero with them. With the
+stub, the gated quality metrics therefore cover the Hebrew questions only (English
+is still reported per language); recorded embeddings gate every language. Quality
+numbers that reflect the real model come from embeddings recorded with --record.
+
+Latencies depend on the machine. Every run also times a fixed reference workload,
+and the baseline's latencies are scaled by the ratio of the two runs' reference
+times, so a baseline recorded on one machine still gates runs on another.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from retrieval import KnowledgeBaseIndexer, semantic_search_knowledge_base
+from retrieval.kb_indexer import text_hash
+from retrieval.text_utils import tokenize
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+KB_DIR = os.path.join(BENCHMARK_DIR, "..", "frontend", "phase2_data")
+QUESTIONS_FILE = os.path.join(BENCHMARK_DIR, "retrieval_questions.json")
+BASELINE_DIR = os.path.join(BENCHMARK_DIR, "baselines")
+
+STUB_DIMENSIONS = 1024
+RECALL_KS = (1, 3, 5)
+# Allowed regressions against the baseline before the run fails
+QUALITY_TOLERANCE = 0.01
+LATENCY_TOLERANCE = 0.5
+# Sub-millisecond timings are mostly noise; latencies within this many ms always pass
+LATENCY_FLOOR_MS = 0.5
+MEMORY_TOLERANCE = 0.1
+# Languages the stub embeddings can answer; English questions only match them by chance
+STUB_GATED_LANGUAGES = ("he",)
+CALIBRATION_ROUNDS = 21
+
+
+def _hashed(feature):
+    value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+    return value % STUB_DIMENSIONS, 1.0 if value >> 63 else -1.0
+
+
+def stub_embedding(text):
+    """
+    Deterministic stand-in for the embedding model: a normalized feature-hashing
+    vector of the text's words and their character trigrams (which also match
+    Hebrew words carrying a prefix letter, e.g. סתימות / בסתימות).
+    """
+    vector = np.zeros(STUB_DIMENSIONS, dtype=np.float32)
+    for word in tokenize(text):
+        index, sign = _hashed(word)
+        vector[index] += sign
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            index, sign = _hashed(padded[i:i + 3])
+            vector[index] += 0.5 * sign
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def stub_embeddings(texts):
+    return [stub_embedding(text) for text in texts]
+
+
+class StoredEmbeddings:
+    """Embeddings recorded with --record, looked up by a hash of the text."""
+
+    def __init__(self, path):
+        data = np.load(path)
+        self.vectors = dict(zip(data["hashes"].tolist(), data["vectors"]))
+        self.name = os.path.splitext(os.path.basename(path))[0]
+
+    def __call__(self, texts):
+        missing = [text for text in texts if text_hash(text) not in self.vectors]
+        if missing:
+            raise KeyError(f"{len(missing)} texts have no stored embedding (first: {missing[0][:60]!r}); "
+                           f"re-record them with --record")
+        return [self.vectors[text_hash(text)].tolist() for text in texts]
+
+
+def record_embeddings(path, questions):
+    """Embeds every knowledge base record and question with Azure OpenAI and saves them to `path`."""
+    sys.path.append(os.path.abspath(os.path.join(BENCHMARK_DIR, "..", "..")))
+    from common import RateLimitedClient, PRIORITY_BATCH
+    from common.clients import get_openai_client
+    from retrieval import get_embeddings
+
+    client = RateLimitedClient(get_openai_client, PRIORITY_BATCH)
+    texts = []
+    indexer = KnowledgeBaseIndexer(KB_DIR, lambda batch: texts.extend(batch) or [None] * len(batch))
+    indexer.refresh()
+    texts.extend(q["question"] for q in questions)
+    texts = list(dict.fromkeys(texts))
+    vectors = get_embeddings(client, texts)
+    failed = [text for text, vector in zip(texts, vectors) if vector is None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} texts failed to embed")
+    np.savez_compressed(path, hashes=np.array([text_hash(text) for text in texts]),
+                        vectors=np.array(vectors, dtype=np.float32))
+    logging.info(f"Recorded {len(texts)} embeddings to {path}")
+
+
+def calibrate(rounds=CALIBRATION_ROUNDS):
+    """
+    Fastest time in ms of a fixed workload shaped like a search (a matrix-vector
+    product and top-k over float32 rows, then a Python loop over words), independent
+    of the code under test. Latencies are compared in units of this time.
+    """
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(4000, 256)).astype(np.float32)
+    query = rng.normal(size=256).astype(np.float32)
+    words = [f"word{i % 997}" for i in range(20000)]
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        np.argsort(-(matrix @ query))[:10]
+        counts = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + len(word)
+        timings.append((time.perf_counter() - start) * 1000)
+    # The fastest round is the least disturbed by other load, so the most repeatable
+    return min(timings)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def build_snapshot(embed_fn, cache_dir, options):
+    """
+    Builds the index the way the services do.
+
+    Returns:
+        tuple: (snapshot, build_ms excluding embedding time, embed_ms)
+    """
+    embed_ms = 0.0
+
+    def timed_embed(texts):
+        nonlocal embed_ms
+        start = time.perf_counter()
+        vectors = embed_fn(texts)
+        embed_ms += (time.perf_counter() - start) * 1000
+        return vectors
+
+    indexer = KnowledgeBaseIndexer(
+        KB_DIR,
+        timed_embed,
+        storage_dtype=options.storage_dtype,
+        rescore=options.rescore,
+        cache_dir=cache_dir,
+        ann_min_records=options.ann_min_records,
+    )
+    start = time.perf_counter()
+    indexer.refresh()
+    build_ms = (time.perf_counter() - start) * 1000 - embed_ms
+    if indexer.last_error:
+        raise RuntimeError(f"Index build failed: {indexer.last_error}")
+    return indexer.snapshot, build_ms, embed_ms
+
+
+def score_questions(snapshot, questions, query_vectors, options):
+    """Runs every question `options.repeat` times; returns per-question ranks and all search latencies."""
+    results = []
+    latencies = []
+    for question, vector in zip(questions, query_vectors):
+        for _ in range(options.repeat):
+            start = time.perf_counter()
+            _, keys = semantic_search_knowledge_base(
+                vector,
+                snapshot,
+                top_k=options.top_k,
+                hmo_name=question["hmo_name"],
+                insurance_tier=question["insurance_tier"],
+                rescore=options.rescore,
+                query=question["question"],
+                token_budget=options.token_budget or None,
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+        expected = set(question["expected"])
+        ranks = [rank for rank, key in enumerate(keys, 1) if key in expected]
+        results.append({
+            "id": question["id"],
+            "language": question["language"],
+            "first_rank": ranks[0] if ranks else None,
+            "recall": {k: len(expected & set(keys[:k])) / len(expected) for k in RECALL_KS},
+        })
+    return results, latencies
+
+
+def quality(results):
+    summary = {f"recall@{k}": round(float(np.mean([r["recall"][k] for r in results])), 4) for k in RECALL_KS}
+    summary["mrr"] = round(float(np.mean([1 / r["first_rank"] if r["first_rank"] else 0.0 for r in results])), 4)
+    return summary
+
+
+def run_benchmark(embed_fn, questions, options):
+    """
+    Returns:
+        dict: Quality (overall and per language), search latency, build time and memory.
+    """
+    query_vectors = embed_fn([q["question"] for q in questions])
+    calibration_ms = calibrate()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        builds = [build_snapshot(embed_fn, cache_dir, options) for _ in range(options.build_repeat)]
+        snapshot = builds[-1][0]
+        tracemalloc.start()
+        build_snapshot(embed_fn, cache_dir, options)
+        _, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results, latencies = score_questions(snapshot, questions, query_vectors, options)
+        gated = [r for r in results if r["language"] in options.gate_languages]
+        report = {
+            "config": {
+                "embeddings": options.embeddings_name,
+                "questions": len(questions),
+                "records": len(snapshot.kb),
+                "top_k": options.top_k,
+                "token_budget": options.token_budget,
+                "storage_dtype": options.storage_dtype,
+                "rescore": options.rescore,
+                "ann": snapshot.index is not None,
+                "gate_languages": sorted(options.gate_languages),
+            },
+            "metrics": {
+                **quality(gated),
+                "search_p50_ms": round(percentile(latencies, 50), 4),
+                "search_p99_ms": round(percentile(latencies, 99), 4),
+                "index_build_ms": round(float(np.median([build[1] for build in builds])), 2),
+                "index_bytes": snapshot.store.nbytes,
+                "build_peak_bytes": build_peak,
+            },
+            "by_language": {
+                language: quality([r for r in results if r["language"] == language])
+                for language in sorted({r["language"] for r in results})
+            },
+            "embed_ms": round(float(np.median([build[2] for build in builds])), 2),
+            # Timed before and after the measurements, to absorb load changes in between
+            "calibration_ms": round(min(calibration_ms, calibrate()), 4),
+            "misses": [r["id"] for r in results if r["first_rank"] is None],
+        }
+    return report
+
+
+def compare(report, baseline, latency_tolerance=LATENCY_TOLERANCE):
+    """
+    Compares the metrics with a baseline report. Baseline latencies are scaled by
+    the ratio of this run's reference workload time to the baseline's.
+
+    Returns:
+        list: (metric, baseline, current, ok) rows; latency baselines are the scaled ones.
+    """
+    scale = machine_scale(report, baseline)
+    rows = []
+    for metric, current in report["metrics"].items():
+        base = baseline["metrics"].get(metric)
+        if base is None:
+            rows.append((metric, None, current, True))
+        elif metric.startswith("recall@") or metric == "mrr":
+            rows.append((metric, base, current, current >= base - QUALITY_TOLERANCE))
+        elif metric.endswith("_ms"):
+            base = round(base * scale, 4)
+            limit = max(base * (1 + latency_tolerance), base + LATENCY_FLOOR_MS)
+            rows.append((metric, base, current, current <= limit))
+        else:
+            rows.append((metric, base, current, current <= base * (1 + MEMORY_TOLERANCE)))
+    return rows
+
+
+def machine_scale(report, baseline):
+    """How much slower this machine ran the reference workload than the baseline's (1.0 if unknown)."""
+    base, current = baseline.get("calibration_ms"), report.get("calibration_ms")
+    return current / base if base and current else 1.0
+
+
+def _format(value):
+    return "-" if value is None else f"{value:d}" if isinstance(value, int) else f"{value:g}"
+
+
+def print_report(report, rows, baseline=None):
+    config = report["config"]
+    print(f"\nRetrieval benchmark: {config['questions']} questions, {config['records']} records, "
+          f"embeddings={config['embeddings']}, top_k={config['top_k']}, dtype={config['storage_dtype']}")
+    print(f"Quality gated on: {', '.join(config['gate_languages'])}; reference workload "
+          f"{report['calibration_ms']:.2f}ms" + (
+              f" ({machine_scale(report, baseline):.2f}x the baseline machine)" if baseline else ""))
+    print(f"{'metric':<18}{'baseline':>14}{'current':>14}")
+    for metric, base, current, ok in rows:
+        print(f"{metric:<18}{_format(base):>14}{_format(current):>14}  {'ok' if ok else 'REGRESSED'}")
+    for language, summary in report["by_language"].items():
+        print(f"  {language}: " + ", ".join(f"{name}={value:.3f}" for name, value in summary.items()))
+    if report["misses"]:
+        print(f"  not retrieved in top {config['top_k']}: {', '.join(report['misses'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retrieval quality and latency benchmark")
+    parser.add_argument("--embeddings", default="stub", help='"stub" or a file written by --record')
+    parser.add_argument("--record", metavar="PATH", help="embed the knowledge base and questions with Azure OpenAI and exit")
+    parser.add_argument("--questions", default=QUESTIONS_FILE)
+    parser.add_argument("--baseline", help="baseline report (default: baselines/retrieval_<embeddings>.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="save this run as the baseline")
+    parser.add_argument("--top-k", type=int, default=max(RECALL_KS))
+    parser.add_argument("--token-budget", type=int, default=0, help="benchmark the budgeted context path (as CONTEXT_TOKEN_BUDGET)")
+    parser.add_argument("--storage-dtype", default="int8")
+    parser.add_argument("--no-rescore", dest="rescore", action="store_false")
+    parser.add_argument("--ann-min-records", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20, help="searches per question for the latency percentiles")
+    parser.add_argument("--build-repeat", type=int, default=3)
+    parser.add_argument("--latency-tolerance", type=float, default=LATENCY_TOLERANCE)
+    parser.add_argument("--gate-languages", help="comma-separated languages whose quality is gated "
+                                                 "(default: he with stub embeddings, all otherwise)")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    options = parser.parse_args(argv)
+
+    with open(options.questions, encoding="utf-8") as f:
+        questions = json.load(f)
+    if options.record:
+        record_embeddings(options.record, questions)
+        return 0
+
+    if options.embeddings == "stub":
+        embed_fn = stub_embeddings
+        options.embeddings_name = "stub"
+    else:
+        embed_fn = StoredEmbeddings(options.embeddings)
+        options.embeddings_name = embed_fn.name
+    if options.gate_languages:
+        options.gate_languages = set(options.gate_languages.split(","))
+    elif options.embeddings == "stub":
+        options.gate_languages = set(STUB_GATED_LANGUAGES)
+    else:
+        options.gate_languages = {q["language"] for q in questions}
+
+    report = run_benchmark(embed_fn, questions, options)
+    baseline_path = options.baseline or os.path.join(BASELINE_DIR, f"retrieval_{options.embeddings_name}.json")
+    baseline = None
+    if os.path.exists(baseline_path) and not options.update_baseline:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != report["config"]:
+            logging.warning(f"Baseline {baseline_path} was run with a different configuration: {baseline['config']}")
+            baseline = None
+
+    rows = compare(report, baseline, options.latency_tolerance) if baseline else [
+        (metric, None, value, True) for metric, value in report["metrics"].items()
+    ]
+    if options.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    print_report(report, rows, baseline)
+
+    if options.update_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {baseline_path}")
+    elif baseline is None:
+        print(f"No comparable baseline at {baseline_path}; save one with --update-baseline")
+    regressed = [metric for metric, _, _, ok in rows if not ok]
+    if regressed:
+        print(f"Regressed: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
@@ -1,30 +1,109 @@
-import numpy as np
 import streamlit as st
 # Set up the Streamlit page configuration
 st.set_page_config("HMO Chatbot")
 
-from openai import AzureOpenAI
 import os
-import json
-import glob
 import re
+import sys
+import json
+import secrets
+from http.cookies import SimpleCookie
+import streamlit.components.v1 as components
 from dotenv import load_dotenv
 import logging
-import config
-import requests
-from langdetect import detect
+
+# The retrieval package is shared with the backend and lives in Part2/; the
+# Azure OpenAI rate limiter is shared with Part1 and lives in common/ at the repo root
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from retrieval import KnowledgeBaseIndexer, semantic_search_knowledge_base, get_embedding, get_embeddings
+from retrieval.text_utils import detect_language, estimate_tokens
+from common import RateLimitedClient, PRIORITY_CHAT, PRIORITY_INTAKE, PRIORITY_BATCH, PromptTemplate, register, settings
+from common.clients import get_openai_client
+from telemetry import Tracer, TRACEPARENT_HEADER, configure_logging, clip
+from backend_client import BackendClient
+from chat_history import ChatHistory
+from session_store import SessionSync, create_session_store, tab_session_id
+from intake_validators import (
+    EDITABLE_FIELD_PARSERS, parse_field, extract_id_number, is_valid_israeli_id,
+    match_confirmation, parse_comparison, looks_like_bulk_details, validate_extracted_fields,
+)
 
 # Load environment variables (ensure you have a .env file with the required keys)
 load_dotenv()
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
-
-EMBEDDING_MODEL = "text-embedding-ada-002"
+# Queued, background-thread logging; LOG_ENV=production switches to sampled JSON lines
+configure_logging("frontend")
+
+# "backend": the /chat endpoint retrieves the context itself (the frontend holds no index).
+# "local": this process loads the knowledge base and sends the snippet with the question.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "backend")
+# Comma-separated chat backend replicas; calls are balanced across them
+BACKEND_URLS = [url.strip() for url in os.getenv("BACKEND_URLS", "http://localhost:8000").split(",") if url.strip()]
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "10"))
+BACKEND_DEADLINE = float(os.getenv("BACKEND_DEADLINE", "90"))
+BACKEND_RETRIES = int(os.getenv("BACKEND_RETRIES", "2"))
+# Stream answers token by token from /chat/stream instead of waiting for /chat
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+# Send questions comparing funds or tiers in the backend's comparison mode
+COMPARE_QUESTIONS = os.getenv("COMPARE_QUESTIONS", "1") == "1"
+# Estimated-token budget of the knowledge snippet in local mode (0 = whole top-k paragraphs)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Above this many records the brute-force scan is replaced by an IVF index
+ANN_MIN_RECORDS = int(os.getenv("ANN_MIN_RECORDS", "2000"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+# Embeddings are kept quantized ("int8", "float16" or "float32"); exact float32 copies
+# for rescoring the top candidates are memory-mapped from EMBEDDING_CACHE_DIR
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "int8")
+EMBEDDING_RESCORE = os.getenv("EMBEDDING_RESCORE", "1") == "1"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".kb_cache")
+# How often (seconds) phase2_data is checked for changed files
+KB_POLL_INTERVAL = float(os.getenv("KB_POLL_INTERVAL", "2"))
+# Messages drawn per page (older ones load on demand) and kept uncompressed per session;
+# beyond CHAT_HISTORY_CAP the oldest messages are spilled to a compressed archive
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "40"))
+CHAT_HISTORY_CAP = int(os.getenv("CHAT_HISTORY_CAP", "200"))
+# Conversation memory sent with each question: the last CHAT_MEMORY_TURNS exchanges
+# plus a rolling summary of older ones capped at CHAT_SUMMARY_MAX_TOKENS
+CHAT_MEMORY_TURNS = int(os.getenv("CHAT_MEMORY_TURNS", "3"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+CHAT_HISTORY_OPTIONS = {
+    "cap": CHAT_HISTORY_CAP,
+    "recent_turns": CHAT_MEMORY_TURNS,
+    "summary_max_tokens": CHAT_SUMMARY_MAX_TOKENS,
+}
+# Where session state is kept so any replica (or a restarted process) can resume it:
+# "memory" (this process only), "sqlite" (file path in SESSION_STORE_URL) or
+# "redis" (redis://host:port/db in SESSION_STORE_URL)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL")
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+# Browser cookie holding the browser's id (kept out of the URL, which gets shared and bookmarked)
+SESSION_COOKIE = "hmo_chat_sid"
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{64}")
+# Query parameter holding the tab's nonce; a session is scoped to cookie + tab
+TAB_PARAM = "tab"
+TAB_ID_PATTERN = re.compile(r"[0-9a-f]{16}")
+# Let the user paste all intake details in one message instead of one field per turn
+BULK_INTAKE = os.getenv("BULK_INTAKE", "1") == "1"
+# Finished spans (chat turn, retrieval, backend call) are appended here as JSON lines;
+# the backend continues the same trace through the traceparent header
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", ".traces/frontend.jsonl")
+
+@st.cache_resource
+def get_openai_clients():
+    """
+    Rate-limited views of the process-wide pooled Azure OpenAI client (created on first
+    call), shared by all sessions instead of being rebuilt on every rerun. Calls wait for
+    budget on the deployment's rate limiter (AZURE_RATE_LIMITS): intake parsing runs
+    below question embeddings (chat priority) and above knowledge base indexing.
+    """
+    return (
+        RateLimitedClient(get_openai_client, PRIORITY_INTAKE, estimate_tokens),
+        RateLimitedClient(get_openai_client, PRIORITY_CHAT, estimate_tokens),
+        RateLimitedClient(get_openai_client, PRIORITY_BATCH, estimate_tokens),
+    )
 
-client = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-)
+client, chat_client, indexing_client = get_openai_clients()
 # Multi-language support messages (English and Hebrew)
 MESSAGES = {
     "greeting": {
@@ -35,6 +114,10 @@ MESSAGES = {
         "en": "Let's start by collecting your details. Please enter your first name.",
         "he": "בוא נתחיל באיסוף הפרטים שלך. אנא הזן/י את שמך הפרטי."
     },
+    "bulk_intake_hint": {
+        "en": "Tip: you can also send all your details in one message (first and last name, ID number, gender, age, health fund, HMO card number and insurance tier).",
+        "he": "טיפ: אפשר גם לשלוח את כל הפרטים בהודעה אחת (שם פרטי ושם משפחה, תעודת זהות, מגדר, גיל, קופת חולים, מספר כרטיס קופה ורמת ביטוח)."
+    },
     "ask_last_name": {
         "en": "Great! Please enter your last name.",
         "he": "מצוין! אנא הזן/י את שם המשפחה שלך."
@@ -79,145 +162,171 @@ MESSAGES = {
 def get_message(key):
     lang = st.session_state.get("user_info", {}).get("language", "en")
     return MESSAGES.get(key, {}).get(lang, MESSAGES.get(key, {}).get("en", ""))
-def detect_language(text):
-    try:
-        detected_lang = detect(text)
-        if detected_lang == "he":
-            return "he"
-        else:
-            return "en"
-    except Exception as e:
-        return "en"
 
-def get_embedding(text):
-    try:
-        response = client.embeddings.create(
-            input=[text],
-            model=EMBEDDING_MODEL,
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        logging.error(f"Failed to get embedding for text. Error: {e}")
-        return None
-
-
-def cosine_similarity(vec1, vec2):
-    v1 = np.array(vec1)
-    v2 = np.array(vec2)
-    return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
+@st.cache_resource
+def get_backend_client():
+    """One pooled backend client per process, shared by all user sessions."""
+    return BackendClient(
+        BACKEND_URLS,
+        timeout=BACKEND_TIMEOUT,
+        deadline=BACKEND_DEADLINE,
+        retries=BACKEND_RETRIES,
+    )
 
+@st.cache_resource
+def get_session_store():
+    """One session store connection per process, shared by all user sessions."""
+    return create_session_store(SESSION_STORE, SESSION_STORE_URL, ttl=SESSION_TTL)
 
-def semantic_search_knowledge_base(query, kb, kb_embeddings, top_k=3):
+def read_session_cookie():
+    """The browser id from its cookie, or None if it has none (or a malformed one)."""
+    context = getattr(st, "context", None)
+    if context is not None and hasattr(context, "cookies"):
+        value = context.cookies.get(SESSION_COOKIE)
+    else:
+        # Before st.context, the cookies are read from the page's websocket request headers
+        from streamlit.web.server.websocket_headers import _get_websocket_headers
+        cookies = SimpleCookie()
+        cookies.load((_get_websocket_headers() or {}).get("Cookie", ""))
+        value = cookies[SESSION_COOKIE].value if SESSION_COOKIE in cookies else None
+    return value if value and SESSION_ID_PATTERN.fullmatch(value) else None
+
+def write_session_cookie(browser_id):
     """
-       Performs semantic search using embeddings to find top matching paragraphs
-       from the knowledge base for the user's query .
-       """
-    query_embedding = get_embedding(query)
-    scored = []
-    for key, content in kb.items():
-        emb = kb_embeddings.get(key)
-        if emb is None:
-            continue
-        score = cosine_similarity(query_embedding, emb)
-        scored.append((score, key, content))
-
-    scored.sort(reverse=True, key=lambda x: x[0])
-    top_matches = scored[:top_k]
-
-    # Combine matched paragraphs and metadata as context for the LLM
-    combined_snippet = "\n\n---\n\n".join(
-        [
-            f"{match[2]['text']} (Source: {match[2]['metadata']['filename']}, Paragraph: {match[2]['metadata']['para_num']})"
-            for match in top_matches]
+    Stores the browser id in a first-party cookie. Streamlit cannot send Set-Cookie
+    headers, so a zero-height component sets it on the app's page.
+    """
+    components.html(
+        "<script>const page = window.parent; page.document.cookie = "
+        f"'{SESSION_COOKIE}={browser_id}; path=/; max-age={int(SESSION_TTL)}; SameSite=Strict' + "
+        "(page.location.protocol === 'https:' ? '; Secure' : '');</script>",
+        height=0,
     )
 
-    logging.debug(f"Top matches: {[match[1] for match in top_matches]}")
-
-    return combined_snippet, [match[1] for match in top_matches]
+@st.cache_resource
+def get_tracer():
+    """One tracer (and span export thread) per process."""
+    return Tracer("frontend", TRACE_EXPORT_PATH)
 
 
 # ---------------------------
 # Load Knowledge Base
 # ---------------------------
-@st.cache_data
-def load_knowledge_base():
+@st.cache_resource
+def get_kb_indexer():
     """
-    Loads and splits HTML knowledge base files into paragraphs, storing each with
-    metadata (filename and paragraph number). Used for improved retrieval accuracy.
+    Loads the HTML knowledge base once per process and keeps it up to date.
+
+    The indexer parses `phase2_data/` (prose sections as paragraphs, every table cell
+    as one record per (service, hmo, tier)), embeds the records into a quantized
+    EmbeddingStore and, for large KBs, an IVF index. A background thread then polls
+    the directory and re-embeds only new or modified records, swapping in a new
+    versioned snapshot so queries already running are not disturbed.
+
+    Being a cache_resource, the indexer is neither hashed nor copied on reruns;
+    sessions read its current snapshot, a read-only handle with a cheap `key`.
     """
-    kb = {}
-    for filepath in glob.glob("phase2_data/*.html"):
-        with open(filepath, "r", encoding="utf-8") as f:
-            raw_text = f.read()
-            text = re.sub("<[^<]+?>", "", raw_text)
-            paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
-            for idx, para in enumerate(paragraphs):
-                key = f"{os.path.basename(filepath)}_para_{idx}"
-                kb[key] = {
-                    "text": para,
-                    "metadata": {
-                        "filename": os.path.basename(filepath),
-                        "para_num": idx
-                    }
-                }
-    return kb
-
-
-
-@st.cache_data
-def precompute_embeddings(kb):
-    """Pre-computes embeddings for knowledge base paragraphs for faster retrieval."""
-    embeddings = {}
-    for key, content in kb.items():
-        emb = get_embedding(content["text"][:5000])
-        embeddings[key] = emb
-    return embeddings
+    indexer = KnowledgeBaseIndexer(
+        "phase2_data",
+        lambda texts: get_embeddings(indexing_client, texts),
+        poll_interval=KB_POLL_INTERVAL,
+        storage_dtype=EMBEDDING_STORAGE_DTYPE,
+        rescore=EMBEDDING_RESCORE,
+        cache_dir=EMBEDDING_CACHE_DIR,
+        ann_min_records=ANN_MIN_RECORDS,
+        ann_nprobe=ANN_NPROBE,
+    )
+    indexer.refresh()
+    indexer.start()
+    return indexer
+
+
+# Intake prompts are compiled once at import (and re-registered unchanged on reruns):
+# the instructions open every request identically and the user's input comes last,
+# so the provider can cache the shared prefix. Bump a version when changing its wording.
+FIELD_FORMATS = {
+    "ID number": (
+        "a valid ID number is exactly 9 digits long. "
+        "If the input contains multiple numbers, extract the one that is exactly 9 digits. "
+        "If no valid 9-digit number is found, return 'Invalid'."
+    ),
+    "age": (
+        "a valid age is an integer between 0 and 120. "
+        "If the input contains additional text, extract the integer value. "
+        "If no valid age is found, return 'Invalid'."
+    ),
+    "HMO name": (
+        "a valid HMO name is one of the following: מכבי, מאוחדת, כללית. "
+        "If the input is not one of these, return 'Invalid'."
+    ),
+    "HMO card number": (
+        "a valid HMO card number is exactly 9 digits long. "
+        "If the input contains multiple numbers, extract the one that is exactly 9 digits. "
+        "If no valid 9-digit number is found, return 'Invalid'."
+    ),
+    "insurance membership tier": (
+        "a valid insurance membership tier is one of the following: זהב, כסף, ארד. "
+        "If the input is not one of these, return 'Invalid'."
+    ),
+}
+FIELD_PROMPTS = {
+    field_name: register(PromptTemplate(
+        f"intake.field.{field_name.lower().replace(' ', '_')}",
+        1,
+        system=(
+            "You are an assistant that extracts one valid value from a user's input. "
+            "Respond with the value only, or with 'Invalid'. "
+            f"The field is: {field_name}. The expected format for {field_name} is: {field_format}"
+        ),
+        user=f"Extract the valid {field_name} from the following input: '{{user_input}}'.",
+    ))
+    for field_name, field_format in FIELD_FORMATS.items()
+}
+EXTRACT_ALL_PROMPT = register(PromptTemplate(
+    "intake.extract_all",
+    1,
+    system=(
+        "You are an assistant that extracts personal details from a user's message. "
+        "The message can be in English or Hebrew. "
+        "Respond with a JSON object with exactly these keys: "
+        "first_name, last_name, id_number (9 digits), gender, age (integer 0-120), "
+        "hmo_name (one of: מכבי, מאוחדת, כללית), hmo_card_number (9 digits), "
+        "insurance_tier (one of: זהב, כסף, ארד). "
+        "Use null for any field that is not present in the message. Do not guess."
+    ),
+    user="{user_input}",
+))
+CONFIRMATION_PROMPT = register(PromptTemplate(
+    "intake.confirmation",
+    1,
+    system=(
+        "You are an assistant that analyzes a user's response regarding confirmation of their details. "
+        "The user input can be in English or Hebrew. "
+        "The available fields in the user data are: first_name, last_name, id_number, gender, age, hmo_name, hmo_card_number, insurance_tier. "
+        "If the response indicates that the user wants to proceed, respond with the single word 'confirm'. "
+        "If the response indicates that the user wants to make corrections, respond with a JSON object in the following format: "
+        '{"action": "edit", "field": "<field_name>", "new_value": "<new_value>"} '
+        "Make sure the JSON is valid. Only output either 'confirm' or the JSON object."
+    ),
+    user="{user_input}",
+    examples=[
+        ("user", 'תשנה את המגדר שלי לזכר'),
+        ("assistant", '{"action": "edit", "field": "gender", "new_value": "זכר"}'),
+    ],
+))
 
 
 def extract_field(field_name, user_input):
     st.info("Validating your input, please wait...")
-    # בונים prompt מותאם לכל שדה
-    system_prompt = f"You are an assistant that extracts a valid {field_name}. The expected format for {field_name} is: "
-    if field_name == "ID number":
-        system_prompt += (
-            "a valid ID number is exactly 9 digits long. "
-            "If the input contains multiple numbers, extract the one that is exactly 9 digits. "
-            "If no valid 9-digit number is found, return 'Invalid'."
-        )
-    elif field_name == "age":
-        system_prompt += (
-            "a valid age is an integer between 0 and 120. "
-            "If the input contains additional text, extract the integer value. "
-            "If no valid age is found, return 'Invalid'."
-        )
-    elif field_name == "HMO name":
-        system_prompt += (
-            "a valid HMO name is one of the following: מכבי, מאוחדת, כללית. "
-            "If the input is not one of these, return 'Invalid'."
-        )
-    elif field_name == "HMO card number":
-        system_prompt += (
-            "a valid HMO card number is exactly 9 digits long. "
-            "If the input contains multiple numbers, extract the one that is exactly 9 digits. "
-            "If no valid 9-digit number is found, return 'Invalid'."
-        )
-    elif field_name == "insurance membership tier":
-        system_prompt += (
-            "a valid insurance membership tier is one of the following: זהב, כסף, ארד. "
-            "If the input is not one of these, return 'Invalid'."
-        )
-
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": f"Extract the valid {field_name} from the following input: '{user_input}'."}
-    ]
+    prompt = FIELD_PROMPTS[field_name]
     try:
         response = client.chat.completions.create(
-            model=config.AZURE_OPENAI_DEPLOYMENT,
-            messages=messages,
+            model=settings.AZURE_OPENAI_DEPLOYMENT,
+            messages=prompt.messages(user_input=user_input),
             temperature=0,
             max_tokens=50
         )
+        prompt.record_usage(response)
         extracted = response.choices[0].message.content.strip()
         if extracted == "Invalid":
             return None
@@ -225,29 +334,74 @@ def extract_field(field_name, user_input):
     except Exception as e:
         logging.error(f"Error extracting field {field_name}: {e}")
         return None
+# Intake fields in the order they are asked, with the phase that asks for each
+INTAKE_FIELDS = [
+    ("first_name", "ask_first_name"),
+    ("last_name", "ask_last_name"),
+    ("id_number", "ask_id_number"),
+    ("gender", "ask_gender"),
+    ("age", "ask_age"),
+    ("hmo_name", "ask_hmo_name"),
+    ("hmo_card_number", "ask_hmo_card_number"),
+    ("insurance_tier", "ask_insurance_tier"),
+]
+INTAKE_PHASES = {phase for _, phase in INTAKE_FIELDS}
+
+
+def resolve_field(field_name, user_input):
+    """
+    Resolves an intake field with the local deterministic parsers first; the LLM
+    (extract_field) is only called when they cannot parse the input.
+
+    Returns:
+        The canonical value, or None if neither the parsers nor the LLM found a valid one.
+    """
+    value = parse_field(field_name, user_input)
+    if value is not None:
+        logging.debug(f"Parsed {field_name} locally: {value}")
+        return value
+    extracted = extract_field(field_name, user_input)
+    logging.debug(f"Extracted {field_name}: {extracted}")
+    # The LLM answer goes through the same validation as direct user input
+    return parse_field(field_name, extracted)
+
+
+def extract_all_fields(user_input):
+    """
+    Extracts every intake field from one free-form message with a single structured LLM call.
+
+    Returns:
+        dict: Valid values keyed by user_info field name; missing or invalid fields are left out.
+    """
+    st.info("Extracting your details, please wait...")
+    try:
+        response = client.chat.completions.create(
+            model=settings.AZURE_OPENAI_DEPLOYMENT,
+            messages=EXTRACT_ALL_PROMPT.messages(user_input=user_input),
+            temperature=0,
+            max_tokens=300,
+            response_format={"type": "json_object"}
+        )
+        EXTRACT_ALL_PROMPT.record_usage(response)
+        raw = json.loads(response.choices[0].message.content)
+    except Exception as e:
+        logging.error(f"Error extracting all fields: {e}")
+        raw = {}
+    return validate_extracted_fields(raw, user_input)
+
+
 def analyze_confirmation(user_input):
-    system_prompt = (
-        "You are an assistant that analyzes a user's response regarding confirmation of their details. "
-        "The user input can be in English or Hebrew. "
-        "The available fields in the user data are: first_name, last_name, id_number, gender, age, hmo_name, hmo_card_number, insurance_tier. "
-        "If the response indicates that the user wants to proceed, respond with the single word 'confirm'. "
-        "If the response indicates that the user wants to make corrections, respond with a JSON object in the following format: "
-        '{"action": "edit", "field": "<field_name>", "new_value": "<new_value>"} '
-        "Make sure the JSON is valid. Only output either 'confirm' or the JSON object."
-    )
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": 'תשנה את המגדר שלי לזכר'},
-        {"role": "assistant", "content": '{"action": "edit", "field": "gender", "new_value": "זכר"}'},
-        {"role": "user", "content": user_input}
-    ]
+    # Plain confirmations ("yes", "confirm", "כן", "אשר") need no LLM call
+    if match_confirmation(user_input):
+        return {"action": "confirm"}
     try:
         response = client.chat.completions.create(
-            model=config.AZURE_OPENAI_DEPLOYMENT,
-            messages=messages,
+            model=settings.AZURE_OPENAI_DEPLOYMENT,
+            messages=CONFIRMATION_PROMPT.messages(user_input=user_input),
             temperature=0,
             max_tokens=100
         )
+        CONFIRMATION_PROMPT.record_usage(response)
         result = response.choices[0].message.content.strip().lower()
         if result.lower() == "confirm":
             return {"action": "confirm"}
@@ -269,67 +423,154 @@ def analyze_confirmation(user_input):
 # ---------------------------
 # Load KnowledgeBase
 # ---------------------------
-knowledge_base = load_knowledge_base()
-kb_embeddings = precompute_embeddings(knowledge_base)
-logging.debug(f"Number of files in knowledge_base: {len(knowledge_base)}")
-logging.debug(f"Number of embeddings in kb_embeddings: {len(kb_embeddings)}")
+kb_indexer = get_kb_indexer() if RETRIEVAL_MODE == "local" else None
+if kb_indexer is not None:
+    kb_status = kb_indexer.status()
+    logging.debug(f"Knowledge base v{kb_status['version']}: {kb_status['records']} records")
 
 
 #######################
 # Streamlit + Chat Flow
 #######################
 st.title("HMO Chatbot - מידע רפואי לפי קופות החולים בישראל")
+if kb_indexer is not None:
+    st.sidebar.caption(
+        f"Knowledge base v{kb_status['version']} · {kb_status['records']} records · "
+        f"updated {kb_status['age_seconds']:.0f}s ago" + (" · stale" if kb_status["stale"] else "")
+    )
 
-# Client-side state management with Streamlit session state
+# Session state is mirrored to the session store. The browser id lives in a cookie and
+# each tab adds its own nonce in ?tab=, so a reload that lands on another replica or a
+# restarted process resumes that tab's session from the store, two tabs keep separate
+# sessions, and a shared or bookmarked URL (a nonce without the cookie) carries none.
+if "session_sync" not in st.session_state:
+    browser_id = read_session_cookie()
+    if browser_id is None:
+        browser_id = secrets.token_hex(32)
+        write_session_cookie(browser_id)
+    tab_id = st.query_params.get(TAB_PARAM)
+    if not (tab_id and TAB_ID_PATTERN.fullmatch(tab_id)):
+        tab_id = secrets.token_hex(8)
+        st.query_params[TAB_PARAM] = tab_id
+    # Links from before the cookie carried the id in ?sid=; it is no longer honoured
+    st.query_params.pop("sid", None)
+    st.session_state["session_sync"] = SessionSync(get_session_store(), tab_session_id(browser_id, tab_id))
+    restored = st.session_state["session_sync"].load(**CHAT_HISTORY_OPTIONS)
+    if restored:
+        st.session_state.update(restored)
 if "phase" not in st.session_state:
     st.session_state["phase"] = "greeting"
 if "user_info" not in st.session_state:
     st.session_state["user_info"] = {}
 if "chat_history" not in st.session_state:
-    st.session_state["chat_history"] = []
-
-chat_placeholder = st.container()
+    st.session_state["chat_history"] = ChatHistory(**CHAT_HISTORY_OPTIONS)
+if "chat_window" not in st.session_state:
+    st.session_state["chat_window"] = CHAT_WINDOW
 
 def build_conversation_history():
     """
-    Converts st.session_state["chat_history"] to the format:
+    Returns the recent exchanges in the format the backend /chat endpoint expects:
     [
-        {"user": "...", "bot": "..."},
         {"user": "...", "bot": "..."},
         ...
     ]
-    This is what the backend /chat endpoint expects.
+    Only the last CHAT_MEMORY_TURNS exchanges are kept (older ones are in the
+    rolling summary), so this is small and does not rescan the history.
     """
-    conversation = []
-    user_text = None
-
-    for msg in st.session_state["chat_history"]:
-        if msg["role"] == "user":
-            user_text = msg["content"]
-        elif msg["role"] == "assistant":
-            if user_text is not None:
-                conversation.append({
-                    "user": user_text,
-                    "bot": msg["content"]
-                })
-                user_text = None
-    return conversation
-
-def add_message(role, content):
-    """Adds a message to the Streamlit session chat history."""
-    st.session_state["chat_history"].append({"role": role, "content": content})
+    return st.session_state["chat_history"].conversation()
+
+def add_message(role, content, live=False, error=False):
+    """
+    Adds a message to the Streamlit session chat history.
+    live=True marks a message that was already drawn on the page while streaming,
+    so the render at the end of this run skips it. error=True keeps a failed
+    answer out of the conversation memory sent to the backend.
+    """
+    st.session_state["chat_history"].append(role, content, live=live, error=error)
     logging.info(f"{role.upper()}: {content}")
 
-def render_chat():
-    """Renders chat history visually in Streamlit."""
-    chat_placeholder.empty()
-    for msg in st.session_state["chat_history"]:
+def show_older_messages():
+    st.session_state["chat_window"] += CHAT_WINDOW
+
+def render_chat(start=None):
+    """
+    Renders chat history visually in Streamlit. With no `start`, only the last
+    `chat_window` messages are drawn, behind a button that loads older ones;
+    otherwise the messages from absolute index `start` on are drawn.
+    """
+    history = st.session_state["chat_history"]
+    if start is None:
+        start, messages = history.tail(st.session_state["chat_window"])
+        if start > 0:
+            st.button(f"Show older messages ({start})", on_click=show_older_messages)
+    else:
+        messages = history.since(start)
+    for msg in messages:
+        if msg.pop("live", False):
+            continue
         st.chat_message(msg["role"]).markdown(msg["content"])
 
+def stream_chat_answer(payload, placeholder):
+    """
+    Posts the payload to the streaming /chat endpoint and renders the answer into
+    `placeholder` token by token. Returns the full answer text.
+    """
+    answer = ""
+    with get_tracer().span("backend_chat", stream=True) as span, get_backend_client().post(
+        "/chat/stream", json=payload, idempotent=False, stream=True, headers={TRACEPARENT_HEADER: span.traceparent}
+    ) as resp:
+        if resp.status_code != 200:
+            raise RuntimeError(f"Error from server: {resp.text}")
+        event = None
+        for line in resp.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "error":
+                    raise RuntimeError(f"Error from server: {data.get('detail', '')}")
+                if event == "done":
+                    answer = data.get("answer", answer)
+                else:
+                    answer += data.get("delta", "")
+                    placeholder.markdown(answer + "▌")
+            elif not line:
+                event = None
+    placeholder.markdown(answer)
+    return answer.strip()
+
 # Initialize greeting if chat history is empty
-if st.session_state["phase"] == "greeting" and not st.session_state["chat_history"]:
+if st.session_state["phase"] == "greeting" and not len(st.session_state["chat_history"]):
     add_message("assistant", get_message("greeting"))
 
+def ask_for_confirmation():
+    st.session_state["phase"] = "confirm"
+    add_message("assistant", get_message("confirm"))
+    add_message("assistant", f"Your details: {st.session_state['user_info']}")
+    add_message("assistant","Type 'confirm' to proceed to chat, or type 'edit' with the details of the field you want to update.")
+
+
+def process_bulk_details(message):
+    """
+    Fills every intake field found in the message, then asks only for the
+    fields that are still missing (or goes straight to confirmation).
+    """
+    fields = extract_all_fields(message)
+    candidate_id = extract_id_number(message)
+    if "id_number" not in fields and candidate_id and not is_valid_israeli_id(candidate_id):
+        add_message("assistant", "ID number check digit is invalid. Please check the number and try again.")
+    st.session_state["user_info"].update(fields)
+    if fields:
+        add_message("assistant", f"Extracted details: {fields}")
+
+    for key, phase in INTAKE_FIELDS:
+        if key not in st.session_state["user_info"]:
+            st.session_state["phase"] = phase
+            add_message("assistant", get_message(phase))
+            return
+    ask_for_confirmation()
+
+
 # Function to process a new user message based on the current phase
 def process_message(message):
     phase = st.session_state["phase"]
@@ -339,8 +580,18 @@ def process_message(message):
         detected_lang = detect_language(message)
         st.session_state["user_info"]["language"] = detected_lang
         add_message("assistant", f"Detected language: {detected_lang}")
+        if BULK_INTAKE and looks_like_bulk_details(message):
+            process_bulk_details(message)
+            return
         st.session_state["phase"] = "ask_first_name"
         add_message("assistant", get_message("ask_first_name"))
+        if BULK_INTAKE:
+            add_message("assistant", get_message("bulk_intake_hint"))
+
+    # Any intake phase: a message with several details fills them all at once
+    if phase in INTAKE_PHASES and BULK_INTAKE and looks_like_bulk_details(message):
+        process_bulk_details(message)
+        return
 
     # Phase: Ask First Name
     if phase == "ask_first_name":
@@ -363,11 +614,11 @@ def process_message(message):
     # Phase: Ask ID Number
     if phase == "ask_id_number":
         answer = message.strip()
-        valid_id = answer if (len(answer) == 9 and answer.isdigit()) else None
-        if valid_id is None:
-            extracted = extract_field("ID number", answer)
-            logging.debug(f"Extracted ID number: {extracted}")
-            valid_id = extracted
+        candidate = extract_id_number(answer)
+        if candidate and not is_valid_israeli_id(candidate):
+            add_message("assistant", "ID number check digit is invalid. Please check the number and try again.")
+            return
+        valid_id = resolve_field("ID number", answer)
         if valid_id:
             st.session_state["user_info"]["id_number"] = valid_id
             add_message("assistant", f"Extracted valid ID number: {valid_id}")
@@ -388,17 +639,7 @@ def process_message(message):
     # Phase: Ask Age
     if phase == "ask_age":
         answer = message.strip()
-        valid_age = None
-        try:
-            age_val = int(answer)
-            if 0 <= age_val <= 120:
-                valid_age = age_val
-        except ValueError:
-            pass
-        if valid_age is None:
-            extracted = extract_field("age", answer)
-            logging.debug(f"Extracted age: {extracted}")
-            valid_age = extracted
+        valid_age = resolve_field("age", answer)
         if valid_age is not None:
             st.session_state["user_info"]["age"] = valid_age
             add_message("assistant", f"Extracted valid age: {valid_age}")
@@ -411,11 +652,7 @@ def process_message(message):
     # Phase: Ask HMO Name
     if phase == "ask_hmo_name":
         answer = message.strip()
-        valid_hmo = answer if answer in ["מכבי", "מאוחדת", "כללית"] else None
-        if valid_hmo is None:
-            extracted = extract_field("HMO name", answer)
-            logging.debug(f"Extracted HMO name: {extracted}")
-            valid_hmo = extracted
+        valid_hmo = resolve_field("HMO name", answer)
         if valid_hmo:
             st.session_state["user_info"]["hmo_name"] = valid_hmo
             add_message("assistant", f"Extracted valid health fund: {valid_hmo}")
@@ -427,11 +664,7 @@ def process_message(message):
     # Phase: Ask HMO Card Number
     if phase == "ask_hmo_card_number":
         answer = message.strip()
-        valid_card = answer if (len(answer) == 9 and answer.isdigit()) else None
-        if valid_card is None:
-            extracted = extract_field("HMO card number", answer)
-            logging.debug(f"Extracted HMO card number: {extracted}")
-            valid_card = extracted
+        valid_card = resolve_field("HMO card number", answer)
         if valid_card:
             st.session_state["user_info"]["hmo_card_number"] = valid_card
             add_message("assistant", f"Extracted valid HMO card number: {valid_card}")
@@ -443,18 +676,12 @@ def process_message(message):
     # Phase: Ask Insurance Tier
     if phase == "ask_insurance_tier":
         answer = message.strip()
-        valid_tier = answer if answer in ["זהב", "כסף", "ארד"] else None
-        if valid_tier is None:
-            extracted = extract_field("insurance membership tier", answer)
-            logging.debug(f"Extracted insurance tier: {extracted}")
-            valid_tier = extracted
+        valid_tier = resolve_field("insurance membership tier", answer)
         if valid_tier:
             st.session_state["user_info"]["insurance_tier"] = valid_tier
             add_message("assistant", f"Extracted valid insurance tier: {valid_tier}")
             st.session_state["phase"] = "confirm"
-            add_message("assistant", get_message("confirm"))
-            add_message("assistant", f"Your details: {st.session_state['user_info']}")
-            add_message("assistant","Type 'confirm' to proceed to chat, or type 'edit' with the details of the field you want to update.")
+            ask_for_confirmation()
         else:
             add_message("assistant", "Insurance tier is invalid and could not be extracted. Please try again.")
 
@@ -465,13 +692,16 @@ def process_message(message):
             add_message("assistant", "Your response was unclear. " + get_message("confirm_input"))
             return
         if analysis.get("action") == "confirm":
-            st.session_state["chat_history"] = []
+            st.session_state["chat_history"].clear()
+            st.session_state["chat_window"] = CHAT_WINDOW
             st.session_state["phase"] = "qa"
             add_message("assistant", get_message("qa_phase"))
         elif analysis.get("action") == "edit":
             field_to_edit = analysis.get("field")
             new_value = analysis.get("new_value")
-            if field_to_edit and new_value:
+            if field_to_edit in EDITABLE_FIELD_PARSERS:
+                new_value = parse_field(EDITABLE_FIELD_PARSERS[field_to_edit], new_value)
+            if field_to_edit and new_value is not None and new_value != "":
                 st.session_state["user_info"][field_to_edit] = new_value
                 add_message("assistant", f"Updated {field_to_edit} to {new_value}.")
                 add_message("assistant", f"Your updated details: {st.session_state['user_info']}")
@@ -490,28 +720,78 @@ def process_message(message):
             return
 
         with st.spinner("Searching for an answer..."):
-            snippet, source_doc = semantic_search_knowledge_base(question, knowledge_base, kb_embeddings, top_k=4)
-            logging.debug(f"Snippet retrieved from file: {source_doc}")
-
-            if not snippet:
-                add_message("assistant", "Sorry, I couldn't find relevant information in the knowledge base.")
-                return
+            # Comparisons are always retrieved by the backend, which slices the context per plan
+            comparison = parse_comparison(question) if COMPARE_QUESTIONS else {}
+            # In backend mode the /chat endpoint retrieves the context from its own index
+            snippet = ""
+            if kb_indexer is not None and not comparison:
+                # Hold on to one snapshot for the whole query, even if the indexer swaps it
+                kb_snapshot = kb_indexer.snapshot
+                with get_tracer().span("retrieval", kb_version=kb_snapshot.key):
+                    snippet, source_doc = semantic_search_knowledge_base(
+                        get_embedding(chat_client, question),
+                        kb_snapshot,
+                        top_k=6,
+                        hmo_name=st.session_state["user_info"].get("hmo_name"),
+                        insurance_tier=st.session_state["user_info"].get("insurance_tier"),
+                        rescore=EMBEDDING_RESCORE,
+                        query=question,
+                        token_budget=CONTEXT_TOKEN_BUDGET,
+                    )
+                logging.debug("Snippet retrieved from file: %s", source_doc)
+
+                if not snippet:
+                    add_message("assistant", "Sorry, I couldn't find relevant information in the knowledge base.")
+                    return
 
             conversation_history_for_server = build_conversation_history()
-            logging.debug(f"[FRONTEND] chat_history = {st.session_state['chat_history']}")
-            logging.debug(f"[FRONTEND] conversation_history_for_server = {conversation_history_for_server}")
 
             payload = {
                 "user_info": st.session_state["user_info"],
                 "question": question,
                 "language": st.session_state["user_info"].get("language", "en"),
                 "context": snippet,
-                "conversation_history": []
+                "conversation_history": conversation_history_for_server,
+                "conversation_summary": st.session_state["chat_history"].summary,
+                **comparison,
             }
-            logging.debug("[FRONTEND] Payload being sent = " + json.dumps(payload, ensure_ascii=False, indent=2))
+            logging.debug(
+                "Sending question: %s", clip(question),
+                extra={
+                    "history_turns": len(conversation_history_for_server),
+                    "context_chars": len(snippet),
+                    "comparison": bool(comparison),
+                },
+            )
+
+        if STREAM_ANSWERS:
+            # Show the question and stream the answer as it is generated (outside the spinner)
+            st.chat_message("user").markdown(question)
+            placeholder = st.chat_message("assistant").empty()
+            try:
+                answer_text = stream_chat_answer(payload, placeholder)
+            except Exception as e:
+                logging.error(f"Error streaming answer: {e}")
+                placeholder.markdown(str(e))
+                # Keep the failed turn in the history so it survives the next rerun
+                add_message("user", question, live=True)
+                add_message("assistant", str(e), live=True, error=True)
+                return
+            if not answer_text:
+                placeholder.markdown("Server returned empty answer.")
+                add_message("user", question, live=True)
+                add_message("assistant", "Server returned empty answer.", live=True, error=True)
+                return
+            add_message("user", question, live=True)
+            add_message("assistant", answer_text, live=True)
+            return
 
+        with st.spinner("Waiting for the answer..."):
             try:
-                resp = requests.post("http://localhost:8000/chat", json=payload)
+                with get_tracer().span("backend_chat", stream=False) as span:
+                    resp = get_backend_client().post(
+                        "/chat", json=payload, idempotent=False, headers={TRACEPARENT_HEADER: span.traceparent}
+                    )
                 if resp.status_code != 200:
                     add_message("assistant", f"Error from server: {resp.text}")
                     return
@@ -529,11 +809,23 @@ def process_message(message):
 
         return
 
+# Draw the existing history first so streamed answers appear below it
+render_chat()
 new_message = st.chat_input("Type your message here...")
 if new_message:
-    if st.session_state["phase"] == "qa":
-        process_message(new_message)
-    else:
-        add_message("user", new_message)
-        process_message(new_message)
-render_chat()
\ No newline at end of file
+    rendered = len(st.session_state["chat_history"])
+    # Root span of the turn; retrieval and backend calls nest under it
+    with get_tracer().span("chat_turn", phase=st.session_state["phase"]):
+        if st.session_state["phase"] == "qa":
+            process_message(new_message)
+        else:
+            add_message("user", new_message)
+            process_message(new_message)
+    if len(st.session_state["chat_history"]) < rendered:
+        # History was reset (details confirmed); redraw from scratch
+        st.session_state["session_sync"].save(st.session_state)
+        st.rerun()
+    render_chat(start=rendered)
+
+# Only the fields that changed since the last run are written to the session store
+st.session_state["session_sync"].save(st.session_state)
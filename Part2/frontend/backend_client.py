@@ -0,0 +1,246 @@
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_DEADLINE = 90.0
+DEFAULT_RETRIES = 2
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 2.0
+# Statuses returned before the backend did any work, so the call is safe to retry
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+
+class BackendUnavailableError(RuntimeError):
+    """Raised when no backend replica could serve the request before the deadline."""
+
+
+def failed_to_connect(error):
+    """
+    True if the connection could not be opened, so the request never reached the
+    backend: a connect timeout, a refused connection or a failed DNS lookup (urllib3
+    reports the last two as NewConnectionError, a ConnectTimeoutError subclass).
+    A reset or a closed connection after sending is not, since the backend may
+    already be working on the request.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    # requests wraps urllib3's MaxRetryError, which holds the underlying error
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class CircuitBreaker:
+    """
+    Per-replica circuit breaker. After `failure_threshold` consecutive failures the
+    replica is skipped for `reset_timeout` seconds; then one trial request is let
+    through (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=15.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_progress:
+            self.trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_progress = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class Replica:
+    def __init__(self, base_url, breaker):
+        self.base_url = base_url.rstrip("/")
+        self.breaker = breaker
+        self.in_flight = 0
+
+
+class BackendClient:
+    """
+    HTTP client from the Streamlit frontend to the chat backend replicas.
+
+    One instance is shared by all user sessions of the process. It keeps a pooled
+    keep-alive `requests.Session`, spreads calls over the replicas (least in-flight,
+    skipping replicas whose circuit breaker is open), enforces a per-call deadline,
+    and retries failed attempts on another replica with jittered exponential backoff.
+    """
+
+    def __init__(self, base_urls, timeout=DEFAULT_TIMEOUT, deadline=DEFAULT_DEADLINE, retries=DEFAULT_RETRIES,
+                 pool_size=20, failure_threshold=3, reset_timeout=15.0):
+        if not base_urls:
+            raise ValueError("At least one backend URL is required")
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.replicas = [Replica(url, CircuitBreaker(failure_threshold, reset_timeout)) for url in base_urls]
+        self._lock = threading.Lock()
+        self._next = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.replicas), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _pick_replica(self, exclude=()):
+        with self._lock:
+            n = len(self.replicas)
+            order = [self.replicas[(self._next + i) % n] for i in range(n)]
+            self._next = (self._next + 1) % n
+            candidates = [r for r in order if r not in exclude] or order
+            for replica in sorted(candidates, key=lambda r: r.in_flight):
+                if replica.breaker.allow():
+                    replica.in_flight += 1
+                    return replica
+        return None
+
+    def _release(self, replica, ok):
+        with self._lock:
+            replica.in_flight -= 1
+            self._record(replica, ok)
+
+    def _record(self, replica, ok):
+        if ok:
+            replica.breaker.record_success()
+        else:
+            replica.breaker.record_failure()
+
+    def _release_on_close(self, resp, replica, ok):
+        """
+        Keeps a streamed response counted as in flight on its replica until it is
+        closed, so least-in-flight selection sees long-running streams.
+        """
+        with self._lock:
+            self._record(replica, ok)
+        close = resp.close
+        released = False
+
+        def close_and_release():
+            nonlocal released
+            close()
+            if not released:
+                released = True
+                with self._lock:
+                    replica.in_flight -= 1
+
+        resp.close = close_and_release
+
+    def _backoff(self, attempt, remaining, retry_after=None):
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+        delay = random.uniform(0, delay)  # full jitter
+        if retry_after:
+            delay = max(delay, retry_after)
+        if delay >= remaining:
+            return False
+        time.sleep(delay)
+        return True
+
+    def request(self, method, path, idempotent=True, stream=False, **kwargs):
+        """
+        Sends a request to one of the replicas, retrying on another replica on failure.
+
+        Args:
+            method (str): HTTP method.
+            path (str): Path such as "/chat".
+            idempotent (bool): If True, any connection error or timeout is retried.
+                Otherwise only failures that happen before the backend starts working
+                (failing to open the connection, 429/502/503/504) are retried.
+            stream (bool): Return the response without reading the body; it counts as
+                in flight on its replica until closed.
+
+        Returns:
+            requests.Response: The first non-retryable response.
+
+        Raises:
+            BackendUnavailableError: If every attempt failed or the deadline passed.
+        """
+        start = time.monotonic()
+        last_error = None
+        tried = []
+        for attempt in range(self.retries + 1):
+            remaining = self.deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            replica = self._pick_replica(exclude=tried)
+            if replica is None:
+                last_error = "all backend replicas are unavailable (circuit open)"
+                break
+            tried.append(replica)
+            retry_after = None
+            try:
+                resp = self.session.request(
+                    method,
+                    replica.base_url + path,
+                    timeout=(min(self.timeout, remaining), remaining),
+                    stream=stream,
+                    **kwargs,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                retryable = idempotent or failed_to_connect(e)
+                self._release(replica, ok=False)
+                last_error = f"{replica.base_url}: {e}"
+                logging.warning(f"Backend request failed ({last_error}), attempt {attempt + 1}")
+                if not retryable:
+                    break
+            else:
+                if resp.status_code not in RETRYABLE_STATUSES:
+                    if stream:
+                        self._release_on_close(resp, replica, ok=resp.status_code < 500)
+                    else:
+                        self._release(replica, ok=resp.status_code < 500)
+                    return resp
+                self._release(replica, ok=resp.status_code == 429)
+                last_error = f"{replica.base_url}: HTTP {resp.status_code}"
+                logging.warning(f"Backend returned {resp.status_code}, attempt {attempt + 1}")
+                try:
+                    retry_after = float(resp.headers.get("Retry-After", 0))
+                except ValueError:
+                    retry_after = None
+                resp.close()
+            if attempt < self.retries:
+                remaining = self.deadline - (time.monotonic() - start)
+                if not self._backoff(attempt, remaining, retry_after):
+                    break
+        raise BackendUnavailableError(f"Backend unavailable: {last_error}")
+
+    def post(self, path, json=None, idempotent=True, stream=False, headers=None):
+        return self.request("POST", path, idempotent=idempotent, stream=stream, json=json, headers=headers)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def status(self):
+        """Breaker state and in-flight count per replica."""
+        return [
+            {"url": r.base_url, "state": r.breaker.state, "in_flight": r.in_flight}
+            for r in self.replicas
+        ]
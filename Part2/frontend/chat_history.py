@@ -0,0 +1,167 @@
+import os
+import re
+import sys
+import json
+import zlib
+
+# The retrieval package lives in Part2/; set up its path here too, so this module
+# imports on its own and not only after app.py's path setup
+_PART2_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _PART2_DIR not in sys.path:
+    sys.path.append(_PART2_DIR)
+from retrieval.text_utils import estimate_tokens, truncate_to_tokens
+
+DEFAULT_CAP = 200
+DEFAULT_SPILL_CHUNK = 50
+# Exchanges sent verbatim to the backend; older ones are folded into the summary
+DEFAULT_RECENT_TURNS = 3
+DEFAULT_SUMMARY_MAX_TOKENS = 300
+SUMMARY_QUESTION_TOKENS = 60
+SUMMARY_ANSWER_TOKENS = 40
+
+
+def _pack(messages):
+    data = json.dumps(messages, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(data.encode("utf-8"))
+
+
+def _unpack(chunk):
+    return json.loads(zlib.decompress(chunk).decode("utf-8"))
+
+
+class ChatHistory:
+    """
+    Bounded chat history of one session.
+
+    The newest `cap` messages are kept as plain dicts; older ones are spilled in
+    chunks of `spill_chunk` messages to zlib-compressed JSON and only decompressed
+    when the user scrolls back to them. Messages are addressed by their absolute
+    index (0 = first message of the session), which does not change when older
+    messages are spilled.
+
+    The conversation memory sent to the backend is tracked as messages are added:
+    the last `recent_turns` (user, assistant) exchanges verbatim, and a rolling
+    summary (one short line per older exchange, oldest lines dropped beyond
+    `summary_max_tokens`), so its size stays bounded however long the chat runs.
+    """
+
+    def __init__(self, cap=DEFAULT_CAP, spill_chunk=DEFAULT_SPILL_CHUNK, recent_turns=DEFAULT_RECENT_TURNS,
+                 summary_max_tokens=DEFAULT_SUMMARY_MAX_TOKENS):
+        self.cap = max(cap, 1)
+        self.spill_chunk = max(min(spill_chunk, self.cap), 1)
+        self.recent_turns = recent_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.summary = ""
+        self.messages = []
+        self.archive = []
+        self.archived_count = 0
+        self.exchanges = []
+        self._pending_user = None
+        # Bumped by clear() so stored archive chunks of a previous history are not reused
+        self.generation = 0
+
+    def __len__(self):
+        return self.archived_count + len(self.messages)
+
+    def append(self, role, content, live=False, error=False):
+        """
+        Adds a message. An assistant message with error=True (a failed answer) is
+        shown like any other but is not paired with the pending question into the
+        conversation memory.
+        """
+        message = {"role": role, "content": content}
+        if live:
+            message["live"] = True
+        self.messages.append(message)
+
+        if role == "user":
+            self._pending_user = content
+        elif error:
+            self._pending_user = None
+        elif role == "assistant" and self._pending_user is not None:
+            self.exchanges.append({"user": self._pending_user, "bot": content})
+            self._pending_user = None
+            while len(self.exchanges) > self.recent_turns:
+                self._fold(self.exchanges.pop(0))
+
+        if len(self.messages) > self.cap:
+            self._spill()
+        return message
+
+    def _fold(self, exchange):
+        """Adds one short line for an exchange to the rolling summary."""
+        first_sentence = re.split(r"(?<=[.!?])\s", exchange["bot"].strip(), maxsplit=1)[0]
+        line = (
+            f"Q: {truncate_to_tokens(exchange['user'].strip(), SUMMARY_QUESTION_TOKENS)} "
+            f"A: {truncate_to_tokens(first_sentence, SUMMARY_ANSWER_TOKENS)}"
+        ).replace("\n", " ")
+        lines = (self.summary.split("\n") if self.summary else []) + [line]
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        self.summary = "\n".join(lines)
+
+    def _spill(self):
+        chunk = [{"role": m["role"], "content": m["content"]} for m in self.messages[:self.spill_chunk]]
+        self.archive.append(_pack(chunk))
+        self.archived_count += len(chunk)
+        del self.messages[:self.spill_chunk]
+
+    def since(self, start):
+        """Messages from absolute index `start` on; spilled messages are decompressed as needed."""
+        start = max(start, 0)
+        if start >= self.archived_count:
+            return self.messages[start - self.archived_count:]
+        # Every archived chunk holds exactly `spill_chunk` messages
+        first_chunk = start // self.spill_chunk
+        older = []
+        for chunk in self.archive[first_chunk:]:
+            older.extend(_unpack(chunk))
+        return older[start - first_chunk * self.spill_chunk:] + self.messages
+
+    def tail(self, count):
+        """The last `count` messages, with their absolute start index."""
+        start = max(len(self) - count, 0)
+        return start, self.since(start)
+
+    def conversation(self):
+        """The recent (user, assistant) exchanges in the format the backend /chat endpoint expects."""
+        return list(self.exchanges)
+
+    def clear(self):
+        self.messages = []
+        self.archive = []
+        self.archived_count = 0
+        self.exchanges = []
+        self._pending_user = None
+        self.summary = ""
+        self.generation += 1
+
+    def to_state(self):
+        """JSON-serializable state, except the archive chunks (already compressed bytes)."""
+        return {
+            "messages": [{"role": m["role"], "content": m["content"]} for m in self.messages],
+            "archived_count": self.archived_count,
+            "exchanges": self.exchanges,
+            "summary": self.summary,
+            "pending_user": self._pending_user,
+            "generation": self.generation,
+            "chunks": len(self.archive),
+        }
+
+    @classmethod
+    def from_state(cls, state, archive, **options):
+        """Rebuilds a history from to_state() output; `options` are the constructor arguments."""
+        history = cls(**options)
+        history.messages = state["messages"]
+        history.archive = list(archive)
+        history.archived_count = state["archived_count"]
+        history.exchanges = state["exchanges"]
+        history.summary = state.get("summary", "")
+        history._pending_user = state["pending_user"]
+        history.generation = state["generation"]
+        return history
+
+    @property
+    def nbytes(self):
+        """Approximate size of the spilled archive, for monitoring."""
+        return sum(len(chunk) for chunk in self.archive)
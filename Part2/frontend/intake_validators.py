@@ -0,0 +1,357 @@
+import os
+import re
+import sys
+import difflib
+
+# The retrieval package lives in Part2/; set up its path here too, so this module
+# imports on its own and not only after app.py's path setup
+_PART2_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if _PART2_DIR not in sys.path:
+    sys.path.append(_PART2_DIR)
+from retrieval.text_utils import tokenize, normalize_text
+
+# Canonical values and the spellings / transliterations users type for them
+HMO_ALIASES = {
+    "מכבי": ["מכבי", "maccabi", "makabi", "macabi", "maccaby", "makkabi"],
+    "מאוחדת": ["מאוחדת", "מאוחדות", "meuhedet", "meuchedet", "meuhedeth", "mehuhedet", "meuhed"],
+    "כללית": ["כללית", "clalit", "klalit", "kalalit", "clallit"],
+}
+TIER_ALIASES = {
+    "זהב": ["זהב", "gold", "golden", "zahav"],
+    "כסף": ["כסף", "silver", "kesef"],
+    "ארד": ["ארד", "bronze", "arad"],
+}
+CONFIRM_WORDS = {
+    "yes", "y", "yep", "yeah", "confirm", "confirmed", "ok", "okay", "correct", "approve", "approved",
+    "sure", "proceed", "continue", "fine",
+    "כן", "אשר", "מאשר", "מאשרת", "אישור", "מאושר", "נכון", "בסדר", "תקין", "אוקיי", "סבבה", "מעולה",
+}
+# Words that may surround a confirmation word ("yes, it's all correct") but confirm nothing on their own
+CONFIRM_FILLER_WORDS = {"all", "its", "it's", "is", "it", "that's", "thats", "everything", "thanks", "הכל", "זה", "תודה"}
+# Whole messages that confirm without containing a confirmation word
+CONFIRM_PHRASES = {"all good", "looks good", "looks right", "its all good", "it's all good", "all right", "alright"}
+# Words that turn a question naming a fund or tier into a comparison with the user's plan
+COMPARISON_WORDS = {
+    "compare", "comparison", "compared", "vs", "versus", "difference", "differences", "better", "cheaper",
+    "השוואה", "השווה", "להשוות", "תשווה", "לעומת", "מול", "הבדל", "ההבדל", "הבדלים", "עדיף", "משתלם",
+}
+# Hebrew prefixes ("in", "the", "and", "that", "to") that may be glued to a word, e.g. "במכבי"
+HEBREW_PREFIXES = "בהושל"
+FUZZY_CUTOFF = 0.75
+
+EN_NUMBERS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15,
+    "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20, "thirty": 30,
+    "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90, "hundred": 100,
+}
+HE_UNITS = {
+    "אפס": 0, "אחת": 1, "אחד": 1, "שתיים": 2, "שתים": 2, "שניים": 2, "שנים": 2, "שני": 2, "שתי": 2,
+    "שלוש": 3, "שלושה": 3, "שלש": 3, "ארבע": 4, "ארבעה": 4, "חמש": 5, "חמישה": 5, "שש": 6, "שישה": 6,
+    "שבע": 7, "שבעה": 7, "שמונה": 8, "תשע": 9, "תשעה": 9,
+}
+HE_TENS = {
+    "עשר": 10, "עשרה": 10, "עשרים": 20, "שלושים": 30, "ארבעים": 40, "חמישים": 50, "שישים": 60,
+    "שבעים": 70, "שמונים": 80, "תשעים": 90, "מאה": 100,
+}
+FILLER_WORDS = {"and", "years", "year", "old", "i", "am", "i'm", "im", "my", "age", "is",
+                "בן", "בת", "שנים", "שנה", "אני", "גיל", "הגיל", "שלי"}
+
+# A run of digits that may contain spaces, dashes, dots or slashes as separators
+DIGIT_RUN_PATTERN = re.compile(r"\d[\d\s\-./]*\d|\d")
+
+
+def _normalized(words):
+    """Normalizes a word set/map the same way tokenize() normalizes user input."""
+    if isinstance(words, dict):
+        return {normalize_text(word): value for word, value in words.items()}
+    return {normalize_text(word) for word in words}
+
+
+CONFIRM_WORDS = _normalized(CONFIRM_WORDS)
+CONFIRM_FILLER_WORDS = _normalized(CONFIRM_FILLER_WORDS)
+COMPARISON_WORDS = _normalized(COMPARISON_WORDS)
+EN_NUMBERS = _normalized(EN_NUMBERS)
+HE_UNITS = _normalized(HE_UNITS)
+HE_TENS = _normalized(HE_TENS)
+FILLER_WORDS = _normalized(FILLER_WORDS)
+
+
+def is_valid_israeli_id(id_number):
+    """
+    Validates an Israeli ID number (Teudat Zehut) by its check digit: digits are
+    multiplied alternately by 1 and 2, two-digit products are reduced by summing
+    their digits, and the total must be a multiple of 10.
+    """
+    if not id_number or not id_number.isdigit() or len(id_number) > 9:
+        return False
+    id_number = id_number.zfill(9)
+    total = 0
+    for i, ch in enumerate(id_number):
+        value = int(ch) * (1 if i % 2 == 0 else 2)
+        total += value - 9 if value > 9 else value
+    return total % 10 == 0
+
+
+def extract_digit_sequences(text):
+    """Returns every digit sequence in the text, with separators removed."""
+    return [re.sub(r"\D", "", run) for run in DIGIT_RUN_PATTERN.findall(text or "")]
+
+
+def extract_nine_digits(text):
+    """
+    Extracts a single 9-digit number such as "123-456-789" or "123 456 789".
+    Returns None if there is no such number or more than one.
+    """
+    candidates = {seq for seq in extract_digit_sequences(text) if len(seq) == 9}
+    if len(candidates) == 1:
+        return candidates.pop()
+    return None
+
+
+def extract_id_number(text):
+    """Extracts a 9-digit ID number from free text (check digit is validated separately)."""
+    return extract_nine_digits(text)
+
+
+def parse_number_words(text):
+    """
+    Parses an English or Hebrew number written in words, e.g. "thirty five",
+    "thirty-five", "שלושים וחמש", "עשרים ואחת", "שתים עשרה". Returns None if the
+    text contains anything other than number words and fillers.
+    """
+    total = 0
+    pending_unit = None
+    found = False
+    for word in tokenize(text.replace("-", " ")):
+        if word in FILLER_WORDS:
+            continue
+        if word in EN_NUMBERS:
+            value = EN_NUMBERS[word]
+            if value == 100:
+                total = max(total, 1) * 100
+            else:
+                total += value
+            found = True
+            continue
+        # Hebrew joins the last part with "ו" ("and"), e.g. "וחמש"
+        candidates = [word]
+        if word.startswith("ו") and len(word) > 2:
+            candidates.append(word[1:])
+        for candidate in candidates:
+            if candidate in HE_UNITS:
+                if pending_unit is not None:
+                    total += pending_unit
+                pending_unit = HE_UNITS[candidate]
+                break
+            if candidate in HE_TENS:
+                value = HE_TENS[candidate]
+                if value == 10 and pending_unit is not None:
+                    # Teens: "שלוש עשרה" = 13
+                    total += pending_unit + 10
+                    pending_unit = None
+                else:
+                    if pending_unit is not None:
+                        total += pending_unit
+                        pending_unit = None
+                    total += value
+                break
+        else:
+            return None
+        found = True
+    if pending_unit is not None:
+        total += pending_unit
+    return total if found else None
+
+
+def parse_age(text):
+    """
+    Parses an age (0-120) from digits ("I'm 30") or number words ("thirty",
+    "שלושים וחמש"). Returns None if no single valid age is found.
+    """
+    numbers = [int(seq) for seq in extract_digit_sequences(text) if len(seq) <= 3]
+    if len(numbers) == 1:
+        age = numbers[0]
+    elif not numbers:
+        age = parse_number_words(text)
+    else:
+        return None
+    if age is not None and 0 <= age <= 120:
+        return age
+    return None
+
+
+def _find_aliases(text, aliases, fuzzy=True):
+    """Every canonical value the text mentions, via exact, prefix-stripped and (optionally) fuzzy matching."""
+    words = tokenize(text)
+    lookup = {normalize_text(alias): canonical for canonical, names in aliases.items() for alias in names}
+    matches = set()
+    for word in words:
+        candidates = [word]
+        if len(word) > 3 and word[0] in HEBREW_PREFIXES:
+            candidates.append(word[1:])
+        for candidate in candidates:
+            if candidate in lookup:
+                matches.add(lookup[candidate])
+                break
+        else:
+            close = difflib.get_close_matches(word, lookup.keys(), n=1, cutoff=FUZZY_CUTOFF) if fuzzy else []
+            if close:
+                matches.add(lookup[close[0]])
+    return matches
+
+
+def _match_alias(text, aliases, fuzzy=True):
+    """Maps free text to a canonical value via exact, prefix-stripped and (optionally) fuzzy matching."""
+    matches = _find_aliases(text, aliases, fuzzy)
+    if len(matches) == 1:
+        return matches.pop()
+    return None
+
+
+def match_hmo(text, fuzzy=True):
+    """
+    Returns the canonical HMO name (מכבי/מאוחדת/כללית) or None. Pass fuzzy=False
+    when scanning a whole free-form message rather than the answer to the HMO question.
+    """
+    return _match_alias(text, HMO_ALIASES, fuzzy)
+
+
+def match_tier(text, fuzzy=True):
+    """
+    Returns the canonical insurance tier (זהב/כסף/ארד) or None. Pass fuzzy=False
+    when scanning a whole free-form message ("good" and "old" are close to "gold").
+    """
+    return _match_alias(text, TIER_ALIASES, fuzzy)
+
+
+def parse_comparison(text):
+    """
+    Detects a question comparing health funds or insurance tiers, e.g. "מה ההבדל
+    בין מכבי לכללית בטיפולי שיניים?" or "compare gold and silver for glasses".
+
+    A question naming two or more funds (or tiers) compares them; one naming a
+    single fund or tier compares it with the user's own plan only when it also uses
+    a comparison word. A single fund named next to several tiers ("Maccabi gold vs
+    silver") is kept, and the backend compares that fund's tiers. Only exact
+    spellings count, since a whole question is scanned (fuzzy matching would find
+    funds in unrelated words).
+
+    Returns:
+        dict: The /chat comparison fields ("compare_hmos", "compare_tiers"), empty
+            if the question is not a comparison.
+    """
+    hmos = _find_aliases(text, HMO_ALIASES, fuzzy=False)
+    tiers = _find_aliases(text, TIER_ALIASES, fuzzy=False)
+    if len(hmos) < 2 and len(tiers) < 2:
+        if not COMPARISON_WORDS & set(tokenize(text)):
+            return {}
+        return {"compare_hmos": sorted(hmos), "compare_tiers": sorted(tiers)} if hmos or tiers else {}
+    # A single tier next to several funds is dropped: tier names are also everyday
+    # words ("כסף" is money), so it is more likely part of the question than a plan
+    return {
+        "compare_hmos": sorted(hmos),
+        "compare_tiers": sorted(tiers) if len(tiers) > 1 else [],
+    }
+
+
+def match_confirmation(text):
+    """
+    Returns True if the message is a plain confirmation ("yes", "confirm", "כן",
+    "אשר", "looks good", ...): at least one confirmation word and nothing but
+    confirmation and filler words around it. Anything else, including a filler word
+    alone ("is") or a correction ("all good except my age"), returns False.
+    """
+    words = tokenize(text)
+    if " ".join(words) in CONFIRM_PHRASES:
+        return True
+    return (
+        any(word in CONFIRM_WORDS for word in words)
+        and all(word in CONFIRM_WORDS or word in CONFIRM_FILLER_WORDS for word in words)
+    )
+
+
+def extract_valid_id_number(text):
+    """Extracts a 9-digit ID number and returns it only if its check digit is valid."""
+    id_number = extract_id_number(text)
+    return id_number if id_number and is_valid_israeli_id(id_number) else None
+
+
+# Local parser per intake field; the keys match the field names used by extract_field
+FIELD_PARSERS = {
+    "ID number": extract_valid_id_number,
+    "age": parse_age,
+    "HMO name": match_hmo,
+    "HMO card number": extract_nine_digits,
+    "insurance membership tier": match_tier,
+}
+# user_info keys that have a local parser, used to validate values from edit requests
+EDITABLE_FIELD_PARSERS = {
+    "id_number": "ID number",
+    "age": "age",
+    "hmo_name": "HMO name",
+    "hmo_card_number": "HMO card number",
+    "insurance_tier": "insurance membership tier",
+}
+# user_info keys taken as free text from a combined extraction
+FREE_TEXT_FIELDS = ("first_name", "last_name", "gender")
+
+
+def parse_field(field_name, text):
+    """
+    Parses an intake field deterministically, without any LLM call.
+
+    Args:
+        field_name (str): One of the FIELD_PARSERS keys.
+        text (str): The raw user input.
+
+    Returns:
+        The canonical value (str, or int for age), or None if it could not be parsed.
+    """
+    parser = FIELD_PARSERS.get(field_name)
+    if parser is None or not text:
+        return None
+    return parser(str(text))
+
+
+def looks_like_bulk_details(text):
+    """
+    Cheap local check for a message carrying several intake fields at once
+    (e.g. a 9-digit number plus a health fund), which is worth one combined extraction.
+    """
+    sequences = extract_digit_sequences(text)
+    signals = sum(1 for seq in sequences if len(seq) == 9)
+    # Only exact spellings count here: fuzzily, "old" or "good" would read as the gold tier
+    signals += match_hmo(text, fuzzy=False) is not None
+    signals += match_tier(text, fuzzy=False) is not None
+    signals += any(1 <= len(seq) <= 3 for seq in sequences)
+    return signals >= 2
+
+
+def validate_extracted_fields(raw, text):
+    """
+    Validates the JSON answer of a combined intake extraction of `text`.
+
+    Args:
+        raw (dict): The LLM's answer keyed by user_info field name.
+        text (str): The user's message the answer was extracted from.
+
+    Returns:
+        dict: Valid values keyed by user_info field name; missing or invalid fields are left out.
+    """
+    fields = {}
+    for key in FREE_TEXT_FIELDS:
+        value = raw.get(key)
+        if isinstance(value, str) and value.strip():
+            fields[key] = value.strip()
+    for key, field_name in EDITABLE_FIELD_PARSERS.items():
+        value = parse_field(field_name, raw.get(key))
+        if value is not None:
+            fields[key] = value
+    # Health fund and tier are recognized locally (exact spellings only) when the LLM
+    # gave no answer for them; a field it returned as null stays missing and is asked for
+    if "hmo_name" not in raw:
+        fields.setdefault("hmo_name", match_hmo(text, fuzzy=False))
+    if "insurance_tier" not in raw:
+        fields.setdefault("insurance_tier", match_tier(text, fuzzy=False))
+    return {key: value for key, value in fields.items() if value is not None}
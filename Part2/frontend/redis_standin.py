@@ -0,0 +1,126 @@
+"""
+A tiny in-process server speaking the Redis protocol, for running several
+frontends against SESSION_STORE=redis locally without installing Redis.
+Supports the commands the session store uses: PING, SELECT, HSET, HGETALL,
+HDEL, DEL and EXPIRE.
+
+    python redis_standin.py --port 6379
+"""
+import time
+import argparse
+import logging
+import threading
+import socketserver
+
+
+class RedisStandIn:
+    """In-memory hash storage with per-key expiry."""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires < time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return self._data.get(key)
+
+    def execute(self, args):
+        name = args[0].decode().upper()
+        with self._lock:
+            if name == "PING":
+                return "PONG"
+            if name == "SELECT":
+                return "OK"
+            if name == "HSET":
+                fields = self._live(args[1])
+                if fields is None:
+                    fields = self._data[args[1]] = {}
+                added = 0
+                for i in range(2, len(args), 2):
+                    added += args[i] not in fields
+                    fields[args[i]] = args[i + 1]
+                return added
+            if name == "HGETALL":
+                fields = self._live(args[1]) or {}
+                return [item for pair in fields.items() for item in pair]
+            if name == "HDEL":
+                fields = self._live(args[1]) or {}
+                return sum(fields.pop(field, None) is not None for field in args[2:])
+            if name == "DEL":
+                removed = 0
+                for key in args[1:]:
+                    removed += self._data.pop(key, None) is not None
+                    self._expires.pop(key, None)
+                return removed
+            if name == "EXPIRE":
+                if self._live(args[1]) is None:
+                    return 0
+                self._expires[args[1]] = time.time() + int(args[2])
+                return 1
+        raise ValueError(f"unknown command '{name}'")
+
+
+def encode_reply(value):
+    if isinstance(value, str):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, bytes):
+        return f"${len(value)}\r\n".encode() + value + b"\r\n"
+    if isinstance(value, list):
+        return f"*{len(value)}\r\n".encode() + b"".join(encode_reply(item) for item in value)
+    return b"$-1\r\n"
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            size = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if not args:
+                return
+            try:
+                reply = encode_reply(self.server.storage.execute(args))
+            except Exception as e:
+                reply = f"-ERR {e}\r\n".encode()
+            self.wfile.write(reply)
+
+
+class RedisStandInServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, RespHandler)
+        self.storage = RedisStandIn()
+
+    def start(self):
+        """Serves from a daemon thread; returns the bound port (useful with port 0)."""
+        threading.Thread(target=self.serve_forever, name="redis-standin", daemon=True).start()
+        return self.server_address[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Redis-protocol stand-in for the session store")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    logging.info(f"Redis stand-in listening on {args.host}:{args.port}")
+    with RedisStandInServer((args.host, args.port)) as server:
+        server.serve_forever()
@@ -0,0 +1,345 @@
+import abc
+import json
+import time
+import zlib
+import socket
+import sqlite3
+import hashlib
+import logging
+import threading
+from urllib.parse import urlparse
+
+from chat_history import ChatHistory
+
+DEFAULT_TTL = 7 * 24 * 3600
+# Field values larger than this are zlib-compressed
+COMPRESS_MIN_BYTES = 512
+REDIS_KEY_PREFIX = "hmo-chat:session:"
+
+
+class SessionStore(abc.ABC):
+    """
+    Interface of the external session stores. A session is a flat mapping of
+    field name to bytes, so a store can write only the fields that changed.
+    """
+
+    @abc.abstractmethod
+    def load(self, session_id):
+        """Returns {field: bytes} for the session (empty if unknown or expired)."""
+
+    @abc.abstractmethod
+    def save(self, session_id, changed, removed=()):
+        """Writes the `changed` fields, deletes the `removed` ones and refreshes the TTL."""
+
+    @abc.abstractmethod
+    def delete(self, session_id):
+        """Removes the session and all its fields."""
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local store; sessions survive Streamlit reconnects but not restarts."""
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[0] < time.time():
+                self._sessions.pop(session_id, None)
+                return {}
+            return dict(entry[1])
+
+    def save(self, session_id, changed, removed=()):
+        with self._lock:
+            _, fields = self._sessions.get(session_id, (0, {}))
+            fields.update(changed)
+            for field in removed:
+                fields.pop(field, None)
+            self._sessions[session_id] = (time.time() + self.ttl, fields)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions in one SQLite file (one row per session field), shareable by several
+    frontend processes on the same host and kept across restarts.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_fields ("
+                "session_id TEXT, field TEXT, value BLOB, expires_at REAL, "
+                "PRIMARY KEY (session_id, field))"
+            )
+
+    def load(self, session_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT field, value FROM session_fields WHERE session_id = ? AND expires_at >= ?",
+                (session_id, time.time()),
+            ).fetchall()
+        return {field: bytes(value) for field, value in rows}
+
+    def save(self, session_id, changed, removed=()):
+        expires_at = time.time() + self.ttl
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO session_fields VALUES (?, ?, ?, ?)",
+                [(session_id, field, value, expires_at) for field, value in changed.items()],
+            )
+            self._conn.executemany(
+                "DELETE FROM session_fields WHERE session_id = ? AND field = ?",
+                [(session_id, field) for field in removed],
+            )
+            self._conn.execute(
+                "UPDATE session_fields SET expires_at = ? WHERE session_id = ?", (expires_at, session_id)
+            )
+            self._conn.execute("DELETE FROM session_fields WHERE expires_at < ?", (time.time(),))
+
+    def delete(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM session_fields WHERE session_id = ?", (session_id,))
+
+
+class RedisProtocolError(RuntimeError):
+    """Raised when the Redis server answers with an error reply."""
+
+
+class RespConnection:
+    """Minimal blocking client for the Redis serialization protocol (RESP2)."""
+
+    def __init__(self, host, port, db=0, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._file = self._sock.makefile("rb")
+        if self.db:
+            self._send(["SELECT", str(self.db)])
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+        self._sock = None
+        self._file = None
+
+    def _send(self, args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._sock.sendall(b"".join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisProtocolError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._file.read(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            size = int(rest)
+            return None if size < 0 else [self._read() for _ in range(size)]
+        raise RedisProtocolError(f"Unexpected reply: {line!r}")
+
+    def command(self, *args):
+        """Sends one command, reconnecting once if the connection was dropped."""
+        for attempt in range(2):
+            try:
+                if self._sock is None:
+                    self._connect()
+                return self._send(list(args))
+            except (ConnectionError, OSError):
+                self.close()
+                if attempt:
+                    raise
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions as Redis hashes (one hash field per session field) with a TTL, shared
+    by every frontend replica. Speaks RESP directly, so any Redis-compatible
+    server works, including the local stand-in in `redis_standin.py`.
+    """
+
+    def __init__(self, url, ttl=DEFAULT_TTL):
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        self.ttl = ttl
+        self._conn = RespConnection(parsed.hostname or "localhost", parsed.port or 6379, db=db)
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            reply = self._conn.command("HGETALL", REDIS_KEY_PREFIX + session_id) or []
+        return {reply[i].decode("utf-8"): reply[i + 1] for i in range(0, len(reply), 2)}
+
+    def save(self, session_id, changed, removed=()):
+        key = REDIS_KEY_PREFIX + session_id
+        with self._lock:
+            if changed:
+                args = [item for field, value in changed.items() for item in (field, value)]
+                self._conn.command("HSET", key, *args)
+            if removed:
+                self._conn.command("HDEL", key, *removed)
+            self._conn.command("EXPIRE", key, int(self.ttl))
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.command("DEL", REDIS_KEY_PREFIX + session_id)
+
+
+def create_session_store(kind, url=None, ttl=DEFAULT_TTL):
+    """
+    Builds a session store.
+
+    Args:
+        kind (str): "memory", "sqlite" or "redis".
+        url (str): SQLite file path or redis://host:port/db URL.
+        ttl (float): Seconds an idle session is kept.
+    """
+    if kind == "memory":
+        return InMemorySessionStore(ttl=ttl)
+    if kind == "sqlite":
+        return SQLiteSessionStore(url or "sessions.db", ttl=ttl)
+    if kind == "redis":
+        return RedisSessionStore(url or "redis://localhost:6379/0", ttl=ttl)
+    raise ValueError(f"Unknown session store: {kind}")
+
+
+def tab_session_id(browser_id, tab_id):
+    """
+    The store key of one browser tab's session. Tabs of one browser share the cookie's
+    browser id; keying the stored state per tab keeps their field-by-field saves from
+    overwriting each other.
+    """
+    return f"{browser_id}.{tab_id}"
+
+
+def encode_value(value):
+    data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return b"z" + zlib.compress(data)
+    return b"j" + data
+
+
+def decode_value(data):
+    if data[:1] == b"z":
+        return json.loads(zlib.decompress(data[1:]).decode("utf-8"))
+    return json.loads(data[1:].decode("utf-8"))
+
+
+def encode_session(state):
+    """
+    Flattens the session state into {field: bytes}. Spilled chat archive chunks
+    are immutable and already compressed, so each is stored once as its own field.
+    """
+    history = state["chat_history"]
+    fields = {
+        "phase": encode_value(state["phase"]),
+        "user_info": encode_value(state["user_info"]),
+        "chat_window": encode_value(state["chat_window"]),
+        "chat_history": encode_value(history.to_state()),
+    }
+    for i, chunk in enumerate(history.archive):
+        fields[f"chat_archive:{history.generation}:{i}"] = chunk
+    return fields
+
+
+def decode_session(fields, **history_options):
+    """Rebuilds the session state from encode_session() output; None if incomplete."""
+    if "phase" not in fields or "chat_history" not in fields:
+        return None
+    data = decode_value(fields["chat_history"])
+    archive = [fields[f"chat_archive:{data['generation']}:{i}"] for i in range(data["chunks"])]
+    history = ChatHistory.from_state(data, archive, **history_options)
+    return {
+        "phase": decode_value(fields["phase"]),
+        "user_info": decode_value(fields["user_info"]),
+        "chat_window": decode_value(fields["chat_window"]),
+        "chat_history": history,
+    }
+
+
+class SessionSync:
+    """
+    Mirrors one user's session state to a SessionStore, writing only the fields
+    whose encoded bytes changed since the last save.
+    """
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+        self._digests = {}
+
+    @staticmethod
+    def _digest(value):
+        return hashlib.blake2b(value, digest_size=8).digest()
+
+    def load(self, **history_options):
+        try:
+            fields = self.store.load(self.session_id)
+        except Exception as e:
+            logging.error(f"Failed to load session {self.session_id}: {e}")
+            return None
+        self._digests = {field: self._digest(value) for field, value in fields.items()}
+        try:
+            return decode_session(fields, **history_options)
+        except Exception as e:
+            logging.error(f"Ignoring unreadable session {self.session_id}: {e}")
+            return None
+
+    def save(self, state):
+        """Writes the changed fields; returns how many fields were written."""
+        fields = encode_session(state)
+        changed = {}
+        for field, value in fields.items():
+            # Archive chunks never change once written
+            if field.startswith("chat_archive:") and field in self._digests:
+                continue
+            digest = self._digest(value)
+            if self._digests.get(field) != digest:
+                changed[field] = value
+                self._digests[field] = digest
+        removed = [field for field in self._digests if field not in fields]
+        if not changed and not removed:
+            return 0
+        removed_digests = {field: self._digests.pop(field) for field in removed}
+        try:
+            self.store.save(self.session_id, changed, removed)
+        except Exception as e:
+            # Roll back the digests so the next save retries these fields
+            for field in changed:
+                self._digests.pop(field, None)
+            self._digests.update(removed_digests)
+            logging.error(f"Failed to save session {self.session_id}: {e}")
+            return 0
+        return len(changed)
@@ -0,0 +1,11 @@
+"""
+Knowledge base retrieval shared by the Part2 backend and frontend: HTML parsing,
+quantized embedding storage, the IVF index, the hot-reloading indexer, per-plan
+comparison retrieval and the Hebrew/English text utilities.
+"""
+from .kb_indexer import KnowledgeBaseIndexer, KnowledgeBaseSnapshot
+from .search import semantic_search_knowledge_base
+from .context_builder import build_context
+from .comparison import compare_plans, comparison_table, plan_context, plan_label
+from .embeddings import EMBEDDING_MODEL, embedding_flight, get_embedding, get_embeddings
+from .text_utils import detect_language, normalize_text, tokenize
@@ -0,0 +1,359 @@
+import os
+import copy
+import json
+import time
+import logging
+import numpy as np
+
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+TRAIN_POINTS_PER_LIST = 64
+# A store-backed index reads vectors from the store in blocks of this many rows
+ADD_BLOCK_ROWS = 4096
+
+
+def normalize_rows(vectors):
+    """L2-normalizes each row so a dot product equals cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def kmeans(vectors, n_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Spherical k-means over normalized vectors.
+
+    Returns:
+        np.ndarray: (n_clusters, dim) normalized centroids.
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = vectors[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                # Re-seed empty clusters with a random point
+                centroids[c] = vectors[rng.integers(len(vectors))]
+        centroids = normalize_rows(centroids)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF) approximate nearest-neighbour index over cosine similarity.
+
+    Vectors are clustered into `n_lists` cells with k-means. A query only scans the
+    `nprobe` cells whose centroids are closest to it, so query cost grows with
+    n / n_lists * nprobe instead of n. Raising `nprobe` trades latency for recall;
+    nprobe == n_lists is an exact search.
+
+    Given an EmbeddingStore, the cells hold only row ids into it and the probed rows
+    are scored (and rescored) by the store, so the index adds no copy of the
+    vectors. Without one, each cell keeps its normalized float32 vectors.
+    """
+
+    def __init__(self, dim, n_lists=None, nprobe=DEFAULT_NPROBE, seed=0, store=None):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.seed = seed
+        self.store = store
+        self.centroids = None
+        self._list_keys = []
+        self._list_vectors = []
+        self._list_rows = []
+        self._key_to_list = {}
+        # Inserts and deletes since the centroids were trained, a measure of how far
+        # the data may have drifted from them
+        self.updates_since_train = 0
+
+    def __len__(self):
+        return len(self._key_to_list)
+
+    def __contains__(self, key):
+        return key in self._key_to_list
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def copy(self):
+        """
+        A copy that can be updated without affecting searches on this index. Cell
+        arrays are shared: updates replace them rather than writing into them.
+        """
+        index = copy.copy(self)
+        index._list_keys = [list(keys) for keys in self._list_keys]
+        index._list_vectors = list(self._list_vectors)
+        index._list_rows = list(self._list_rows)
+        index._key_to_list = dict(self._key_to_list)
+        return index
+
+    def bind(self, store):
+        """
+        Points a store-backed index at another store holding (at least) its keys,
+        such as the next snapshot's, re-resolving every cell to rows in that store.
+        """
+        self.store = store
+        self._list_rows = [store.rows(keys) for keys in self._list_keys]
+
+    def train(self, vectors):
+        """Learns the cell centroids from a sample of the given vectors."""
+        vectors = normalize_rows(vectors)
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(vectors))))
+        rng = np.random.default_rng(self.seed)
+        max_train = n_lists * TRAIN_POINTS_PER_LIST
+        if len(vectors) > max_train:
+            vectors = vectors[rng.choice(len(vectors), max_train, replace=False)]
+        self.centroids = kmeans(vectors, n_lists, seed=self.seed)
+        self.n_lists = len(self.centroids)
+        self._list_keys = [[] for _ in range(self.n_lists)]
+        if self.store is None:
+            self._list_vectors = [np.empty((0, self.dim), dtype=np.float32) for _ in range(self.n_lists)]
+        else:
+            self._list_rows = [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)]
+        self._key_to_list = {}
+        self.updates_since_train = 0
+        logging.debug(f"Trained IVF index with {self.n_lists} lists on {len(vectors)} vectors")
+
+    def add(self, keys, vectors=None):
+        """
+        Inserts (or replaces) vectors. Trains the index on the first batch if needed.
+        A store-backed index reads the vectors of the keys from its store when none
+        are given.
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        if vectors is None:
+            self._add_from_store(keys)
+            return
+        vectors = normalize_rows(vectors)
+        if not self.is_trained:
+            self.train(vectors)
+        else:
+            self.updates_since_train += len(keys)
+        self._remove([key for key in keys if key in self._key_to_list])
+
+        assignments = np.argmax(vectors @ self.centroids.T, axis=1)
+        for list_id in np.unique(assignments):
+            mask = assignments == list_id
+            new_keys = [key for key, m in zip(keys, mask) if m]
+            if self.store is None:
+                self._list_vectors[list_id] = np.vstack([self._list_vectors[list_id], vectors[mask]])
+            else:
+                self._list_rows[list_id] = np.concatenate([self._list_rows[list_id], self.store.rows(new_keys)])
+            self._list_keys[list_id].extend(new_keys)
+            for key in new_keys:
+                self._key_to_list[key] = int(list_id)
+
+    def _add_from_store(self, keys):
+        # Only a training sample and one block at a time are dequantized
+        initial = not self.is_trained
+        if initial:
+            n_lists = self.n_lists or max(1, int(np.sqrt(len(keys))))
+            max_train = n_lists * TRAIN_POINTS_PER_LIST
+            sample = keys
+            if len(keys) > max_train:
+                rng = np.random.default_rng(self.seed)
+                sample = [keys[i] for i in np.sort(rng.choice(len(keys), max_train, replace=False))]
+            self.n_lists = n_lists
+            self.train(self.store.vectors(sample))
+        for start in range(0, len(keys), ADD_BLOCK_ROWS):
+            block = keys[start:start + ADD_BLOCK_ROWS]
+            self.add(block, self.store.vectors(block))
+        if initial:
+            self.updates_since_train = 0
+
+    def remove(self, keys):
+        """Deletes the given keys; unknown keys are ignored."""
+        self.updates_since_train += self._remove(keys)
+
+    def _remove(self, keys):
+        by_list = {}
+        for key in keys:
+            list_id = self._key_to_list.pop(key, None)
+            if list_id is not None:
+                by_list.setdefault(list_id, set()).add(key)
+        for list_id, removed in by_list.items():
+            keep = [i for i, key in enumerate(self._list_keys[list_id]) if key not in removed]
+            self._list_keys[list_id] = [self._list_keys[list_id][i] for i in keep]
+            if self.store is None:
+                self._list_vectors[list_id] = np.asarray(self._list_vectors[list_id][keep])
+            else:
+                self._list_rows[list_id] = self._list_rows[list_id][keep]
+        return sum(len(removed) for removed in by_list.values())
+
+    def search(self, query, top_k=3, nprobe=None, key_filter=None, rescore=True):
+        """
+        Finds the approximate top_k most similar keys to the query vector.
+
+        With a key_filter, cells are scanned in order of centroid similarity until at
+        least top_k keys passed the filter, so a selective filter widens the probe
+        beyond `nprobe` cells instead of returning fewer results.
+
+        Args:
+            query (list | np.ndarray): Query embedding.
+            top_k (int): Number of results.
+            nprobe (int): Minimum number of cells to scan (defaults to self.nprobe).
+            key_filter (callable): Optional predicate; keys for which it returns False are skipped.
+            rescore (bool): For a store-backed index, re-rank with the store's exact vectors.
+
+        Returns:
+            list: (score, key) tuples sorted by descending score.
+        """
+        if not self.is_trained or not len(self):
+            return []
+        query = normalize_rows(query)[0]
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        list_order = np.argsort(-(self.centroids @ query))
+
+        cells = self._list_vectors if self.store is None else self._list_rows
+        candidate_keys = []
+        candidate_cells = []
+        for probed, list_id in enumerate(list_order):
+            if probed >= nprobe and (key_filter is None or len(candidate_keys) >= top_k):
+                break
+            keys = self._list_keys[list_id]
+            if not keys:
+                continue
+            cell = cells[list_id]
+            if key_filter is not None:
+                mask = [key_filter(key) for key in keys]
+                keys = [key for key, m in zip(keys, mask) if m]
+                cell = cell[np.asarray(mask, dtype=bool)]
+            candidate_keys.extend(keys)
+            candidate_cells.append(cell)
+        if not candidate_keys:
+            return []
+        if self.store is not None:
+            return self.store.search(query, top_k, rescore=rescore, rows=np.concatenate(candidate_cells))
+
+        scores = np.concatenate(candidate_cells) @ query
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), candidate_keys[i]) for i in top]
+
+    def save(self, directory):
+        """
+        Persists the index to a directory. Vectors are written as one contiguous
+        array so that `load(..., mmap=True)` can keep them on disk; a store-backed
+        index writes none, the store holds them.
+        """
+        os.makedirs(directory, exist_ok=True)
+        offsets = np.cumsum([0] + [len(keys) for keys in self._list_keys])
+        np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        if self.store is None:
+            vectors = (np.concatenate(self._list_vectors) if self._list_vectors
+                       else np.empty((0, self.dim), dtype=np.float32))
+            np.save(os.path.join(directory, "vectors.npy"), vectors)
+        with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "dim": self.dim,
+                "n_lists": self.n_lists,
+                "nprobe": self.nprobe,
+                "seed": self.seed,
+                "store_backed": self.store is not None,
+                "offsets": offsets.tolist(),
+                "keys": [key for keys in self._list_keys for key in keys],
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory, mmap=False, store=None):
+        """
+        Loads an index written by `save`. With mmap=True the vectors stay on disk and
+        only the scanned cells are paged in; cells touched by later inserts or
+        deletes are copied into memory. A store-backed index needs the store holding
+        its keys.
+        """
+        with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("store_backed") and store is None:
+            raise ValueError(f"The index in {directory} is store-backed; pass the embedding store")
+        index = cls(meta["dim"], n_lists=meta["n_lists"], nprobe=meta["nprobe"], seed=meta["seed"])
+        index.centroids = np.load(os.path.join(directory, "centroids.npy"))
+        vectors = None
+        if not meta.get("store_backed"):
+            vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r" if mmap else None)
+        offsets = meta["offsets"]
+        keys = meta["keys"]
+        for list_id in range(index.n_lists):
+            start, end = offsets[list_id], offsets[list_id + 1]
+            index._list_keys.append(keys[start:end])
+            if vectors is not None:
+                index._list_vectors.append(vectors[start:end])
+            for key in keys[start:end]:
+                index._key_to_list[key] = list_id
+        if meta.get("store_backed"):
+            index.bind(store)
+        return index
+
+
+def exact_search(keys, vectors, query, top_k=3):
+    """
+    Brute-force cosine search over already normalized vectors, used as ground truth
+    for the recall benchmark.
+    """
+    scores = vectors @ normalize_rows(query)[0]
+    top = np.argsort(-scores)[:top_k]
+    return [(float(scores[i]), keys[i]) for i in top]
+
+
+def benchmark_recall(index, keys, vectors, queries, top_k=4, nprobes=(1, 2, 4, 8, 16)):
+    """
+    Measures recall@k and mean query latency of the index against exact search.
+
+    Returns:
+        list: One dict per nprobe value with recall, latency_ms and exact_latency_ms.
+    """
+    normalized = normalize_rows(vectors)
+    ground_truth = []
+    start = time.perf_counter()
+    for query in queries:
+        ground_truth.append({key for _, key in exact_search(keys, normalized, query, top_k)})
+    exact_latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = []
+    for nprobe in nprobes:
+        hits = 0
+        start = time.perf_counter()
+        results = [index.search(query, top_k, nprobe=nprobe) for query in queries]
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        for truth, result in zip(ground_truth, results):
+            hits += len(truth & {key for _, key in result})
+        report.append({
+            "nprobe": nprobe,
+            "recall": hits / (len(queries) * top_k),
+            "latency_ms": latency_ms,
+            "exact_latency_ms": exact_latency_ms,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    # Synthetic clustered corpus standing in for a large knowledge base
+    rng = np.random.default_rng(42)
+    dim = 1536
+    for n in (2000, 8000, 32000):
+        centers = rng.normal(size=(64, dim)).astype(np.float32)
+        data = centers[rng.integers(64, size=n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+        data_keys = [f"doc_{i}" for i in range(n)]
+        queries = data[rng.integers(n, size=50)] + 0.1 * rng.normal(size=(50, dim)).astype(np.float32)
+
+        start = time.perf_counter()
+        ivf = IVFIndex(dim)
+        ivf.add(data_keys, data)
+        build_s = time.perf_counter() - start
+
+        print(f"\n--- n={n}, n_lists={ivf.n_lists}, build={build_s:.2f}s ---")
+        for row in benchmark_recall(ivf, data_keys, data, queries):
+            print(f"nprobe={row['nprobe']:>3}  recall@4={row['recall']:.3f}  "
+                  f"ivf={row['latency_ms']:.2f}ms  exact={row['exact_latency_ms']:.2f}ms")
@@ -0,0 +1,132 @@
+import logging
+import weakref
+
+from .kb_parser import matches_user_plan
+from .context_builder import build_context
+from .search import BUDGET_CANDIDATES_FACTOR
+
+# Cell lookup per knowledge base snapshot, built on the first comparison against it
+_cell_indexes = weakref.WeakKeyDictionary()
+
+
+def plan_label(hmo_name, insurance_tier):
+    """Display name of a plan, e.g. "מכבי (זהב)"."""
+    return f"{hmo_name} ({insurance_tier})" if insurance_tier else hmo_name
+
+
+def _cell_index(snapshot):
+    """(filename, para_num, service, hmo, tier) -> record key over the snapshot's table records."""
+    index = _cell_indexes.get(snapshot)
+    if index is None:
+        index = {}
+        for key, record in snapshot.kb.items():
+            metadata = record["metadata"]
+            if metadata.get("type") == "table":
+                index[(metadata["filename"], metadata["para_num"], metadata["service"], metadata["hmo"], metadata["tier"])] = key
+        _cell_indexes[snapshot] = index
+    return index
+
+
+def _benefit(record):
+    """The benefit text of a table cell, without its "topic - service - hmo (tier): " prefix."""
+    metadata = record["metadata"]
+    tier_label = f" ({metadata['tier']})" if metadata["tier"] else ""
+    prefix = f"{metadata['topic']} - {metadata['service']} - {metadata['hmo']}{tier_label}: "
+    text = record["text"]
+    return text[len(prefix):] if text.startswith(prefix) else text
+
+
+def compare_plans(query_embedding, snapshot, plans, top_k=3, rescore=True, query=None, token_budget=None):
+    """
+    Retrieves once for a question comparing several plans and slices the result per plan.
+
+    A single search runs over the prose records and the table cells of every compared
+    plan. The best top_k distinct table rows (services) are kept, and for each plan
+    the cell of each row is looked up directly, so every plan is answered over the
+    same services even if its own cells ranked lower. Prose records are shared by all
+    plans and, with a token_budget (and the query text), built by build_context.
+
+    Args:
+        query_embedding (list): Embedding of the question.
+        snapshot (KnowledgeBaseSnapshot): The snapshot to search.
+        plans (list): (hmo_name, insurance_tier) tuples; either part may be None.
+        top_k (int): Number of services compared, and of prose records considered.
+
+    Returns:
+        dict: {"shared": prose snippet, "services": [(topic, service, source)],
+            "cells": {plan: [benefit or None per service]}, "sources": record keys used}
+    """
+    result = {"shared": "", "services": [], "cells": {plan: [] for plan in plans}, "sources": []}
+    if query_embedding is None or not plans:
+        return result
+    kb = snapshot.kb
+
+    def key_filter(key):
+        return any(matches_user_plan(kb[key], hmo_name, insurance_tier) for hmo_name, insurance_tier in plans)
+
+    budgeted = bool(token_budget) and query is not None
+    n_candidates = top_k * len(plans) * (BUDGET_CANDIDATES_FACTOR if budgeted else 1)
+    if snapshot.index is not None:
+        results = snapshot.index.search(query_embedding, n_candidates, key_filter=key_filter, rescore=rescore)
+    else:
+        results = snapshot.store.search(query_embedding, n_candidates, key_filter=key_filter, rescore=rescore)
+
+    prose, rows = [], []
+    for score, key in results:
+        record = kb[key]
+        metadata = record["metadata"]
+        if metadata.get("type") != "table":
+            if len(prose) < top_k * (BUDGET_CANDIDATES_FACTOR if budgeted else 1):
+                prose.append((score, key, record))
+            continue
+        row = (metadata["filename"], metadata["para_num"], metadata["service"], metadata["topic"])
+        if row not in rows and len(rows) < top_k:
+            rows.append(row)
+
+    if budgeted:
+        result["shared"], result["sources"] = build_context(query, prose, token_budget=token_budget)
+    else:
+        prose = prose[:top_k]
+        result["shared"] = "\n\n---\n\n".join(
+            f"{record['text']} (Source: {record['metadata']['filename']}, Paragraph: {record['metadata']['para_num']})"
+            for _, _, record in prose
+        )
+        result["sources"] = [key for _, key, _ in prose]
+
+    cells = _cell_index(snapshot)
+    for filename, para_num, service, topic in rows:
+        result["services"].append((topic, service, f"{filename}, Paragraph: {para_num}"))
+        for plan in plans:
+            hmo_name, insurance_tier = plan
+            # Cells without tier lines apply to every tier of the fund
+            key = cells.get((filename, para_num, service, hmo_name, insurance_tier)) or cells.get(
+                (filename, para_num, service, hmo_name, None)
+            )
+            result["cells"][plan].append(_benefit(kb[key]) if key else None)
+            if key:
+                result["sources"].append(key)
+    logging.debug("Comparison of %d plans over %d services: %s", len(plans), len(rows), result["sources"])
+    return result
+
+
+def comparison_table(result):
+    """Renders the per-plan cells as a compact markdown table: one row per service, one column per plan."""
+    plans = list(result["cells"])
+    lines = [
+        "| Service | " + " | ".join(plan_label(*plan) for plan in plans) + " |",
+        "|---" * (len(plans) + 1) + "|",
+    ]
+    for position, (topic, service, _) in enumerate(result["services"]):
+        cells = [(result["cells"][plan][position] or "-").replace("|", "/") for plan in plans]
+        lines.append(f"| {topic} - {service} | " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def plan_context(result, plan):
+    """The context of one plan's answer: the shared prose followed by that plan's cells."""
+    lines = [
+        f"{topic} - {service} - {plan_label(*plan)}: {benefit} (Source: {source})"
+        for (topic, service, source), benefit in zip(result["services"], result["cells"][plan])
+        if benefit
+    ]
+    return "\n\n---\n\n".join(part for part in (result["shared"], "\n".join(lines)) if part)
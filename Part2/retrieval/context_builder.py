@@ -0,0 +1,119 @@
+import re
+
+from .text_utils import tokenize, estimate_tokens
+
+DEFAULT_TOKEN_BUDGET = 1200
+# Weight of the parent record's embedding score vs. word overlap with the query
+RECORD_SCORE_WEIGHT = 0.7
+# MMR trade-off between relevance (1.0) and diversity (0.0)
+MMR_LAMBDA = 0.7
+# Units whose word sets overlap at least this much are near-duplicates
+DUPLICATE_THRESHOLD = 0.8
+SENTENCE_SPLIT_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+MIN_UNIT_CHARS = 3
+
+
+def split_units(record):
+    """Splits a record into selectable units: one per table row, sentences for prose."""
+    text = record["text"].strip()
+    if record["metadata"].get("type") == "table":
+        return [text]
+    units = [unit.strip() for unit in SENTENCE_SPLIT_PATTERN.split(text)]
+    return [unit for unit in units if len(unit) >= MIN_UNIT_CHARS]
+
+
+def _overlap(a, b):
+    """Jaccard similarity of two word sets."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _source_line(record):
+    metadata = record["metadata"]
+    return f" (Source: {metadata['filename']}, Paragraph: {metadata['para_num']})"
+
+
+def build_context(query, matches, token_budget=DEFAULT_TOKEN_BUDGET, mmr_lambda=MMR_LAMBDA,
+                  duplicate_threshold=DUPLICATE_THRESHOLD):
+    """
+    Builds the LLM context from retrieved records under a token budget.
+
+    Records are split into sentences (table records stay whole rows), each unit is
+    scored by its record's similarity to the query plus its word overlap with the
+    query, near-duplicates are dropped, and units are picked by maximal marginal
+    relevance until the budget (checked with estimate_tokens) is used up. The kept
+    units are grouped back per record, in their original order, with the source.
+
+    Args:
+        query (str): The user question.
+        matches (list): (score, key, record) tuples from the search, best first.
+        token_budget (int): Maximum estimated tokens of the returned context.
+
+    Returns:
+        tuple: (context text, list of record keys that contributed units)
+    """
+    query_words = set(tokenize(query))
+    units = []
+    for rank, (score, key, record) in enumerate(matches):
+        for position, text in enumerate(split_units(record)):
+            words = set(tokenize(text))
+            overlap = len(query_words & words) / len(query_words) if query_words else 0.0
+            relevance = RECORD_SCORE_WEIGHT * float(score) + (1 - RECORD_SCORE_WEIGHT) * overlap
+            units.append({
+                "key": key, "record": record, "rank": rank, "position": position,
+                "text": text, "words": words, "relevance": relevance,
+                "tokens": estimate_tokens(text) + 1,
+            })
+
+    # Drop near-duplicates, keeping the more relevant copy. Two sets whose sizes differ
+    # by more than the threshold ratio cannot reach it, so only similar sizes are compared.
+    units.sort(key=lambda unit: unit["relevance"], reverse=True)
+    distinct = []
+    for unit in units:
+        size = len(unit["words"])
+        if all(
+            min(size, len(kept["words"])) < duplicate_threshold * max(size, len(kept["words"]))
+            or _overlap(unit["words"], kept["words"]) < duplicate_threshold
+            for kept in distinct
+        ):
+            distinct.append(unit)
+
+    # Maximal marginal relevance under the token budget. Each candidate's redundancy
+    # (its max overlap with the selected units) is kept up to date against the newly
+    # selected unit only, so a pick costs O(candidates) instead of O(candidates * selected).
+    for unit in distinct:
+        unit["redundancy"] = 0.0
+    selected = []
+    used_tokens = 0
+    cited = set()
+    separator_tokens = estimate_tokens("\n\n---\n\n")
+    candidates = distinct
+    while candidates:
+        if token_budget - used_tokens < min(unit["tokens"] for unit in candidates):
+            break
+        best, best_value = None, None
+        for unit in candidates:
+            value = mmr_lambda * unit["relevance"] - (1 - mmr_lambda) * unit["redundancy"]
+            if best_value is None or value > best_value:
+                best, best_value = unit, value
+        candidates = [unit for unit in candidates if unit is not best]
+        cost = best["tokens"]
+        if best["key"] not in cited:
+            cost += estimate_tokens(_source_line(best["record"])) + separator_tokens
+        if used_tokens + cost > token_budget:
+            continue
+        selected.append(best)
+        cited.add(best["key"])
+        used_tokens += cost
+        for unit in candidates:
+            unit["redundancy"] = max(unit["redundancy"], _overlap(unit["words"], best["words"]))
+
+    by_record = {}
+    for unit in sorted(selected, key=lambda unit: (unit["rank"], unit["position"])):
+        by_record.setdefault(unit["key"], []).append(unit)
+    blocks = [
+        " ".join(unit["text"] for unit in record_units) + _source_line(record_units[0]["record"])
+        for record_units in by_record.values()
+    ]
+    return "\n\n---\n\n".join(blocks), list(by_record)
@@ -0,0 +1,39 @@
+import logging
+from .text_utils import clean_text
+from .single_flight import SingleFlight
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_BATCH_SIZE = 64
+
+# Concurrent requests embedding the same question share one API call
+embedding_flight = SingleFlight()
+
+
+def get_embedding(client, text):
+    """Embeds a single text, returning None on failure."""
+    # Niqqud is stripped so pointed and unpointed spellings embed alike
+    cleaned = clean_text(text)
+    return embedding_flight.do((id(client), cleaned), lambda: _embed_one(client, cleaned))
+
+
+def _embed_one(client, text):
+    try:
+        response = client.embeddings.create(input=[text], model=EMBEDDING_MODEL)
+        return response.data[0].embedding
+    except Exception as e:
+        logging.error(f"Failed to get embedding for text. Error: {e}")
+        return None
+
+
+def get_embeddings(client, texts):
+    """Embeds a list of texts in batches, returning None for any batch that failed."""
+    embeddings = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = [clean_text(text) for text in texts[start:start + EMBEDDING_BATCH_SIZE]]
+        try:
+            response = client.embeddings.create(input=batch, model=EMBEDDING_MODEL)
+            embeddings.extend(item.embedding for item in response.data)
+        except Exception as e:
+            logging.error(f"Failed to get embeddings for batch starting at {start}. Error: {e}")
+            embeddings.extend([None] * len(batch))
+    return embeddings
@@ -0,0 +1,270 @@
+import os
+import re
+import glob
+import time
+import hashlib
+import logging
+import threading
+from types import MappingProxyType
+
+from .kb_parser import parse_html_document
+from .ann_index import IVFIndex
+from .vector_store import EmbeddingStore
+
+DEFAULT_POLL_INTERVAL = 2.0
+MAX_EMBED_CHARS = 5000
+# The ANN index is retrained once inserts and deletes since its last training
+# exceed this fraction of the records; until then changes are applied in place
+ANN_RETRAIN_DRIFT = 0.2
+EXACT_FILE_PATTERN = re.compile(r"kb_exact_(\d+)_v\d+\.npy")
+
+
+class KnowledgeBaseSnapshot:
+    """
+    An immutable, versioned view of the knowledge base: parsed records, their
+    embeddings and the optional ANN index. A query keeps using the snapshot it
+    started with even if the indexer swaps in a newer one meanwhile.
+
+    `kb` is a read-only mapping and the store's arrays are frozen, so one snapshot
+    can be handed to every session without copying. `key` is a cheap cache key:
+    a fingerprint of the record keys and texts, computed once per build. It depends
+    on the content only, not on `version` (a per-process build counter), so it is
+    identical across processes and restarts holding the same content.
+    """
+
+    def __init__(self, version, kb, store, index=None, text_hashes=None, file_state=None):
+        self.version = version
+        self.kb = MappingProxyType(kb)
+        self.store = store
+        self.index = index
+        self.text_hashes = MappingProxyType(text_hashes or {})
+        self.file_state = MappingProxyType(file_state or {})
+        self.built_at = time.time()
+        fingerprint = hashlib.sha1(
+            "".join(f"{key}\0{h}\n" for key, h in sorted(self.text_hashes.items())).encode("utf-8")
+        ).hexdigest()
+        self.key = f"kb-{fingerprint[:16]}"
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _process_alive(pid):
+    """
+    Whether a process with this id is running. On Windows it is not checked (os.kill
+    would terminate it); removing a file still mapped by a live worker fails there.
+    """
+    if os.name == "nt":
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class KnowledgeBaseIndexer:
+    """
+    Watches the knowledge base directory and keeps an up-to-date snapshot.
+
+    Every `poll_interval` seconds the directory is scanned (mtime + size per file).
+    Only files that changed are re-parsed, and only records whose text is new or
+    modified are sent to the embedding API; the rest reuse the vectors of the
+    previous snapshot. The new snapshot is swapped in with a single assignment.
+    """
+
+    def __init__(self, directory, embed_fn, poll_interval=DEFAULT_POLL_INTERVAL, storage_dtype="int8",
+                 rescore=True, cache_dir=".kb_cache", ann_min_records=2000, ann_nprobe=8,
+                 ann_retrain_drift=ANN_RETRAIN_DRIFT):
+        self.directory = directory
+        self.embed_fn = embed_fn
+        self.poll_interval = poll_interval
+        self.storage_dtype = storage_dtype
+        self.rescore = rescore
+        self.cache_dir = cache_dir
+        self.ann_min_records = ann_min_records
+        self.ann_nprobe = ann_nprobe
+        self.ann_retrain_drift = ann_retrain_drift
+
+        self._snapshot = KnowledgeBaseSnapshot(0, {}, EmbeddingStore.from_embeddings({}))
+        self._records_by_file = {}
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.last_checked_at = None
+        self.last_error = None
+        self.stale = True
+        self._remove_stale_exact_files()
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def _scan(self):
+        state = {}
+        for filepath in glob.glob(os.path.join(self.directory, "*.html")):
+            stat = os.stat(filepath)
+            state[os.path.basename(filepath)] = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def refresh(self):
+        """
+        Re-indexes changed files and swaps in a new snapshot.
+
+        Returns:
+            bool: True if a new snapshot was published.
+        """
+        with self._refresh_lock:
+            try:
+                return self._refresh()
+            except Exception as e:
+                self.last_error = str(e)
+                self.stale = True
+                logging.error(f"Knowledge base refresh failed: {e}")
+                return False
+            finally:
+                self.last_checked_at = time.time()
+
+    def _refresh(self):
+        current = self._snapshot
+        file_state = self._scan()
+        changed = [name for name, state in file_state.items() if current.file_state.get(name) != state]
+        removed = [name for name in current.file_state if name not in file_state]
+        if not changed and not removed:
+            self.stale = False
+            return False
+
+        records_by_file = dict(self._records_by_file)
+        for name in removed:
+            records_by_file.pop(name, None)
+        for name in changed:
+            with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                records_by_file[name] = parse_html_document(f.read(), name)
+
+        kb = {key: rec for records in records_by_file.values() for key, rec in records.items()}
+        hashes = {key: text_hash(rec["text"][:MAX_EMBED_CHARS]) for key, rec in kb.items()}
+
+        # Reuse vectors for texts that were already embedded in the previous snapshot
+        previous_by_hash = {h: key for key, h in current.text_hashes.items() if key in current.store}
+        embeddings = {}
+        to_embed = []
+        for key, h in hashes.items():
+            if h in previous_by_hash:
+                embeddings[key] = current.store.get(previous_by_hash[h])
+            else:
+                to_embed.append(key)
+        if to_embed:
+            vectors = self.embed_fn([kb[key]["text"][:MAX_EMBED_CHARS] for key in to_embed])
+            embeddings.update(zip(to_embed, vectors))
+        failed = [key for key in to_embed if embeddings.get(key) is None]
+
+        version = current.version + 1
+        store = EmbeddingStore.from_embeddings(
+            embeddings,
+            dtype=self.storage_dtype,
+            keep_exact=self.rescore,
+            exact_path=os.path.join(self.cache_dir, f"kb_exact_{os.getpid()}_v{version}.npy"),
+        )
+        index = self._update_index(current, store, hashes)
+
+        # Failed records keep no hash so the next refresh retries them
+        state_for_snapshot = dict(file_state)
+        for key in failed:
+            hashes.pop(key, None)
+            state_for_snapshot.pop(kb[key]["metadata"]["filename"], None)
+
+        self._snapshot = KnowledgeBaseSnapshot(version, kb, store, index, hashes, state_for_snapshot)
+        self._records_by_file = records_by_file
+        self.stale = bool(failed)
+        self.last_error = f"{len(failed)} records failed to embed" if failed else None
+        logging.info(
+            f"Knowledge base v{version}: {len(changed)} changed, {len(removed)} removed files, "
+            f"{len(to_embed)} records embedded, {len(kb)} total"
+        )
+        self._remove_old_exact_files(keep=version)
+        return True
+
+    def _update_index(self, current, store, hashes):
+        """
+        The ANN index for the new store: the previous index with the added, changed
+        and removed records applied, or a freshly trained one if there was none or
+        the updates since its training exceed `ann_retrain_drift`.
+        """
+        if len(store) < self.ann_min_records:
+            return None
+        previous = current.index
+        if previous is not None:
+            updated = [key for key in store.keys if key not in previous or current.text_hashes.get(key) != hashes.get(key)]
+            removed = [key for key in current.store.keys if key not in store]
+            drift = previous.updates_since_train + len(updated) + len(removed)
+            if drift <= self.ann_retrain_drift * len(store):
+                # Searches on the previous snapshot keep using the unmodified index
+                index = previous.copy()
+                index.remove(removed)
+                index.bind(store)
+                index.add(updated)
+                return index
+        # The index cells hold row ids into the store, which scores the probed rows
+        index = IVFIndex(dim=store.dim, nprobe=self.ann_nprobe, store=store)
+        index.add(store.keys)
+        logging.info(f"Trained ANN index over {len(store)} records")
+        return index
+
+    def _remove_old_exact_files(self, keep):
+        # Files are per process so several workers can share one cache dir. Older
+        # snapshots still mapping these files keep working on POSIX after unlink; on
+        # Windows the unlink fails while they are mapped and is retried next refresh.
+        for path in glob.glob(os.path.join(self.cache_dir, f"kb_exact_{os.getpid()}_v*.npy")):
+            if path.endswith(f"_v{keep}.npy"):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _remove_stale_exact_files(self):
+        """Removes exact-vector files left in the cache dir by workers that have exited."""
+        for path in glob.glob(os.path.join(self.cache_dir, "kb_exact_*_v*.npy")):
+            match = EXACT_FILE_PATTERN.fullmatch(os.path.basename(path))
+            if not match or int(match.group(1)) == os.getpid() or _process_alive(int(match.group(1))):
+                continue
+            try:
+                os.remove(path)
+                logging.info(f"Removed stale knowledge base file {path}")
+            except OSError:
+                pass
+
+    def _watch(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self.refresh()
+
+    def start(self):
+        """Starts the background watcher thread (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._watch, name="kb-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def status(self):
+        """Index version and staleness, for display and health checks."""
+        snapshot = self._snapshot
+        now = time.time()
+        return {
+            "version": snapshot.version,
+            "key": snapshot.key,
+            "records": len(snapshot.kb),
+            "built_at": snapshot.built_at,
+            "age_seconds": now - snapshot.built_at,
+            "seconds_since_check": now - self.last_checked_at if self.last_checked_at else None,
+            "stale": self.stale,
+            "last_error": self.last_error,
+        }
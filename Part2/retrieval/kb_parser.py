@@ -0,0 +1,238 @@
+import os
+import re
+import logging
+from html.parser import HTMLParser
+
+# Health funds and insurance tiers as they appear in the phase2_data tables
+HMO_NAMES = ["מכבי", "מאוחדת", "כללית"]
+INSURANCE_TIERS = ["זהב", "כסף", "ארד"]
+
+# Matches a single tier line inside a table cell, e.g. "זהב: חינם פעמיים בשנה"
+TIER_LINE_PATTERN = re.compile(r"^\s*(" + "|".join(INSURANCE_TIERS) + r")\s*:\s*(.+)$")
+
+BLOCK_TAGS = {"p", "li", "ul", "ol", "div", "h1", "h2", "h3", "h4"}
+HEADING_TAGS = {"h1", "h2", "h3", "h4"}
+
+
+class KnowledgeBaseHTMLParser(HTMLParser):
+    """
+    Walks a phase2_data HTML page and splits it into prose sections and table rows.
+
+    Prose is grouped into sections that start at each heading, so a heading stays
+    together with the paragraphs and lists that follow it. Tables are kept as a list
+    of rows, each row being a list of cell texts (line breaks preserved).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.sections = []  # list of ("prose", text) or ("table", rows)
+        self._prose_lines = []
+        self._current_line = []
+        self._in_heading = False
+        self._heading_text = []
+        self._in_table = False
+        self._rows = []
+        self._row = None
+        self._cell = None
+
+    # -- helpers -------------------------------------------------------------
+    def _end_line(self):
+        line = re.sub(r"[ \t]+", " ", "".join(self._current_line)).strip()
+        if line:
+            self._prose_lines.append(line)
+        self._current_line = []
+
+    def _flush_prose(self):
+        self._end_line()
+        if self._prose_lines:
+            self.sections.append(("prose", "\n".join(self._prose_lines)))
+        self._prose_lines = []
+
+    # -- HTMLParser callbacks ------------------------------------------------
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self._flush_prose()
+            self._in_table = True
+            self._rows = []
+        elif self._in_table:
+            if tag == "tr":
+                self._row = []
+            elif tag in ("td", "th"):
+                # Some pages omit <tr> around the header cells
+                if self._row is None:
+                    self._row = []
+                self._cell = []
+            elif tag == "br" and self._cell is not None:
+                self._cell.append("\n")
+        elif tag in HEADING_TAGS:
+            self._flush_prose()
+            self._in_heading = True
+            self._heading_text = []
+        elif tag in BLOCK_TAGS or tag == "br":
+            self._end_line()
+
+    def handle_endtag(self, tag):
+        if self._in_table:
+            if tag in ("td", "th") and self._cell is not None:
+                lines = [re.sub(r"\s+", " ", line).strip() for line in "".join(self._cell).split("\n")]
+                self._row.append("\n".join(line for line in lines if line))
+                self._cell = None
+            elif tag == "tr" and self._row is not None:
+                self._rows.append(self._row)
+                self._row = None
+            elif tag == "table":
+                if self._row:
+                    self._rows.append(self._row)
+                self._row = None
+                self.sections.append(("table", self._rows))
+                self._in_table = False
+        elif tag in HEADING_TAGS and self._in_heading:
+            heading = re.sub(r"\s+", " ", "".join(self._heading_text)).strip()
+            if heading and not self.title:
+                self.title = heading
+            self._in_heading = False
+            self._current_line.append(heading)
+            self._end_line()
+        elif tag in BLOCK_TAGS:
+            self._end_line()
+
+    def handle_data(self, data):
+        if self._in_table:
+            if self._cell is not None:
+                self._cell.append(data)
+        elif self._in_heading:
+            self._heading_text.append(data)
+        else:
+            # Loose text lines (e.g. trailing "Citations:") are kept as prose
+            parts = data.split("\n")
+            for i, part in enumerate(parts):
+                if i > 0:
+                    self._end_line()
+                self._current_line.append(part)
+
+    def close(self):
+        super().close()
+        self._flush_prose()
+
+
+def split_tier_cell(cell_text):
+    """
+    Splits a table cell into its per-tier benefits.
+
+    Returns:
+        list: (tier, benefit) tuples. If the cell has no tier prefixes the whole cell
+        is returned with tier None.
+    """
+    tiers = []
+    for line in cell_text.split("\n"):
+        match = TIER_LINE_PATTERN.match(line)
+        if match:
+            tiers.append((match.group(1), match.group(2).strip()))
+        elif tiers:
+            # Continuation of the previous tier line
+            tier, benefit = tiers[-1]
+            tiers[-1] = (tier, f"{benefit} {line.strip()}")
+    if not tiers and cell_text.strip():
+        return [(None, cell_text.strip())]
+    return tiers
+
+
+def parse_html_document(raw_html, filename):
+    """
+    Parses a knowledge base HTML page into retrieval records.
+
+    Prose sections become one record each. Every table cell is split into one record
+    per (service, hmo, tier), so the chat context can carry only the cells that
+    match the user's health fund and insurance tier.
+
+    Args:
+        raw_html (str): Contents of the HTML file.
+        filename (str): Base name of the file, stored in the record metadata.
+
+    Returns:
+        dict: Mapping of record key to {"text": ..., "metadata": {...}}.
+    """
+    parser = KnowledgeBaseHTMLParser()
+    parser.feed(raw_html)
+    parser.close()
+
+    records = {}
+    topic = parser.title
+    for para_num, (kind, content) in enumerate(parser.sections):
+        if kind == "prose":
+            records[f"{filename}_para_{para_num}"] = {
+                "text": content,
+                "metadata": {
+                    "filename": filename,
+                    "para_num": para_num,
+                    "type": "prose",
+                    "topic": topic,
+                },
+            }
+            continue
+
+        rows = [row for row in content if row]
+        if not rows:
+            continue
+        header, body = rows[0], rows[1:]
+        hmo_columns = header[1:]
+        for row_num, row in enumerate(body):
+            service = row[0]
+            for hmo, cell in zip(hmo_columns, row[1:]):
+                for tier, benefit in split_tier_cell(cell):
+                    key = f"{filename}_row_{row_num}_{hmo}_{tier or 'all'}"
+                    tier_label = f" ({tier})" if tier else ""
+                    records[key] = {
+                        "text": f"{topic} - {service} - {hmo}{tier_label}: {benefit}",
+                        "metadata": {
+                            "filename": filename,
+                            "para_num": para_num,
+                            "type": "table",
+                            "topic": topic,
+                            "service": service,
+                            "hmo": hmo,
+                            "tier": tier,
+                        },
+                    }
+    return records
+
+
+def load_knowledge_base_dir(directory):
+    """
+    Parses every .html file in `directory` into a single knowledge base dict.
+    """
+    kb = {}
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".html"):
+            continue
+        with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+            kb.update(parse_html_document(f.read(), filename))
+    logging.debug(f"Parsed {len(kb)} knowledge base records from {directory}")
+    return kb
+
+
+def build_table_index(kb):
+    """
+    Builds a (service, hmo, tier) -> record key lookup over the table records.
+    """
+    return {
+        (rec["metadata"]["service"], rec["metadata"]["hmo"], rec["metadata"]["tier"]): key
+        for key, rec in kb.items()
+        if rec["metadata"].get("type") == "table"
+    }
+
+
+def matches_user_plan(record, hmo_name=None, insurance_tier=None):
+    """
+    Returns True if the record is relevant to the given health fund and tier.
+    Prose records are shared across funds and always match.
+    """
+    metadata = record["metadata"]
+    if metadata.get("type") != "table":
+        return True
+    if hmo_name and metadata.get("hmo") != hmo_name:
+        return False
+    if insurance_tier and metadata.get("tier") not in (None, insurance_tier):
+        return False
+    return True
@@ -0,0 +1,54 @@
+import logging
+
+from .kb_parser import matches_user_plan
+from .context_builder import build_context
+
+# With a token budget, this many times top_k records are retrieved as candidates
+BUDGET_CANDIDATES_FACTOR = 3
+
+
+def semantic_search_knowledge_base(query_embedding, snapshot, top_k=3, hmo_name=None, insurance_tier=None,
+                                   rescore=True, query=None, token_budget=None):
+    """
+       Performs semantic search using embeddings to find top matching paragraphs
+       from a knowledge base snapshot for the user's query.
+       When hmo_name / insurance_tier are given, table records of other funds and
+       tiers are skipped so only the user's own cells reach the LLM.
+       If the snapshot has an ANN index it is used instead of scanning every paragraph.
+       With a token_budget (and the query text), more candidates are retrieved and the
+       snippet is built sentence by sentence by build_context to fit the budget.
+
+       Returns:
+           tuple: (combined snippet, list of matched record keys)
+       """
+    if query_embedding is None:
+        return "", []
+    kb = snapshot.kb
+
+    def key_filter(key):
+        return matches_user_plan(kb[key], hmo_name, insurance_tier)
+
+    budgeted = bool(token_budget) and query is not None
+    n_candidates = top_k * BUDGET_CANDIDATES_FACTOR if budgeted else top_k
+    if snapshot.index is not None:
+        results = snapshot.index.search(query_embedding, n_candidates, key_filter=key_filter, rescore=rescore)
+    else:
+        results = snapshot.store.search(query_embedding, n_candidates, key_filter=key_filter, rescore=rescore)
+    top_matches = [(score, key, kb[key]) for score, key in results]
+
+    if budgeted:
+        combined_snippet, keys = build_context(query, top_matches, token_budget=token_budget)
+        logging.debug("Context from %d of %d candidates: %s", len(keys), len(top_matches), keys)
+        return combined_snippet, keys
+
+    # Combine matched paragraphs and metadata as context for the LLM
+    combined_snippet = "\n\n---\n\n".join(
+        [
+            f"{match[2]['text']} (Source: {match[2]['metadata']['filename']}, Paragraph: {match[2]['metadata']['para_num']})"
+            for match in top_matches]
+    )
+
+    keys = [match[1] for match in top_matches]
+    logging.debug("Top matches: %s", keys)
+
+    return combined_snippet, keys
@@ -0,0 +1,51 @@
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key across threads: the first caller
+    runs `fn`, callers arriving while it runs block until it finishes and get the
+    same result (or exception). Nothing is kept once the call has finished.
+
+    `on_shared` (if set) is called each time a caller joins a call already in flight.
+    """
+
+    def __init__(self, on_shared=None):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.on_shared = on_shared
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if self.on_shared is not None:
+                self.on_shared()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
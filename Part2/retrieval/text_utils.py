@@ -0,0 +1,130 @@
+"""
+Language detection and Hebrew text normalization shared by retrieval, the
+intake validators and cache keys.
+"""
+import re
+import logging
+
+# Hebrew points and cantillation marks (the letters themselves are U+05D0-U+05EA);
+# maqaf, paseq, sof pasuq and nun hafukha are punctuation and are kept
+NIQQUD_PATTERN = re.compile("[֑-ׇֽֿׁׂׅׄ]")
+HEBREW_LETTER_PATTERN = re.compile("[א-ת]")
+LATIN_LETTER_PATTERN = re.compile("[A-Za-z]")
+FINAL_LETTERS = str.maketrans({"ך": "כ", "ם": "מ", "ן": "נ", "ף": "פ", "ץ": "צ"})
+# Words, keeping apostrophes and geresh/gershayim inside them ("it's", צ'ק, מע"מ)
+TOKEN_PATTERN = re.compile(r"\w+(?:['\"׳״]\w+)*")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Share of letters from one script needed to decide without langdetect
+SCRIPT_DECISION_RATIO = 0.7
+
+
+def strip_niqqud(text):
+    """Removes Hebrew vowel points and cantillation marks."""
+    return NIQQUD_PATTERN.sub("", text)
+
+
+def normalize_final_letters(text):
+    """Maps Hebrew final letters (ך ם ן ף ץ) to their regular forms."""
+    return text.translate(FINAL_LETTERS)
+
+
+def clean_text(text):
+    """Strips niqqud and collapses whitespace, keeping the text otherwise unchanged."""
+    return WHITESPACE_PATTERN.sub(" ", strip_niqqud(text or "")).strip()
+
+
+def normalize_text(text, fold_finals=True):
+    """
+    Normalizes text for matching: strips niqqud, lower-cases, collapses whitespace
+    and (by default) folds Hebrew final letters.
+    """
+    text = clean_text(text).lower()
+    return normalize_final_letters(text) if fold_finals else text
+
+
+def tokenize(text, fold_finals=True):
+    """
+    Splits text into normalized word tokens.
+
+    Args:
+        text (str): Hebrew and/or English text.
+        fold_finals (bool): Fold Hebrew final letters so "כסף" and "כספ" match.
+
+    Returns:
+        list[str]: The tokens, in order.
+    """
+    return TOKEN_PATTERN.findall(normalize_text(text, fold_finals))
+
+
+def detect_script(text):
+    """
+    Decides he/en from the Unicode blocks of the letters in the text.
+
+    Returns:
+        str | None: "he" or "en", or None if there are no letters or the scripts are mixed.
+    """
+    hebrew = len(HEBREW_LETTER_PATTERN.findall(text or ""))
+    latin = len(LATIN_LETTER_PATTERN.findall(text or ""))
+    total = hebrew + latin
+    if total == 0:
+        return None
+    if hebrew / total >= SCRIPT_DECISION_RATIO:
+        return "he"
+    if latin / total >= SCRIPT_DECISION_RATIO:
+        return "en"
+    return None
+
+
+def detect_language(text, default="en"):
+    """
+    Detects whether text is Hebrew or English. The script detector decides almost
+    every input; langdetect is only loaded and consulted for mixed-script text.
+
+    Returns:
+        str: "he" or "en".
+    """
+    script = detect_script(text)
+    if script is not None:
+        return script
+    if not text or not text.strip():
+        return default
+    try:
+        from langdetect import detect
+        return "he" if detect(text) == "he" else "en"
+    except Exception as e:
+        logging.debug(f"langdetect failed: {e}")
+        return default
+
+
+# Rough tokens per character for the GPT tokenizers: Hebrew letters are split into
+# far more tokens than English text
+HEBREW_TOKENS_PER_CHAR = 0.6
+OTHER_TOKENS_PER_CHAR = 0.27
+
+
+def estimate_tokens(text):
+    """
+    Estimates the GPT token count of a text without a tokenizer. Errs slightly high,
+    so budgets enforced with it hold for the real tokenizer too.
+    """
+    if not text:
+        return 0
+    hebrew = len(HEBREW_LETTER_PATTERN.findall(text))
+    return int(hebrew * HEBREW_TOKENS_PER_CHAR + (len(text) - hebrew) * OTHER_TOKENS_PER_CHAR) + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cuts text (at a word boundary where possible) so its estimate fits max_tokens."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    space = cut.rfind(" ")
+    return cut[:space] if space > low * 0.8 else cut
@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import logging
+import numpy as np
+
+from .ann_index import normalize_rows
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+# Scoring is done in row blocks so dequantizing never materializes the full matrix
+SCORE_BLOCK_ROWS = 4096
+RESCORE_CANDIDATES_FACTOR = 4
+
+
+class EmbeddingStore:
+    """
+    Compact, contiguous storage for the knowledge base embeddings.
+
+    Vectors are L2-normalized and kept as one (n, dim) array in float32, float16 or
+    int8 (one float32 scale per vector). Search scores every row against the
+    quantized matrix, then optionally rescores the best candidates with the exact
+    float32 vectors. The exact vectors can live in a memory-mapped file so they do
+    not count against the process memory.
+    """
+
+    def __init__(self, keys, codes, scales=None, dtype="float32", exact=None, exact_path=None):
+        self.keys = list(keys)
+        self.dtype = dtype
+        self._codes = codes
+        self._scales = scales
+        self._exact = exact
+        self._exact_path = exact_path
+        self._positions = {key: i for i, key in enumerate(self.keys)}
+        # Stores are shared read-only by every session and thread, so the arrays are frozen
+        for array in (codes, scales, exact):
+            if array is not None and not isinstance(array, np.memmap):
+                array.flags.writeable = False
+
+    @classmethod
+    def from_embeddings(cls, embeddings, dtype="int8", keep_exact=False, exact_path=None):
+        """
+        Builds a store from a {key: vector} dict. Keys whose vector is None are dropped.
+
+        Args:
+            embeddings (dict): Mapping of record key to embedding (list of floats).
+            dtype (str): One of "float32", "float16", "int8".
+            keep_exact (bool): Keep float32 vectors for rescoring.
+            exact_path (str): If given, the exact vectors are written there as .npy and
+                memory-mapped instead of held in memory.
+        """
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+        keys = [key for key, emb in embeddings.items() if emb is not None]
+        if not keys:
+            return cls([], np.empty((0, 0), dtype=np.float32), dtype="float32")
+        vectors = normalize_rows([embeddings[key] for key in keys])
+
+        scales = None
+        if dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            codes = np.round(vectors / scales[:, None]).astype(np.int8)
+            scales = scales.astype(np.float32)
+        else:
+            codes = vectors.astype(dtype)
+
+        exact = None
+        if keep_exact and dtype != "float32":
+            if exact_path:
+                os.makedirs(os.path.dirname(exact_path) or ".", exist_ok=True)
+                np.save(exact_path, vectors)
+                exact = np.load(exact_path, mmap_mode="r")
+            else:
+                exact = vectors
+        return cls(keys, codes, scales=scales, dtype=dtype, exact=exact, exact_path=exact_path if exact is not None else None)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def __getstate__(self):
+        # A memory-mapped exact matrix is reopened from its file instead of pickled
+        state = self.__dict__.copy()
+        if self._exact_path:
+            state["_exact"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._exact_path and os.path.exists(self._exact_path):
+            self._exact = np.load(self._exact_path, mmap_mode="r")
+
+    @property
+    def dim(self):
+        return self._codes.shape[1]
+
+    @property
+    def nbytes(self):
+        """Bytes held in memory by the quantized vectors (excludes memory-mapped data)."""
+        total = self._codes.nbytes
+        if self._scales is not None:
+            total += self._scales.nbytes
+        if self._exact is not None and not isinstance(self._exact, np.memmap):
+            total += self._exact.nbytes
+        return total
+
+    def _dequantize(self, rows):
+        block = np.asarray(self._codes[rows], dtype=np.float32)
+        if self._scales is not None:
+            block *= self._scales[rows, None]
+        return block
+
+    def get(self, key, default=None):
+        """Returns the (dequantized) vector for a key, mirroring dict.get."""
+        pos = self._positions.get(key)
+        if pos is None:
+            return default
+        if self._exact is not None:
+            return np.asarray(self._exact[pos])
+        return self._dequantize(slice(pos, pos + 1))[0]
+
+    def rows(self, keys):
+        """Row positions of the given keys, for restricting `score` and `search`."""
+        return np.fromiter((self._positions[key] for key in keys), dtype=np.int64, count=len(keys))
+
+    def vectors(self, keys=None):
+        """Returns a float32 matrix for the given keys (all keys by default)."""
+        rows = np.arange(len(self.keys)) if keys is None else self.rows(list(keys))
+        if self._exact is not None:
+            return np.asarray(self._exact[rows])
+        return self._dequantize(rows)
+
+    def score(self, query, rows=None):
+        """Approximate cosine similarity of the query against every stored vector, or the given rows."""
+        query = normalize_rows(query)[0]
+        n = len(self.keys) if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCORE_BLOCK_ROWS):
+            block = slice(start, start + SCORE_BLOCK_ROWS)
+            scores[block] = self._dequantize(block if rows is None else rows[block]) @ query
+        return scores
+
+    def search(self, query, top_k=3, key_filter=None, rescore=True, candidates=None, rows=None):
+        """
+        Finds the top_k most similar keys to the query vector.
+
+        Args:
+            query (list | np.ndarray): Query embedding.
+            top_k (int): Number of results.
+            key_filter (callable): Optional predicate; keys for which it returns False are skipped.
+            rescore (bool): Re-rank the best candidates with the exact vectors, if kept.
+            candidates (int): Candidates passed to rescoring (default top_k * 4).
+            rows (np.ndarray): Only score these rows (see `rows`); all rows by default.
+
+        Returns:
+            list: (score, key) tuples sorted by descending score.
+        """
+        if not self.keys or (rows is not None and not len(rows)):
+            return []
+        scores = self.score(query, rows)
+        if key_filter is not None:
+            keys = self.keys if rows is None else [self.keys[row] for row in rows]
+            mask = np.fromiter((key_filter(key) for key in keys), dtype=bool, count=len(keys))
+            scores[~mask] = -np.inf
+
+        do_rescore = rescore and self._exact is not None
+        n_candidates = (candidates or top_k * RESCORE_CANDIDATES_FACTOR) if do_rescore else top_k
+        n_candidates = min(n_candidates, len(scores))
+        top = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+        top = top[np.isfinite(scores[top])]
+        top_rows = top if rows is None else rows[top]
+
+        if do_rescore and len(top):
+            # Sorted rows keep reads from a memory-mapped file sequential
+            top_rows = np.sort(top_rows)
+            final = np.asarray(self._exact[top_rows]) @ normalize_rows(query)[0]
+        else:
+            final = scores[top]
+        order = np.argsort(-final)[:top_k]
+        return [(float(final[i]), self.keys[top_rows[i]]) for i in order]
+
+
+def python_list_nbytes(embeddings):
+    """Approximate memory held by a {key: list-of-floats} embeddings dict."""
+    total = 0
+    for emb in embeddings.values():
+        if emb is None:
+            continue
+        total += sys.getsizeof(emb) + sum(sys.getsizeof(x) for x in emb)
+    return total
+
+
+def benchmark_storage(embeddings, queries, top_k=4):
+    """
+    Compares memory and recall@k of each storage mode against exact float32 search.
+
+    Returns:
+        list: One dict per (dtype, rescore) combination.
+    """
+    exact = EmbeddingStore.from_embeddings(embeddings, dtype="float32")
+    truth = [{key for _, key in exact.search(q, top_k)} for q in queries]
+    baseline_bytes = python_list_nbytes(embeddings)
+
+    report = []
+    for dtype in STORAGE_DTYPES:
+        store = EmbeddingStore.from_embeddings(embeddings, dtype=dtype, keep_exact=True)
+        for rescore in ((False, True) if dtype != "float32" else (False,)):
+            start = time.perf_counter()
+            results = [store.search(q, top_k, rescore=rescore) for q in queries]
+            latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            hits = sum(len(t & {key for _, key in r}) for t, r in zip(truth, results))
+            quantized_bytes = store._codes.nbytes + (store._scales.nbytes if store._scales is not None else 0)
+            report.append({
+                "dtype": dtype,
+                "rescore": rescore,
+                "recall": hits / (len(queries) * top_k),
+                "latency_ms": latency_ms,
+                "bytes": quantized_bytes,
+                "shrink_vs_lists": baseline_bytes / quantized_bytes,
+            })
+    logging.debug(f"Storage benchmark: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(7)
+    dim, n = 1536, 3000
+    centers = rng.normal(size=(40, dim))
+    data = centers[rng.integers(40, size=n)] + 0.6 * rng.normal(size=(n, dim))
+    kb_embeddings = {f"para_{i}": data[i].tolist() for i in range(n)}
+    queries = data[rng.integers(n, size=100)] + 0.2 * rng.normal(size=(100, dim))
+
+    print(f"Python lists: {python_list_nbytes(kb_embeddings) / 1e6:.1f} MB for {n} vectors")
+    for row in benchmark_storage(kb_embeddings, queries):
+        print(f"{row['dtype']:>8} rescore={str(row['rescore']):<5} recall@4={row['recall']:.3f} "
+              f"{row['bytes'] / 1e6:6.1f} MB ({row['shrink_vs_lists']:.0f}x smaller) {row['latency_ms']:.2f}ms")
@@ -0,0 +1,7 @@
+"""
+Metrics (Prometheus text format), request tracing (JSON-lines spans) and the
+queued logging setup shared by the Part2 backend and frontend. No external dependencies.
+"""
+from .metrics import Counter, Histogram, render_metrics, watch_event_loop_lag
+from .tracing import Tracer, current_span, parse_traceparent, TRACEPARENT_HEADER
+from .logs import configure_logging, clip
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+
+from .tracing import current_span
+
+# Per-environment defaults; each can still be overridden by its own variable below.
+# development: everything at DEBUG as readable text. production: INFO as JSON lines,
+# with only a sample of DEBUG records (if LOG_LEVEL is lowered) and shorter fields.
+LOG_PROFILES = {
+    "development": {"level": "DEBUG", "format": "text", "debug_sample_rate": 1.0, "field_max_chars": 2000},
+    "production": {"level": "INFO", "format": "json", "debug_sample_rate": 0.01, "field_max_chars": 300},
+}
+LOG_QUEUE_SIZE = 10000
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+# Attributes every LogRecord has; anything else was passed through `extra=` and is
+# emitted as a structured field
+RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "service", "trace_id"}
+
+_field_max_chars = LOG_PROFILES["development"]["field_max_chars"]
+_listener = None
+
+
+class Clipped:
+    """A value whose string form is cut to `limit` characters, computed only when rendered."""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else repr(self.value)
+        limit = self.limit or _field_max_chars
+        if len(text) <= limit:
+            return text
+        return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+    __repr__ = __str__
+
+
+def clip(value, limit=None):
+    """
+    Wraps a bulky value (knowledge snippet, message list) for a log call. Nothing is
+    converted to a string unless the record is actually emitted, and then only the
+    first `limit` characters (LOG_FIELD_MAX_CHARS by default) are kept.
+
+        logging.debug("Snippet: %s", clip(snippet))
+    """
+    return Clipped(value, limit)
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the service name and the current trace id (on the calling thread)."""
+
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def filter(self, record):
+        record.service = self.service
+        span = current_span()
+        record.trace_id = span.trace_id if span else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps every record at INFO and above, and a `rate` fraction of DEBUG records."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that leaves all formatting to the listener thread. The stock
+    QueueHandler formats the message before enqueueing it; here the record is
+    queued as is, so callers must pass immutable (or `clip`-wrapped) arguments.
+    When the queue is full, records are dropped instead of blocking the request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; fields passed via `extra=` are clipped and included."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "service": getattr(record, "service", None),
+            "logger": record.name,
+            "message": str(clip(record.getMessage())),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        for name, value in vars(record).items():
+            if name not in RESERVED_ATTRS:
+                entry[name] = value if isinstance(value, (int, float, bool, type(None))) else str(clip(value))
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(service, env=None):
+    """
+    Sends all logging through a bounded in-memory queue to a background listener
+    thread, which formats the records and writes them to stderr (and LOG_FILE if set).
+    Request threads only filter the record and enqueue it. Safe to call repeatedly
+    (Streamlit re-runs the script); only the first call configures anything.
+
+    Args:
+        service (str): Service name added to every record ("backend", "frontend").
+        env (str): Profile from LOG_PROFILES; defaults to the LOG_ENV variable.
+    """
+    global _listener, _field_max_chars
+    if _listener is not None:
+        return
+
+    env = env or os.getenv("LOG_ENV", "development")
+    profile = LOG_PROFILES.get(env, LOG_PROFILES["development"])
+    level = os.getenv("LOG_LEVEL", profile["level"]).upper()
+    log_format = os.getenv("LOG_FORMAT", profile["format"])
+    sample_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", str(profile["debug_sample_rate"])))
+    _field_max_chars = int(os.getenv("LOG_FIELD_MAX_CHARS", str(profile["field_max_chars"])))
+    log_file = os.getenv("LOG_FILE")
+
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = LazyQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    queue_handler.addFilter(ContextFilter(service))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import logging
+import secrets
+import threading
+import contextvars
+from contextlib import contextmanager
+
+TRACEPARENT_HEADER = "traceparent"
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+def new_span_id():
+    return secrets.token_hex(8)
+
+
+def parse_traceparent(header):
+    """Returns (trace_id, parent_span_id) from a W3C traceparent header, or (None, None)."""
+    match = TRACEPARENT_PATTERN.match((header or "").strip().lower())
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+class SpanExporter:
+    """
+    Writes finished spans as JSON lines from a background thread, so request
+    threads never block on file I/O.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def export(self, span):
+        self._queue.put(span)
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    return
+                f.write(json.dumps(span, ensure_ascii=False) + "\n")
+                if self._queue.empty():
+                    f.flush()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=2)
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self._start_perf = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def traceparent(self):
+        """Header value that makes this span the parent of the callee's spans."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self):
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+        }
+        if self.error:
+            record["error"] = self.error
+        return record
+
+
+class Tracer:
+    """
+    Minimal tracer: spans nest through a context variable (so they follow asyncio
+    tasks and threadpool calls) and are exported as JSON lines to `export_path`.
+    With no export path, spans are still timed but not written anywhere.
+    """
+
+    def __init__(self, service, export_path=None):
+        self.service = service
+        self.exporter = SpanExporter(export_path) if export_path else None
+
+    @contextmanager
+    def span(self, name, traceparent=None, **attributes):
+        """
+        Opens a span as a child of the current one. A `traceparent` header starts
+        the span inside the caller's trace; with neither, a new trace begins.
+        """
+        parent = _current_span.get()
+        trace_id, parent_id = parse_traceparent(traceparent) if traceparent else (None, None)
+        if trace_id is None:
+            trace_id = parent.trace_id if parent else new_trace_id()
+            parent_id = parent.span_id if parent else None
+        span = Span(name, trace_id, parent_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - span._start_perf
+            _current_span.reset(token)
+            if self.exporter is not None:
+                record = span.to_dict()
+                record["service"] = self.service
+                self.exporter.export(record)
+            logging.debug("span %s %.1fms trace=%s", span.name, span.duration * 1000, span.trace_id)
+
+
+def current_span():
+    return _current_span.get()
@@ -0,0 +1,12 @@
+"""
+Helpers shared by Part 1 and Part 2: settings loaded once from .env, the
+process-wide pooled Azure clients, the Azure OpenAI rate limiter / priority
+scheduler, the versioned prompt registry and a local Azure OpenAI stand-in for
+testing them.
+"""
+from . import settings
+from .rate_limit import (
+    PRIORITY_CHAT, PRIORITY_INTAKE, PRIORITY_BATCH,
+    RateLimitedClient, RateLimitWaitTimeout, get_limiter,
+)
+from .prompts import PromptTemplate, register, get_prompt, prompt_versions, cache_report
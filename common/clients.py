@@ -0,0 +1,115 @@
+import logging
+import threading
+import importlib.util
+
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI
+
+from . import settings
+
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _shared(key, factory):
+    """Creates the client for `key` on first use and hands the same one out afterwards."""
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = factory()
+    return client
+
+
+def _http_options(max_connections, timeout):
+    # A caller sizing the pool itself (e.g. to its concurrency limit) keeps all of it warm
+    keepalive = max_connections or settings.AZURE_HTTP_KEEPALIVE_CONNECTIONS
+    max_connections = max_connections or settings.AZURE_HTTP_MAX_CONNECTIONS
+    return {
+        "http2": settings.AZURE_HTTP2 and HTTP2_AVAILABLE,
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(max_connections, keepalive),
+            keepalive_expiry=settings.AZURE_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(timeout or settings.AZURE_HTTP_TIMEOUT, connect=settings.AZURE_HTTP_CONNECT_TIMEOUT),
+    }
+
+
+def get_openai_client(max_connections=None, timeout=None, max_retries=None):
+    """
+    The process-wide synchronous Azure OpenAI client, created on first use.
+
+    Every module of the process shares its connection pool, so calls reuse warm
+    keep-alive connections instead of opening new TLS sessions. Callers asking for
+    different pool size / timeout / retries get (and share) a separate client.
+
+    Args:
+        max_connections (int): Connection pool size (AZURE_HTTP_MAX_CONNECTIONS by default).
+        timeout (float): Read timeout in seconds (AZURE_HTTP_TIMEOUT by default).
+        max_retries (int): Retries of the OpenAI client (AZURE_MAX_RETRIES by default). A
+            RateLimitedClient makes these retries itself, through its limiter.
+    """
+    def create():
+        settings.require_openai_settings()
+        logging.info("Creating the shared Azure OpenAI client")
+        return AzureOpenAI(
+            api_key=settings.AZURE_OPENAI_API_KEY,
+            api_version=settings.AZURE_OPENAI_API_VERSION,
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            max_retries=settings.AZURE_MAX_RETRIES if max_retries is None else max_retries,
+            http_client=httpx.Client(**_http_options(max_connections, timeout)),
+        )
+
+    return _shared(("openai", max_connections, timeout, max_retries), create)
+
+
+def get_async_openai_client(max_connections=None, timeout=None, max_retries=None):
+    """
+    The process-wide asynchronous Azure OpenAI client, created on first use (from
+    within the event loop that will use it). Same options as `get_openai_client`.
+    """
+    def create():
+        settings.require_openai_settings()
+        logging.info("Creating the shared async Azure OpenAI client")
+        return AsyncAzureOpenAI(
+            api_key=settings.AZURE_OPENAI_API_KEY,
+            api_version=settings.AZURE_OPENAI_API_VERSION,
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            max_retries=settings.AZURE_MAX_RETRIES if max_retries is None else max_retries,
+            http_client=httpx.AsyncClient(**_http_options(max_connections, timeout)),
+        )
+
+    return _shared(("async_openai", max_connections, timeout, max_retries), create)
+
+
+def get_document_intelligence_client():
+    """The process-wide Azure Document Intelligence client, created on first use."""
+    def create():
+        # Imported here so services that never run OCR do not load the Azure SDK
+        from azure.ai.documentintelligence import DocumentIntelligenceClient
+        from azure.core.credentials import AzureKeyCredential
+
+        settings.require_document_intelligence_settings()
+        logging.info("Creating the shared Azure Document Intelligence client")
+        return DocumentIntelligenceClient(
+            settings.AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT,
+            AzureKeyCredential(settings.AZURE_DOCUMENT_INTELLIGENCE_KEY),
+            connection_timeout=settings.AZURE_HTTP_CONNECT_TIMEOUT,
+            read_timeout=settings.AZURE_HTTP_TIMEOUT,
+        )
+
+    return _shared(("document_intelligence",), create)
+
+
+async def aclose_async_clients():
+    """Closes the async clients created so far (e.g. on server shutdown)."""
+    with _lock:
+        keys = [key for key in _clients if key[0] == "async_openai"]
+        clients = [_clients.pop(key) for key in keys]
+    for client in clients:
+        await client.close()
@@ -0,0 +1,345 @@
+"""
+Local stand-in for an Azure OpenAI resource, for trying the rate limiter (and the
+chat services) without a real quota. It answers chat completions (plain or
+streamed) with a canned answer and embeddings with deterministic vectors, and
+enforces per-deployment requests/tokens-per-minute quotas over a sliding minute
+the way Azure does: over quota, it returns 429 with a Retry-After header. It also
+imitates prompt caching: a chat request whose leading messages were already seen
+reports them as cached_tokens (from 1024 tokens, in 128-token steps, like Azure).
+For load tests, response latency can be drawn from a log-normal distribution and a
+share of calls can fail with a 500 or a 429.
+
+    python -m common.mock_azure --port 8089 --rpm 30 --tpm 20000
+
+Point the services at it with AZURE_OPENAI_ENDPOINT=http://localhost:8089.
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import logging
+import threading
+from collections import deque, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .rate_limit import rough_token_estimate
+
+PATH_PATTERN = re.compile(r"^/openai/deployments/([^/]+)/(chat/completions|embeddings)$")
+WINDOW = 60.0
+EMBEDDING_DIMENSIONS = 1536
+DEFAULT_ANSWER = "This is a mock answer from the local Azure OpenAI stand-in."
+# Prompt caching: minimum cached prefix, cache granularity and prefixes remembered per deployment
+CACHE_MIN_TOKENS = 1024
+CACHE_BLOCK_TOKENS = 128
+CACHE_MAX_PREFIXES = 10000
+
+
+class QuotaWindow:
+    """Requests and tokens accepted in the last minute for one deployment."""
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.entries = deque()
+        self.tokens = 0
+        self.lock = threading.Lock()
+
+    def admit(self, cost):
+        """Records the call and returns 0, or returns the seconds until it would fit."""
+        with self.lock:
+            now = time.monotonic()
+            while self.entries and now - self.entries[0][0] >= WINDOW:
+                self.tokens -= self.entries.popleft()[1]
+            over_requests = self.rpm and len(self.entries) >= self.rpm
+            over_tokens = self.tpm and self.tokens + cost > self.tpm
+            if over_requests or over_tokens:
+                oldest = self.entries[0][0] if self.entries else now
+                return max(1.0, WINDOW - (now - oldest))
+            self.entries.append((now, cost))
+            self.tokens += cost
+            return 0
+
+
+class PromptCache:
+    """Message prefixes seen recently for one deployment (hashed, least recently used dropped first)."""
+
+    def __init__(self, min_tokens):
+        self.min_tokens = min_tokens
+        self.prefixes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, messages):
+        """Returns the cached tokens of the prompt and remembers its prefixes."""
+        digest = hashlib.blake2b(digest_size=16)
+        cached = tokens = 0
+        with self.lock:
+            for message in messages:
+                digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+                tokens += rough_token_estimate(str(message.get("content", "")))
+                key = digest.hexdigest()
+                if key in self.prefixes:
+                    self.prefixes.move_to_end(key)
+                    cached = tokens
+                else:
+                    self.prefixes[key] = None
+            while len(self.prefixes) > CACHE_MAX_PREFIXES:
+                self.prefixes.popitem(last=False)
+        if cached < self.min_tokens:
+            return 0
+        return cached - cached % CACHE_BLOCK_TOKENS
+
+
+class MockAzureOpenAI:
+    """
+    Args:
+        rpm (int): Requests per minute per deployment (0 = unlimited).
+        tpm (int): Tokens per minute per deployment, counting the prompt and max_tokens.
+        latency (float): Seconds before each response (and between streamed chunks / 10).
+        embedding_latency (float): Median latency of embedding calls (`latency` if None).
+        answer (str): Text returned by chat completions.
+        cache_min_tokens (int): Shortest message prefix reported as cached.
+        latency_sigma (float): Spread of the log-normal latency around `latency` (0 = fixed).
+        error_rate (float): Share of calls answered with a 500.
+        throttle_rate (float): Share of calls answered with a 429, on top of the quotas.
+    """
+
+    def __init__(self, rpm=0, tpm=0, latency=0.0, answer=DEFAULT_ANSWER, cache_min_tokens=CACHE_MIN_TOKENS,
+                 latency_sigma=0.0, error_rate=0.0, throttle_rate=0.0, embedding_latency=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.embedding_latency = latency if embedding_latency is None else embedding_latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.answer = answer
+        self.cache_min_tokens = cache_min_tokens
+        self.windows = {}
+        self.caches = {}
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        # (monotonic time, deployment, status) of recent calls, for tests
+        self.calls = deque(maxlen=10000)
+        self.forced_throttles = deque()
+
+    def window(self, deployment):
+        with self.lock:
+            if deployment not in self.windows:
+                self.windows[deployment] = QuotaWindow(self.rpm, self.tpm)
+            return self.windows[deployment]
+
+    def prompt_cache(self, deployment):
+        with self.lock:
+            if deployment not in self.caches:
+                self.caches[deployment] = PromptCache(self.cache_min_tokens)
+            return self.caches[deployment]
+
+    def sample_latency(self, operation="chat/completions"):
+        """Seconds before a response: the configured latency is the median of the log-normal distribution."""
+        median = self.embedding_latency if operation == "embeddings" else self.latency
+        if not median or not self.latency_sigma:
+            return median
+        return median * random.lognormvariate(0, self.latency_sigma)
+
+    def throttle_next(self, count=1, retry_after=1.0):
+        """Answers the next `count` calls with a 429 asking to retry after `retry_after` seconds."""
+        with self.lock:
+            self.forced_throttles.extend([retry_after] * count)
+
+    def forced_throttle(self):
+        with self.lock:
+            return self.forced_throttles.popleft() if self.forced_throttles else 0
+
+    def record_call(self, deployment, status):
+        with self.lock:
+            self.calls.append((time.monotonic(), deployment, status))
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def embed(self, text):
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        return [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockAzureOpenAI/1.0"
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        logging.debug("mock azure: " + format % args)
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        match = PATH_PATTERN.match(self.path.split("?")[0])
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not match:
+            self.send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+            return
+        deployment, operation = match.groups()
+        self.mock.count("requests")
+
+        if operation == "embeddings":
+            inputs = body.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            prompt_tokens = sum(rough_token_estimate(text) for text in inputs)
+            cost = prompt_tokens
+        else:
+            prompt_tokens = sum(rough_token_estimate(str(m.get("content", ""))) for m in body.get("messages", []))
+            cost = prompt_tokens + (body.get("max_tokens") or 0)
+
+        if random.random() < self.mock.error_rate:
+            self.mock.count("errors")
+            self.mock.record_call(deployment, 500)
+            self.send_json(500, {"error": {"code": "InternalServerError", "message": "Injected mock failure"}})
+            return
+        retry_after = self.mock.forced_throttle()
+        if not retry_after:
+            retry_after = 1.0 if random.random() < self.mock.throttle_rate else self.mock.window(deployment).admit(cost)
+        if retry_after:
+            self.mock.count("throttled")
+            self.mock.record_call(deployment, 429)
+            self.send_json(
+                429,
+                {"error": {"code": "429", "message": f"Requests to {deployment} have exceeded the rate limit."}},
+                {"Retry-After": str(int(retry_after + 0.999)), "retry-after-ms": str(int(retry_after * 1000))},
+            )
+            return
+        self.mock.record_call(deployment, 200)
+
+        if operation != "embeddings":
+            cached_tokens = self.mock.prompt_cache(deployment).lookup(body.get("messages", []))
+            self.mock.count("prompt_tokens", prompt_tokens)
+            self.mock.count("cached_tokens", cached_tokens)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": rough_token_estimate(self.mock.answer),
+                "total_tokens": prompt_tokens + rough_token_estimate(self.mock.answer),
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            }
+
+        latency = self.mock.sample_latency(operation)
+        if latency:
+            time.sleep(latency)
+        if operation == "embeddings":
+            self.send_json(200, {
+                "object": "list",
+                "model": deployment,
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": self.mock.embed(text)}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+            })
+        elif body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            self.stream_completion(deployment, usage if include_usage else None, latency)
+        else:
+            self.send_json(200, {
+                "id": f"chatcmpl-mock-{random.getrandbits(32):x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": deployment,
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": self.mock.answer},
+                }],
+                "usage": usage,
+            })
+
+    def stream_completion(self, deployment, usage=None, latency=0.0):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        completion_id = f"chatcmpl-mock-{random.getrandbits(32):x}"
+        words = re.findall(r"\S+\s*", self.mock.answer)
+        for word in words + [None]:
+            delta = {"content": word} if word is not None else {}
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": deployment,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if word is not None else "stop"}],
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+            if word is not None and latency:
+                time.sleep(latency / 10)
+        if usage is not None:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": deployment,
+                "choices": [],
+                "usage": usage,
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class MockAzureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, mock, host="127.0.0.1", port=0):
+        super().__init__((host, port), MockHandler)
+        self.mock = mock
+
+    def start(self):
+        """Serves from a daemon thread; returns the bound port."""
+        threading.Thread(target=self.serve_forever, name="mock-azure", daemon=True).start()
+        return self.server_address[1]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Local Azure OpenAI stand-in with simulated quotas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute per deployment (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute per deployment (0 = unlimited)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--embedding-latency", type=float, help="seconds before embedding responses (default: --latency)")
+    parser.add_argument("--latency-sigma", type=float, default=0.0,
+                        help="log-normal spread of the latency around --latency (0 = fixed)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls failing with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of calls throttled with a 429")
+    parser.add_argument("--cache-min-tokens", type=int, default=CACHE_MIN_TOKENS,
+                        help="shortest prompt prefix reported as cached")
+    args = parser.parse_args()
+    mock = MockAzureOpenAI(
+        args.rpm, args.tpm, args.latency,
+        cache_min_tokens=args.cache_min_tokens,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        embedding_latency=args.embedding_latency,
+    )
+    server = MockAzureServer(mock, args.host, args.port)
+    logging.info(f"Mock Azure OpenAI listening on http://{args.host}:{server.server_address[1]}")
+    server.serve_forever()
@@ -0,0 +1,134 @@
+"""
+Versioned prompt templates and the per-process registry that holds them.
+
+A template is compiled once, when its module is imported: the system instructions,
+schema and few-shot examples become a fixed leading prefix of messages, and only
+the last user message is filled in per call. Every request made with a template
+therefore starts with byte-identical messages, which is what provider-side prompt
+caching needs in order to hit. Azure OpenAI only caches prefixes of 1024+ tokens;
+none of the current templates is that long (the largest, "form_extraction", is
+about 400 estimated tokens), so `cache_report()` is expected to show a 0 ratio.
+
+Each template has a `version_id` ("name@v<version>:<fingerprint>"), where the
+fingerprint is a hash of the template text. It changes with any edit, even one
+made without bumping `version`, so caches and evaluation reports keyed on it
+never mix answers from two prompts.
+"""
+import json
+import string
+import hashlib
+import logging
+import threading
+
+_registry = {}
+_lock = threading.Lock()
+
+
+class PromptTemplate:
+    """
+    Args:
+        name (str): Registry name, e.g. "chat" or "intake.extract_all".
+        version (int): Version number, bumped whenever the wording changes on purpose.
+        system (str): Static system instructions (and schema) opening every request.
+        user (str): str.format template of the final user message; all per-call
+            values go here, after the static prefix.
+        examples (list): Static few-shot (role, content) pairs placed after the system message.
+    """
+
+    def __init__(self, name, version, system, user, examples=()):
+        self.name = name
+        self.version = version
+        self.prefix = tuple(
+            [{"role": "system", "content": system}]
+            + [{"role": role, "content": content} for role, content in examples]
+        )
+        self.user = user
+        self.fields = {field for _, field, _, _ in string.Formatter().parse(user) if field}
+        fingerprint = hashlib.blake2b(
+            json.dumps([self.prefix, user], ensure_ascii=False).encode("utf-8"), digest_size=4
+        ).hexdigest()
+        self.version_id = f"{name}@v{version}:{fingerprint}"
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def messages(self, history=(), **values):
+        """
+        Builds the messages of one call: the static prefix, then `history` (e.g.
+        conversation memory), then the user message filled in with `values`.
+
+        Returns:
+            list: New message dicts; the prefix dicts are copied so callers may modify them.
+        """
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"Prompt {self.version_id} is missing values for: {', '.join(sorted(missing))}")
+        messages = [dict(message) for message in self.prefix]
+        messages.extend(history)
+        messages.append({"role": "user", "content": self.user.format(**values)})
+        return messages
+
+    def record_usage(self, response):
+        """
+        Adds the prompt / cached prompt tokens reported for a call made with this
+        template (a completion or the final chunk of a stream with usage).
+
+        Returns:
+            tuple: (prompt_tokens, cached_tokens) of the call, or None when it reported no usage.
+        """
+        usage = getattr(response, "usage", None)
+        if usage is None or getattr(usage, "prompt_tokens", None) is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        with _lock:
+            self.calls += 1
+            self.prompt_tokens += usage.prompt_tokens
+            self.cached_tokens += cached
+        return usage.prompt_tokens, cached
+
+    def cache_stats(self):
+        with _lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cached_ratio": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+            }
+
+
+def register(template):
+    """
+    Adds a template to the process-wide registry and returns the registered one.
+    Registering identical text again (e.g. a Streamlit rerun re-importing the
+    script) returns the existing template, keeping its usage counters. A different
+    template under the same name (the prompt was edited and the script re-run in
+    the same process) replaces the old one, whose usage counters stay with it.
+    """
+    with _lock:
+        existing = _registry.get(template.name)
+        if existing is not None and existing.version_id == template.version_id:
+            return existing
+        _registry[template.name] = template
+    if existing is None:
+        logging.debug("Registered prompt %s", template.version_id)
+    else:
+        logging.info("Replaced prompt %s with %s", existing.version_id, template.version_id)
+    return template
+
+
+def get_prompt(name):
+    return _registry[name]
+
+
+def prompt_versions():
+    """{name: version_id} of every registered template, for reports and response metadata."""
+    with _lock:
+        return {name: template.version_id for name, template in sorted(_registry.items())}
+
+
+def cache_report():
+    """Cached-token ratio per prompt version, over the calls made by this process."""
+    with _lock:
+        templates = list(_registry.values())
+    return {template.version_id: template.cache_stats() for template in templates}
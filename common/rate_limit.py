@@ -0,0 +1,523 @@
+import os
+import time
+import uuid
+import heapq
+import sqlite3
+import tempfile
+import asyncio
+import inspect
+import logging
+import itertools
+import threading
+
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError
+
+# Lower value = served first when the deployment's budget is short
+PRIORITY_CHAT = 0
+PRIORITY_INTAKE = 1
+PRIORITY_BATCH = 2
+
+# Waiters re-check the budget at least this often (seconds)
+POLL_INTERVAL = 0.05
+# After a 429 the budgets are halved (down to MIN_SCALE of the configured rate) and
+# regain RECOVERY_STEP of it with every successful call
+MIN_SCALE = 0.1
+RECOVERY_STEP = 0.02
+DEFAULT_RETRY_AFTER = 1.0
+# Retries of the wrapper (the wrapped client itself makes none): 429s wait for the
+# Retry-After pause on the limiter; connection errors and 5xx back off exponentially
+DEFAULT_MAX_RETRIES = 2
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 8.0
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+# With shared budgets, another process's waiting caller holds back lower priorities
+# until it has not polled for this many seconds (its process may have exited)
+SHARED_WAITER_TTL = 1.0
+# Processes on one host share their budgets through this file unless
+# AZURE_RATE_LIMIT_STATE names another one (or is empty: per-process budgets)
+DEFAULT_RATE_LIMIT_STATE = os.path.join(tempfile.gettempdir(), "azure_rate_limits.db")
+
+
+class RateLimitWaitTimeout(RuntimeError):
+    """Raised when a call could not be scheduled within its maximum wait."""
+
+    def __init__(self, deployment, retry_after):
+        super().__init__(f"Rate limit budget for {deployment} exhausted, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def parse_rate_limits(spec):
+    """
+    Parses "deployment=rpm:tpm,other=rpm:tpm" into {deployment: (rpm, tpm)}.
+    A 0 means that budget is not limited.
+    """
+    limits = {}
+    for entry in (spec or "").split(","):
+        if "=" not in entry:
+            continue
+        name, _, budget = entry.partition("=")
+        rpm, _, tpm = budget.partition(":")
+        limits[name.strip()] = (int(rpm or 0), int(tpm or 0))
+    return limits
+
+
+def rough_token_estimate(text):
+    """Conservative default estimate (about 3 characters per token)."""
+    return len(text) // 3 + 1
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding up to one minute's budget; 0 = unlimited."""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now, scale):
+        capacity = self.per_minute * scale
+        self.level = min(capacity, self.level + (now - self.updated) * capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount, now, scale):
+        """Seconds until `amount` is available (0 if it is available now)."""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now, scale)
+        # A call bigger than the whole bucket only waits for a full bucket
+        amount = min(amount, self.per_minute * scale)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / (self.per_minute * scale)
+
+    def take(self, amount):
+        if self.per_minute:
+            self.level -= amount
+
+
+def _restored_bucket(per_minute, level, updated):
+    bucket = TokenBucket(per_minute)
+    bucket.level = level
+    bucket.updated = updated
+    return bucket
+
+
+class SharedBudgets:
+    """
+    Deployment budgets kept in one SQLite file, so every process on the host draws
+    from the same buckets and Retry-After pause instead of a fixed share of the quota.
+
+    Each process also publishes the priority of the caller at the head of its queue.
+    A call is only admitted while no other process has a higher-priority caller
+    waiting, so interactive chat in the backend pre-empts batch indexing or
+    extraction running in another process. Times are wall-clock (shared between
+    processes), unlike the monotonic clock of the in-process buckets.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Identifies this process's queue among the waiters
+        self._owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS budgets ("
+                "deployment TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL, "
+                "scale REAL, blocked_until REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS waiters ("
+                "deployment TEXT, owner TEXT, priority INTEGER, seen REAL, "
+                "PRIMARY KEY (deployment, owner))"
+            )
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _load(self, conn, limiter, now):
+        row = conn.execute(
+            "SELECT requests, tokens, updated, scale, blocked_until FROM budgets WHERE deployment = ?",
+            (limiter.deployment,),
+        ).fetchone()
+        if row is None:
+            row = (float(limiter.requests.per_minute), float(limiter.tokens.per_minute), now, 1.0, 0.0)
+            conn.execute("INSERT INTO budgets VALUES (?, ?, ?, ?, ?, ?)", (limiter.deployment, *row))
+        return row
+
+    def try_admit(self, limiter, priority, cost):
+        """Charges the call and returns 0, or returns the seconds to wait."""
+        def admit(conn):
+            now = time.time()
+            requests, tokens, updated, scale, blocked_until = self._load(conn, limiter, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO waiters VALUES (?, ?, ?, ?)", (limiter.deployment, self._owner, priority, now)
+            )
+            ahead = conn.execute(
+                "SELECT 1 FROM waiters WHERE deployment = ? AND owner != ? AND priority < ? AND seen >= ? LIMIT 1",
+                (limiter.deployment, self._owner, priority, now - SHARED_WAITER_TTL),
+            ).fetchone()
+            if ahead:
+                return POLL_INTERVAL
+            request_bucket = _restored_bucket(limiter.requests.per_minute, requests, updated)
+            token_bucket = _restored_bucket(limiter.tokens.per_minute, tokens, updated)
+            wait = max(
+                blocked_until - now,
+                request_bucket.wait_time(1, now, scale),
+                token_bucket.wait_time(cost, now, scale),
+            )
+            if wait <= 0:
+                request_bucket.take(1)
+                token_bucket.take(cost)
+                conn.execute(
+                    "DELETE FROM waiters WHERE deployment = ? AND owner = ?", (limiter.deployment, self._owner)
+                )
+            conn.execute(
+                "UPDATE budgets SET requests = ?, tokens = ?, updated = ? WHERE deployment = ?",
+                (request_bucket.level, token_bucket.level, now, limiter.deployment),
+            )
+            return max(wait, 0)
+        return self._transaction(admit)
+
+    def withdraw(self, limiter):
+        """Removes this process's waiting caller (its queue head gave up)."""
+        def withdraw(conn):
+            conn.execute("DELETE FROM waiters WHERE deployment = ? AND owner = ?", (limiter.deployment, self._owner))
+        self._transaction(withdraw)
+
+    def record_success(self, limiter, extra_tokens):
+        """Lets the budgets recover and charges tokens used beyond the estimate; returns the new scale."""
+        def record(conn):
+            _, _, _, scale, _ = self._load(conn, limiter, time.time())
+            scale = min(1.0, scale + RECOVERY_STEP)
+            conn.execute(
+                "UPDATE budgets SET scale = ?, tokens = tokens - ? WHERE deployment = ?",
+                (scale, extra_tokens if limiter.tokens.per_minute else 0, limiter.deployment),
+            )
+            return scale
+        return self._transaction(record)
+
+    def record_rate_limited(self, limiter, retry_after):
+        """Pauses the deployment for every process and halves its budgets; returns the new scale."""
+        def record(conn):
+            now = time.time()
+            _, _, _, scale, blocked_until = self._load(conn, limiter, now)
+            scale = max(MIN_SCALE, scale / 2)
+            conn.execute(
+                "UPDATE budgets SET scale = ?, blocked_until = ? WHERE deployment = ?",
+                (scale, max(blocked_until, now + retry_after), limiter.deployment),
+            )
+            return scale
+        return self._transaction(record)
+
+
+class DeploymentLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets of one Azure OpenAI deployment.
+
+    Callers queue by priority (then arrival); only the head of the queue is admitted,
+    once both buckets hold enough for its estimated cost and no Retry-After pause is
+    active. Works for threads (`acquire`) and asyncio tasks (`acquire_async`) sharing
+    the same budget. With `shared` (SharedBudgets), the buckets and pause are those
+    of all processes using the same state file rather than this process's own.
+    """
+
+    def __init__(self, deployment, rpm=0, tpm=0, shared=None):
+        self.deployment = deployment
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.shared = shared
+        self.scale = 1.0
+        self.blocked_until = 0.0
+        self._queue = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+
+    def _try_admit(self, ticket, cost):
+        """With the lock held: admits the ticket and returns 0, or returns the seconds to wait."""
+        if self._queue[0] is not ticket:
+            return POLL_INTERVAL
+        if self.shared is not None:
+            wait = self.shared.try_admit(self, ticket[0], cost)
+            if wait > 0:
+                return wait
+        else:
+            now = time.monotonic()
+            wait = max(
+                self.blocked_until - now,
+                self.requests.wait_time(1, now, self.scale),
+                self.tokens.wait_time(cost, now, self.scale),
+            )
+            if wait > 0:
+                return wait
+            self.requests.take(1)
+            self.tokens.take(cost)
+        heapq.heappop(self._queue)
+        self._cond.notify_all()
+        return 0
+
+    def _withdraw(self, ticket):
+        if ticket in self._queue:
+            if self.shared is not None and self._queue[0] is ticket:
+                self.shared.withdraw(self)
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._cond.notify_all()
+
+    def acquire(self, cost, priority=PRIORITY_BATCH, timeout=None):
+        """Blocks until the call may be sent; raises RateLimitWaitTimeout after `timeout` seconds."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            ticket = [priority, next(self._order)]
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    wait = self._try_admit(ticket, cost)
+                    if wait == 0:
+                        return
+                    if deadline is not None and time.monotonic() + wait > deadline:
+                        raise RateLimitWaitTimeout(self.deployment, wait)
+                    self._cond.wait(timeout=min(wait, POLL_INTERVAL))
+            except BaseException:
+                self._withdraw(ticket)
+                raise
+
+    async def acquire_async(self, cost, priority=PRIORITY_CHAT, timeout=None):
+        """Asyncio version of `acquire`; waits without blocking the event loop."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            ticket = [priority, next(self._order)]
+            heapq.heappush(self._queue, ticket)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_admit(ticket, cost)
+                if wait == 0:
+                    return
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    raise RateLimitWaitTimeout(self.deployment, wait)
+                await asyncio.sleep(min(wait, POLL_INTERVAL))
+        except BaseException:
+            with self._cond:
+                self._withdraw(ticket)
+            raise
+
+    def record_success(self, estimated_tokens, used_tokens=None):
+        """Lets the budgets recover and charges the real token usage when it is known."""
+        with self._cond:
+            if self.shared is not None:
+                extra = used_tokens - estimated_tokens if used_tokens is not None else 0
+                self.scale = self.shared.record_success(self, extra)
+                return
+            self.scale = min(1.0, self.scale + RECOVERY_STEP)
+            if used_tokens is not None:
+                self.tokens.take(used_tokens - estimated_tokens)
+
+    def record_rate_limited(self, retry_after):
+        """Pauses the deployment for `retry_after` seconds and halves its budgets."""
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            if self.shared is not None:
+                self.scale = self.shared.record_rate_limited(self, retry_after)
+            else:
+                self.scale = max(MIN_SCALE, self.scale / 2)
+            self._cond.notify_all()
+        logging.warning(
+            f"Azure OpenAI rate limit on {self.deployment}: pausing {retry_after:.1f}s, budget at {self.scale:.0%}"
+        )
+
+    def status(self):
+        with self._cond:
+            return {
+                "deployment": self.deployment,
+                "rpm": self.requests.per_minute,
+                "tpm": self.tokens.per_minute,
+                "scale": round(self.scale, 2),
+                "waiting": len(self._queue),
+                "paused_for": round(max(0.0, self.blocked_until - time.monotonic()), 2),
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_shared_budgets = None
+
+
+def get_limiter(deployment):
+    """
+    The process-wide limiter of a deployment. Budgets come from AZURE_RATE_LIMITS
+    ("deployment=rpm:tpm,..."). They are shared by every process using the SQLite
+    file AZURE_RATE_LIMIT_STATE (DEFAULT_RATE_LIMIT_STATE if unset), so
+    AZURE_RATE_LIMITS is the whole quota and priorities apply across processes. If it
+    is set empty, each process sharing a deployment needs its own share of the quota.
+    """
+    global _shared_budgets
+    with _limiters_lock:
+        limiter = _limiters.get(deployment)
+        if limiter is None:
+            rpm, tpm = parse_rate_limits(os.getenv("AZURE_RATE_LIMITS")).get(deployment, (0, 0))
+            state_path = os.getenv("AZURE_RATE_LIMIT_STATE", DEFAULT_RATE_LIMIT_STATE)
+            shared = None
+            if state_path and (rpm or tpm):
+                if _shared_budgets is None:
+                    _shared_budgets = SharedBudgets(state_path)
+                shared = _shared_budgets
+            limiter = _limiters[deployment] = DeploymentLimiter(deployment, rpm, tpm, shared=shared)
+        return limiter
+
+
+def retry_after_seconds(error):
+    """Reads the Retry-After hint of a 429 response."""
+    headers = error.response.headers if getattr(error, "response", None) is not None else {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after", DEFAULT_RETRY_AFTER))
+    except ValueError:
+        return DEFAULT_RETRY_AFTER
+
+
+def request_cost(kwargs, estimate_tokens):
+    """Tokens Azure charges against TPM before the call: the input plus the max_tokens reserve."""
+    if "messages" in kwargs:
+        text = "".join(str(message.get("content", "")) for message in kwargs["messages"])
+    else:
+        payload = kwargs.get("input", "")
+        text = payload if isinstance(payload, str) else "".join(map(str, payload))
+    return estimate_tokens(text) + (kwargs.get("max_tokens") or 0)
+
+
+class _RateLimitedEndpoint:
+    def __init__(self, owner, resource):
+        self._owner = owner
+        self._resource = resource
+
+    def _target(self):
+        client = self._owner.client
+        return client.chat.completions.create if self._resource == "chat" else client.embeddings.create
+
+    def _retry_delay(self, limiter, error, attempt):
+        """
+        Handles a failed attempt. Returns the seconds to wait before trying again, or
+        None when the error should be raised. After a 429 the limiter pauses the whole
+        deployment, so the retry waits for its budget (charged, in priority order)
+        like any other call.
+        """
+        if isinstance(error, RateLimitError):
+            limiter.record_rate_limited(retry_after_seconds(error))
+        if attempt >= self._owner.max_retries:
+            return None
+        if isinstance(error, RateLimitError):
+            return 0.0
+        delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** attempt))
+        logging.warning(f"Azure OpenAI call failed ({error}), retrying in {delay:.1f}s")
+        return delay
+
+    def create(self, **kwargs):
+        owner = self._owner
+        limiter = get_limiter(kwargs.get("model", ""))
+        cost = request_cost(kwargs, owner.estimate_tokens)
+        target = self._target()
+        if owner.is_async:
+            return self._create_async(target, limiter, cost, kwargs)
+        for attempt in itertools.count():
+            limiter.acquire(cost, owner.priority, timeout=owner.max_wait)
+            try:
+                response = target(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(limiter, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            limiter.record_success(cost, _used_tokens(response))
+            return response
+
+    async def _create_async(self, target, limiter, cost, kwargs):
+        owner = self._owner
+        for attempt in itertools.count():
+            await limiter.acquire_async(cost, owner.priority, timeout=owner.max_wait)
+            try:
+                response = await target(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                delay = self._retry_delay(limiter, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            limiter.record_success(cost, _used_tokens(response))
+            return response
+
+
+def _used_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+class _Namespace:
+    pass
+
+
+class RateLimitedClient:
+    """
+    Wraps an AzureOpenAI / AsyncAzureOpenAI client so `chat.completions.create` and
+    `embeddings.create` first wait for budget on the deployment's shared limiter, at
+    the given priority. Everything else is passed through to the wrapped client.
+
+    Retries are made here rather than by the OpenAI client (which is used through a
+    `max_retries=0` copy sharing its connection pool), so every retry also waits for
+    budget: a 429 pauses the deployment for its Retry-After and the retry is charged
+    to the buckets and queued by priority like any other call.
+
+    Args:
+        client: The OpenAI client to wrap (sync or async), or a function returning it,
+            such as `common.clients.get_openai_client`, called on first use.
+        priority (int): PRIORITY_CHAT, PRIORITY_INTAKE or PRIORITY_BATCH.
+        estimate_tokens (callable): Token estimate of a text; a rough default is used if None.
+        max_wait (float): Longest wait for budget before RateLimitWaitTimeout (None = no limit).
+        max_retries (int): Retries of a failed call; by default the `max_retries` the
+            wrapped client was configured with (DEFAULT_MAX_RETRIES if it has none).
+    """
+
+    def __init__(self, client, priority, estimate_tokens=None, max_wait=None, max_retries=None):
+        self._factory = client if inspect.isfunction(client) or inspect.ismethod(client) else None
+        self._client = None
+        self.priority = priority
+        self.estimate_tokens = estimate_tokens or rough_token_estimate
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.chat = _Namespace()
+        self.chat.completions = _RateLimitedEndpoint(self, "chat")
+        self.embeddings = _RateLimitedEndpoint(self, "embeddings")
+        if self._factory is None:
+            self._wrap(client)
+
+    def _wrap(self, client):
+        if self.max_retries is None:
+            self.max_retries = getattr(client, "max_retries", DEFAULT_MAX_RETRIES)
+        # The SDK's own retries would bypass the limiter
+        with_options = getattr(client, "with_options", None)
+        self._client = with_options(max_retries=0) if with_options is not None else client
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._wrap(self._factory())
+        return self._client
+
+    @property
+    def is_async(self):
+        client = self.client
+        return isinstance(client, AsyncOpenAI) or inspect.iscoroutinefunction(client.chat.completions.create)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,44 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file once per process
+load_dotenv()
+
+# Azure OpenAI credentials
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
+AZURE_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_EMBEDDING_DEPLOYMENT")
+
+# Azure Document Intelligence credentials
+AZURE_DOCUMENT_INTELLIGENCE_KEY = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_KEY")
+AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT = os.getenv("AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT")
+
+# HTTP settings of the shared clients: one keep-alive pool per process, HTTP/2 when
+# the `h2` package is installed, and explicit connect/read timeouts
+AZURE_HTTP_MAX_CONNECTIONS = int(os.getenv("AZURE_HTTP_MAX_CONNECTIONS", "50"))
+AZURE_HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("AZURE_HTTP_KEEPALIVE_CONNECTIONS", "20"))
+AZURE_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("AZURE_HTTP_KEEPALIVE_EXPIRY", "30"))
+AZURE_HTTP_CONNECT_TIMEOUT = float(os.getenv("AZURE_HTTP_CONNECT_TIMEOUT", "5"))
+AZURE_HTTP_TIMEOUT = float(os.getenv("AZURE_HTTP_TIMEOUT", "60"))
+AZURE_HTTP2 = os.getenv("AZURE_HTTP2", "1") == "1"
+AZURE_MAX_RETRIES = int(os.getenv("AZURE_MAX_RETRIES", "2"))
+
+
+def require_openai_settings():
+    if not AZURE_OPENAI_API_KEY or not AZURE_OPENAI_ENDPOINT or not AZURE_OPENAI_DEPLOYMENT or not AZURE_OPENAI_API_VERSION:
+        raise ValueError("Missing API Key or Endpoint in .env file!")
+
+
+def require_document_intelligence_settings():
+    if not AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT or not AZURE_DOCUMENT_INTELLIGENCE_KEY:
+        raise ValueError("API Key or Endpoint not found. Check your .env file!")
+
+
+# Verify that the keys are loaded (optional, but useful for debugging)
+if __name__ == "__main__":
+    print("Config Loaded Successfully!")
+    print(f"Azure OpenAI Endpoint: {AZURE_OPENAI_ENDPOINT}")
+    print(f"Azure Document Intelligence Endpoint: {AZURE_DOCUMENT_INTELLIGENCE_ENDPOINT}")
+    print(f"GPT-4 Deployment: {AZURE_OPENAI_DEPLOYMENT}")
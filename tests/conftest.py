@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Tests import the shared `common` package from the repo root and the Part2 modules by name
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for path in (
+    ROOT, os.path.join(ROOT, "Part2"), os.path.join(ROOT, "Part2", "frontend"), os.path.join(ROOT, "Part2", "backend"),
+):
+    if path not in sys.path:
+        sys.path.insert(0, path)
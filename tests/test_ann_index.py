@@ -0,0 +1,82 @@
+import numpy as np
+
+from retrieval.ann_index import IVFIndex
+from retrieval.vector_store import EmbeddingStore
+
+
+def clustered_index(n_clusters=8, per_cluster=50, dim=16):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(n_clusters, dim))
+    keys, vectors = [], []
+    for c in range(n_clusters):
+        for i in range(per_cluster):
+            keys.append(f"c{c}_{i}")
+            vectors.append(centers[c] + 0.05 * rng.normal(size=dim))
+    index = IVFIndex(dim, n_lists=n_clusters, nprobe=1)
+    index.add(keys, np.array(vectors))
+    return index, centers
+
+
+def test_filtered_search_widens_the_probe_until_top_k_survive():
+    index, centers = clustered_index()
+    # The query sits in cluster 0, but only cluster 5 passes the filter
+    results = index.search(centers[0], top_k=10, key_filter=lambda key: key.startswith("c5_"))
+    assert len(results) == 10
+    assert all(key.startswith("c5_") for _, key in results)
+
+
+def test_unfiltered_search_scans_only_nprobe_cells():
+    index, centers = clustered_index()
+    query = centers[0] / np.linalg.norm(centers[0])
+    nearest_cell = int(np.argmax(index.centroids @ query))
+    results = index.search(centers[0], top_k=len(index))
+    assert {key for _, key in results} == set(index._list_keys[nearest_cell])
+
+
+def test_filter_matching_fewer_than_top_k_returns_all_matches():
+    index, centers = clustered_index()
+    wanted = {"c3_1", "c6_2", "c7_3"}
+    results = index.search(centers[0], top_k=10, key_filter=wanted.__contains__)
+    assert {key for _, key in results} == wanted
+
+
+def same_results(first, second):
+    return [key for _, key in first] == [key for _, key in second] and np.allclose(
+        [score for score, _ in first], [score for score, _ in second], atol=1e-5)
+
+
+def store_backed_index():
+    rng = np.random.default_rng(1)
+    centers = rng.normal(size=(8, 32))
+    embeddings = {f"c{i % 8}_{i}": (centers[i % 8] + 0.3 * rng.normal(size=32)).tolist() for i in range(400)}
+    store = EmbeddingStore.from_embeddings(embeddings, dtype="int8", keep_exact=True)
+    index = IVFIndex(store.dim, n_lists=8, nprobe=8, store=store)
+    index.add(store.keys)
+    return index, store, centers
+
+
+def test_store_backed_index_keeps_row_ids_not_vectors():
+    index, store, centers = store_backed_index()
+    assert not index._list_vectors
+    assert all(row.dtype == np.int64 for row in index._list_rows)
+    assert index.updates_since_train == 0
+    # Probing every cell scores the same rows as the store's own scan
+    for center in centers:
+        assert same_results(index.search(center, top_k=5), store.search(center, top_k=5))
+        assert same_results(index.search(center, top_k=5, rescore=False), store.search(center, top_k=5, rescore=False))
+
+
+def test_store_backed_index_follows_a_new_store(tmp_path):
+    index, store, centers = store_backed_index()
+    # The next store drops one key and orders the rest differently
+    embeddings = {key: store.get(key) for key in reversed(store.keys[1:])}
+    next_store = EmbeddingStore.from_embeddings(embeddings, dtype="int8")
+    updated = index.copy()
+    updated.remove([store.keys[0]])
+    updated.bind(next_store)
+    assert same_results(updated.search(centers[3], top_k=5), next_store.search(centers[3], top_k=5))
+    assert same_results(index.search(centers[3], top_k=5), store.search(centers[3], top_k=5))
+
+    updated.save(str(tmp_path / "index"))
+    loaded = IVFIndex.load(str(tmp_path / "index"), store=next_store)
+    assert same_results(loaded.search(centers[3], top_k=5), next_store.search(centers[3], top_k=5))
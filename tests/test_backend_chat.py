@@ -0,0 +1,113 @@
+"""
+The backend's /chat and /chat/stream endpoints with retrieval stubbed out; the
+FastAPI app runs in process without its lifespan (no indexer thread).
+"""
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from admission import AdmissionLimiter
+
+USER_INFO = {"hmo_name": "מכבי", "insurance_tier": "זהב", "age": 30, "gender": "female"}
+
+
+@pytest.fixture
+def api():
+    return TestClient(main.app)
+
+
+def payload(**overrides):
+    return {"user_info": USER_INFO, "question": "Is dental covered?", "language": "en", **overrides}
+
+
+def stream_events(response):
+    events, event = [], None
+    for line in response.iter_lines():
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            events.append((event, json.loads(line[len("data:"):])))
+            event = None
+    return events
+
+
+@pytest.fixture
+def no_llm(monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("GPT must not be called")
+    monkeypatch.setattr(main, "complete_chat", fail)
+    monkeypatch.setattr(main, "open_chat_stream", fail)
+
+
+@pytest.mark.parametrize("language, answer", [("en", main.NO_INFORMATION_ANSWERS["en"]), ("he", main.NO_INFORMATION_ANSWERS["he"])])
+def test_empty_retrieval_returns_the_no_information_answer(api, monkeypatch, no_llm, language, answer):
+    monkeypatch.setattr(main, "retrieve_context", lambda *args, **kwargs: ("", [], 1))
+    response = api.post("/chat", json=payload(language=language))
+    assert response.status_code == 200
+    assert response.json()["answer"] == answer
+    assert response.json()["no_information"]
+
+
+def test_empty_retrieval_streams_the_no_information_answer(api, monkeypatch, no_llm):
+    monkeypatch.setattr(main, "retrieve_context", lambda *args, **kwargs: ("", [], 1))
+    with api.stream("POST", "/chat/stream", json=payload()) as response:
+        events = stream_events(response)
+    answer = main.NO_INFORMATION_ANSWERS["en"]
+    assert events == [(None, {"delta": answer}), ("done", {"answer": answer, "prompt_version": None, "no_information": True})]
+
+
+def test_embedding_failure_is_a_503(api, monkeypatch, no_llm):
+    monkeypatch.setattr(main, "get_embedding", lambda client, text: None)
+    assert api.post("/chat", json=payload()).status_code == 503
+    assert api.post("/chat/stream", json=payload()).status_code == 503
+    assert api.post("/search", json={"query": "dental", "user_info": USER_INFO}).status_code == 503
+
+
+@pytest.mark.parametrize("top_k", [0, -3, main.SEARCH_MAX_TOP_K + 1, 10**9])
+def test_search_rejects_out_of_range_top_k(api, monkeypatch, top_k):
+    monkeypatch.setattr(main, "retrieve_context", lambda *args, **kwargs: pytest.fail("must not search"))
+    response = api.post("/search", json={"query": "dental", "user_info": USER_INFO, "top_k": top_k})
+    assert response.status_code == 422
+
+
+def test_search_accepts_top_k_within_range(api, monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, "retrieve_context", lambda query, user_info, top_k: calls.append(top_k) or ("ctx", ["k"], 1))
+    response = api.post("/search", json={"query": "dental", "user_info": USER_INFO, "top_k": main.SEARCH_MAX_TOP_K})
+    assert response.status_code == 200 and calls == [main.SEARCH_MAX_TOP_K]
+
+
+class HangingCompletions:
+    """Stands in for chat.completions: every create() waits until cancelled."""
+
+    def __init__(self):
+        self.started = None
+
+    async def create(self, **kwargs):
+        self.started.set()
+        await asyncio.Event().wait()
+
+
+@pytest.mark.parametrize("call", ["complete_chat", "open_chat_stream"])
+def test_cancelled_llm_call_releases_its_admission_slot(monkeypatch, call):
+    completions = HangingCompletions()
+    monkeypatch.setattr(main, "async_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    async def run():
+        limiter = AdmissionLimiter(1, 0, 1)
+        monkeypatch.setattr(main, "llm_admission", limiter)
+        for _ in range(3):
+            completions.started = asyncio.Event()
+            task = asyncio.ensure_future(getattr(main, call)([{"role": "user", "content": "hi"}]))
+            await completions.started.wait()
+            assert limiter.in_flight == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert limiter.in_flight == 0
+
+    asyncio.run(run())
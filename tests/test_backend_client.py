@@ -0,0 +1,124 @@
+"""
+BackendClient retries and circuit breaking against local HTTP servers standing in
+for backend replicas.
+"""
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend_client import BackendClient, BackendUnavailableError, CircuitBreaker
+
+
+class Replica(ThreadingHTTPServer):
+    """Answers each request with the next queued behaviour: a status code, or "drop" to hang up."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.behaviours = []
+        self.hits = 0
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.hits += 1
+        behaviour = self.server.behaviours.pop(0) if self.server.behaviours else 200
+        if behaviour == "drop":
+            # The request arrived but no response is sent
+            self.close_connection = True
+            return
+        status, _, retry_after = str(behaviour).partition(":")
+        self.send_response(int(status))
+        if retry_after:
+            self.send_header("Retry-After", retry_after)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def replicas():
+    servers = [Replica(), Replica()]
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def test_breaker_opens_then_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.1)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    # A failed trial re-opens the breaker, a successful one closes it
+    breaker.record_failure()
+    assert breaker.state == "open"
+    time.sleep(0.1)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow() and breaker.allow()
+
+
+def test_unavailable_status_is_retried_on_another_replica(replicas):
+    replicas[0].behaviours = [503]
+    client = BackendClient([r.url for r in replicas])
+    assert client.post("/chat", json={}, idempotent=False).status_code == 200
+    assert [r.hits for r in replicas] == [1, 1]
+
+
+def test_non_idempotent_call_is_not_retried_once_it_reached_the_backend(replicas):
+    replicas[0].behaviours = ["drop"]
+    client = BackendClient([r.url for r in replicas])
+    with pytest.raises(BackendUnavailableError):
+        client.post("/chat", json={}, idempotent=False)
+    assert [r.hits for r in replicas] == [1, 0]
+
+    # An idempotent call is retried after the same failure
+    replicas[0].behaviours = ["drop"]
+    assert client.post("/search", json={}).status_code == 200
+
+
+def test_refused_connection_is_retried_even_when_not_idempotent(replicas):
+    client = BackendClient([closed_port_url(), replicas[0].url])
+    assert client.post("/chat", json={}, idempotent=False).status_code == 200
+    assert replicas[0].hits == 1
+
+
+def test_failing_replica_is_skipped_once_its_breaker_opens(replicas):
+    client = BackendClient([closed_port_url(), replicas[0].url], failure_threshold=1, reset_timeout=60)
+    client.post("/chat", json={})
+    assert client.status()[0]["state"] == "open"
+    for _ in range(3):
+        client.post("/chat", json={})
+    assert replicas[0].hits == 4
+
+
+def test_retry_after_beyond_the_deadline_gives_up_at_once(replicas):
+    replicas[0].behaviours = ["429:30"]
+    client = BackendClient([replicas[0].url], deadline=2)
+    start = time.monotonic()
+    with pytest.raises(BackendUnavailableError):
+        client.post("/chat", json={})
+    assert time.monotonic() - start < 1
@@ -0,0 +1,46 @@
+"""
+Bulk intake: spotting a message with several details and validating the combined
+extraction of it.
+"""
+import pytest
+
+from intake_validators import looks_like_bulk_details, validate_extracted_fields
+
+MESSAGE = "I'm Dana Levi, ID 123456782, female, 34, Maccabi gold, card 987654321"
+
+
+@pytest.mark.parametrize("text", [
+    MESSAGE, "123456782 maccabi", "כללית כסף", "I am 40 and with clalit", "ת.ז 123-456-782, גיל 30",
+])
+def test_messages_with_several_details_are_bulk(text):
+    assert looks_like_bulk_details(text)
+
+
+@pytest.mark.parametrize("text", [
+    "Dana", "34", "123456782", "I'm Dana and I'm old", "all good", "maccaby, gld",
+])
+def test_single_answers_are_not_bulk(text):
+    assert not looks_like_bulk_details(text)
+
+
+def test_extracted_fields_are_validated_like_direct_input():
+    raw = {
+        "first_name": " Dana ", "last_name": "Levi", "gender": "female", "id_number": "123-456-782",
+        "age": "thirty four", "hmo_name": "maccabi", "hmo_card_number": "987654321", "insurance_tier": "Gold",
+    }
+    assert validate_extracted_fields(raw, MESSAGE) == {
+        "first_name": "Dana", "last_name": "Levi", "gender": "female", "id_number": "123456782",
+        "age": 34, "hmo_name": "מכבי", "hmo_card_number": "987654321", "insurance_tier": "זהב",
+    }
+
+
+def test_invalid_values_are_left_to_be_asked_for():
+    raw = {"first_name": "", "id_number": "123456789", "age": "200", "hmo_card_number": "12345"}
+    assert validate_extracted_fields(raw, "Dana, 123456789, 200 years, card 12345") == {}
+
+
+def test_fund_and_tier_fall_back_to_exact_spellings_in_the_message():
+    assert validate_extracted_fields({}, MESSAGE) == {"hmo_name": "מכבי", "insurance_tier": "זהב"}
+    # Not when the LLM answered null, and not for near-spellings such as "old"
+    assert validate_extracted_fields({"hmo_name": None, "insurance_tier": None}, MESSAGE) == {}
+    assert validate_extracted_fields({}, "Dana, 70 years old, in good health") == {}
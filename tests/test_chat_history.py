@@ -0,0 +1,14 @@
+from chat_history import ChatHistory
+
+
+def test_failed_answer_is_shown_but_kept_out_of_the_conversation():
+    history = ChatHistory()
+    history.append("user", "What does dental cover?")
+    history.append("assistant", "Error from server: 503", error=True)
+    history.append("user", "And eye exams?")
+    history.append("assistant", "Once a year.")
+
+    assert [m["content"] for m in history.since(0)] == [
+        "What does dental cover?", "Error from server: 503", "And eye exams?", "Once a year.",
+    ]
+    assert history.conversation() == [{"user": "And eye exams?", "bot": "Once a year."}]
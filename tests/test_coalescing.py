@@ -0,0 +1,139 @@
+"""
+Coalescing of identical in-flight calls: the thread SingleFlight used for
+embeddings and the async SingleFlight / StreamSingleFlight of the backend.
+"""
+import time
+import asyncio
+import threading
+
+import pytest
+
+from retrieval.single_flight import SingleFlight as ThreadSingleFlight
+from coalescing import SingleFlight, StreamSingleFlight, chat_key
+
+
+def test_threads_share_one_call_and_its_error():
+    shared = []
+    flight = ThreadSingleFlight(on_shared=lambda: shared.append(1))
+    calls = []
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        release.wait(timeout=5)
+        return "vector"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("q", slow))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while len(shared) < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert results == ["vector"] * 5 and len(calls) == 1
+
+    # Nothing is kept: the next call runs again, and its error reaches the caller
+    with pytest.raises(ValueError):
+        flight.do("q", lambda: (_ for _ in ()).throw(ValueError("boom")))
+
+
+def test_async_callers_share_one_task_that_survives_a_cancelled_caller():
+    async def run():
+        calls = []
+        flight = SingleFlight()
+
+        async def answer():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        first = asyncio.ensure_future(flight.do("q", answer))
+        second = asyncio.ensure_future(flight.do("q", answer))
+        await asyncio.sleep(0)
+        # The first caller disconnects; the call keeps running for the second
+        first.cancel()
+        assert await second == "answer"
+        assert first.cancelled() and len(calls) == 1 and len(flight) == 0
+        assert await flight.do("q", answer) == "answer" and len(calls) == 2
+
+    asyncio.run(run())
+
+
+async def deltas(parts, closed, delay=0.01):
+    try:
+        for part in parts:
+            await asyncio.sleep(delay)
+            yield part
+    finally:
+        closed.append(True)
+
+
+def test_stream_is_replayed_from_the_start_to_a_late_subscriber():
+    async def run():
+        opened, closed = [], []
+        flight = StreamSingleFlight()
+
+        async def open_stream():
+            opened.append(1)
+            return deltas(["a", "b", "c"], closed)
+
+        first = await flight.open("q", open_stream)
+        iterator = first.deltas()
+        assert await iterator.__anext__() == "a"
+        second = await flight.open("q", open_stream)
+        assert second is first and len(opened) == 1
+        assert [part async for part in iterator] == ["b", "c"]
+        assert [part async for part in second.deltas()] == ["a", "b", "c"]
+        first.leave()
+        second.leave()
+        assert closed == [True]
+
+    asyncio.run(run())
+
+
+def test_upstream_is_closed_only_when_every_subscriber_left():
+    async def run():
+        closed = []
+        flight = StreamSingleFlight()
+
+        async def open_stream():
+            return deltas(["x"] * 100, closed, delay=0.005)
+
+        first = await flight.open("q", open_stream)
+        second = await flight.open("q", open_stream)
+        first.leave()
+        await asyncio.sleep(0.03)
+        assert not closed and not second.done
+        second.leave()
+        await asyncio.sleep(0.03)
+        assert closed == [True] and len(flight) == 0
+        with pytest.raises(RuntimeError):
+            [part async for part in second.deltas()]
+
+    asyncio.run(run())
+
+
+def test_error_opening_the_stream_reaches_every_caller():
+    async def run():
+        flight = StreamSingleFlight()
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ConnectionError("upstream down")
+
+        results = await asyncio.gather(flight.open("q", failing), flight.open("q", failing), return_exceptions=True)
+        assert [type(result) for result in results] == [ConnectionError, ConnectionError]
+        assert len(flight) == 0
+
+    asyncio.run(run())
+
+
+def test_chat_key_separates_what_the_prompt_depends_on():
+    user = {"hmo_name": "מכבי", "insurance_tier": "זהב", "age": 34, "gender": "female"}
+    key = chat_key("What  does dental cover?", user, "en", "context")
+    assert chat_key("what does dental cover?", dict(user), "en", "context") == key
+    assert chat_key("What does dental cover?", {**user, "age": 70}, "en", "context") != key
+    assert chat_key("What does dental cover?", user, "en", "other context") != key
+    assert chat_key("What does dental cover?", user, "en", "context", [{"role": "user", "content": "hi"}]) != key
@@ -0,0 +1,98 @@
+"""
+Comparison mode: spotting a comparison question, expanding it into plans and
+retrieving the compared cells once for all of them.
+"""
+import os
+import zlib
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+import main
+from intake_validators import parse_comparison
+from retrieval import KnowledgeBaseIndexer, compare_plans, comparison_table, plan_context
+
+KB_DIR = os.path.join(os.path.dirname(__file__), "..", "Part2", "frontend", "phase2_data")
+USER_INFO = {"hmo_name": "כללית", "insurance_tier": "ארד", "age": 30, "gender": "male"}
+
+
+def embed(texts):
+    return [np.random.default_rng(zlib.crc32(text.encode("utf-8"))).normal(size=16).tolist() for text in texts]
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    indexer = KnowledgeBaseIndexer(KB_DIR, embed, cache_dir=str(tmp_path_factory.mktemp("cache")))
+    indexer.refresh()
+    return indexer.snapshot
+
+
+@pytest.mark.parametrize("question, fields", [
+    ("מה ההבדל בין מכבי לכללית בטיפולי שיניים?", {"compare_hmos": ["כללית", "מכבי"], "compare_tiers": []}),
+    ("compare gold and silver for glasses", {"compare_hmos": [], "compare_tiers": ["זהב", "כסף"]}),
+    ("Is Maccabi better for dental?", {"compare_hmos": ["מכבי"], "compare_tiers": []}),
+    # A single fund next to several tiers is kept
+    ("Maccabi gold vs silver", {"compare_hmos": ["מכבי"], "compare_tiers": ["זהב", "כסף"]}),
+    # A single tier next to several funds is read as an everyday word ("money")
+    ("How much money (כסף) do Maccabi and Clalit charge?", {"compare_hmos": ["כללית", "מכבי"], "compare_tiers": []}),
+    # One fund without a comparison word, or misspelled funds, is a plain question
+    ("Is dental covered at Maccabi?", {}),
+    ("compare maccabee and clallitt", {}),
+])
+def test_parse_comparison(question, fields):
+    assert parse_comparison(question) == fields
+
+
+def plans(**fields):
+    return main.comparison_plans(main.ChatRequest(user_info=USER_INFO, question="q", language="en", **fields))
+
+
+def test_requested_funds_and_tiers_are_compared_with_the_users_own_plan():
+    assert plans(compare_hmos=["מכבי"]) == [("כללית", "ארד"), ("מכבי", "ארד")]
+    assert plans(compare_tiers=["זהב", "כסף"]) == [("כללית", "ארד"), ("כללית", "זהב"), ("כללית", "כסף")]
+
+
+def test_a_single_value_next_to_several_of_the_other_replaces_the_users_own():
+    # "Maccabi gold vs silver": Maccabi's tiers, with the user's own tier
+    assert plans(compare_hmos=["מכבי"], compare_tiers=["זהב", "כסף"]) == [
+        ("מכבי", "ארד"), ("מכבי", "זהב"), ("מכבי", "כסף"),
+    ]
+    assert plans(compare_hmos=["מכבי", "מאוחדת"], compare_tiers=["זהב"]) == [
+        ("כללית", "זהב"), ("מכבי", "זהב"), ("מאוחדת", "זהב"),
+    ]
+
+
+def test_plan_expansion_limits(monkeypatch):
+    # Naming only the user's own plan is not a comparison
+    assert plans(compare_hmos=["כללית"]) == []
+    assert plans() == []
+    monkeypatch.setattr(main, "COMPARE_MAX_PLANS", 3)
+    with pytest.raises(HTTPException) as error:
+        plans(compare_hmos=["מכבי", "מאוחדת"], compare_tiers=["זהב", "כסף"])
+    assert error.value.status_code == 422
+
+
+def test_every_plan_is_answered_over_the_same_services(snapshot):
+    compared = [("מכבי", "זהב"), ("כללית", "ארד")]
+    key = next(key for key, record in snapshot.kb.items()
+               if record["metadata"]["type"] == "table" and record["metadata"]["hmo"] == "מכבי"
+               and record["metadata"]["tier"] == "זהב")
+    query = snapshot.store.get(key)
+    result = compare_plans(query, snapshot, compared, top_k=3)
+
+    assert len(result["services"]) == 3
+    top = snapshot.kb[key]["metadata"]
+    assert result["services"][0][:2] == (top["topic"], top["service"])
+    for plan in compared:
+        assert len(result["cells"][plan]) == 3 and all(result["cells"][plan])
+    # The cells are the benefit texts of the plans' own records
+    assert snapshot.kb[key]["text"].endswith(result["cells"][compared[0]][0])
+    assert all(snapshot.kb[source]["metadata"]["hmo"] in ("מכבי", "כללית") for source in result["sources"]
+               if snapshot.kb[source]["metadata"]["type"] == "table")
+
+    table = comparison_table(result).splitlines()
+    assert table[0] == "| Service | מכבי (זהב) | כללית (ארד) |"
+    assert len(table) == 2 + 3
+    assert result["cells"][compared[1]][0] in plan_context(result, compared[1])
+    assert "מכבי (זהב)" not in plan_context(result, compared[1])
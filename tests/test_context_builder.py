@@ -0,0 +1,71 @@
+"""
+build_context over generated prose and table records.
+"""
+import random
+
+from retrieval.context_builder import build_context, _overlap
+from retrieval.text_utils import tokenize, estimate_tokens
+
+WORDS = "dental vision clinic refund visit annual gold silver bronze member card surgery child adult home".split()
+
+
+def record(key, text, kind="prose"):
+    return {"text": text, "metadata": {"type": kind, "filename": f"{key}.html", "para_num": 1}}
+
+
+def random_matches(seed, n_records=20, sentences=6):
+    rng = random.Random(seed)
+    matches = []
+    for i in range(n_records):
+        text = " ".join(" ".join(rng.choices(WORDS, k=rng.randint(4, 10))) + "." for _ in range(sentences))
+        matches.append((1 - i / n_records, f"r{i}", record(f"r{i}", text)))
+    return matches
+
+
+def test_context_stays_within_the_token_budget():
+    matches = random_matches(0)
+    for budget in (40, 120, 400, 1200):
+        context, keys = build_context("dental refund for a child", matches, token_budget=budget)
+        assert estimate_tokens(context) <= budget
+        assert keys and len(keys) == len(set(keys))
+
+
+def test_budget_smaller_than_any_unit_returns_nothing():
+    assert build_context("dental", random_matches(1), token_budget=1) == ("", [])
+
+
+def test_near_duplicate_sentences_are_kept_once():
+    text = "Dental checkups are free twice a year."
+    matches = [(0.9, "a", record("a", text)), (0.8, "b", record("b", text + " "))]
+    context, keys = build_context("dental checkups", matches, token_budget=500)
+    assert context.count("Dental checkups") == 1
+    assert keys == ["a"]
+
+
+def test_selected_units_are_grouped_per_record_in_order_with_their_source():
+    matches = [(0.9, "a", record("a", "First about dental. Second about vision.")),
+               (0.5, "b", record("b", "Gold members get refunds.", kind="table"))]
+    context, keys = build_context("dental vision gold refunds", matches, token_budget=500)
+    assert keys == ["a", "b"]
+    assert context == (
+        "First about dental. Second about vision. (Source: a.html, Paragraph: 1)"
+        "\n\n---\n\n"
+        "Gold members get refunds. (Source: b.html, Paragraph: 1)"
+    )
+
+
+def test_mmr_prefers_a_diverse_unit_over_a_redundant_one():
+    matches = [
+        (0.9, "a", record("a", "dental clinic visit refund", kind="table")),
+        (0.88, "b", record("b", "dental clinic visit refund annual", kind="table")),
+        (0.85, "c", record("c", "vision surgery for children", kind="table")),
+    ]
+    # Room for two units: the second pick skips the near-copy of the first
+    budget = 2 * (estimate_tokens("dental clinic visit refund annual (Source: a.html, Paragraph: 1)") + 6)
+    _, keys = build_context("dental clinic refund", matches, token_budget=budget, duplicate_threshold=1.01)
+    assert keys == ["a", "c"]
+
+
+def test_overlap_is_jaccard():
+    assert _overlap(set(tokenize("a b c")), set(tokenize("b c d"))) == 0.5
+    assert _overlap(set(), {"a"}) == 0.0
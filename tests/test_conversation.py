@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from conversation import is_follow_up, service_terms, history_messages
+from retrieval import KnowledgeBaseIndexer
+
+KB_DIR = os.path.join(os.path.dirname(__file__), "..", "Part2", "frontend", "phase2_data")
+
+
+@pytest.fixture(scope="module")
+def terms(tmp_path_factory):
+    indexer = KnowledgeBaseIndexer(
+        KB_DIR, lambda texts: [[1.0, 0.0]] * len(texts), cache_dir=str(tmp_path_factory.mktemp("cache")),
+    )
+    indexer.refresh()
+    return service_terms(indexer.snapshot)
+
+
+@pytest.mark.parametrize("question", [
+    "and for silver?", "ומה לגבי כסף?", "how much does it cost?", "כמה עולה זה?", "and Clalit?",
+])
+def test_questions_referring_back_are_follow_ups(terms, question):
+    assert is_follow_up(question, terms)
+
+
+@pytest.mark.parametrize("question", [
+    # Short or with a pronoun, but naming the service asked about
+    "is it free for dental checkups?", "כמה עולות סתימות?", "האם זה כולל בדיקות ראייה?", "ומה לגבי טיפולי שורש?",
+    # No reference to earlier turns at all
+    "What does Maccabi gold cover for glasses?", "Thanks", "acupuncture", "",
+])
+def test_self_contained_questions_are_not_follow_ups(terms, question):
+    assert not is_follow_up(question, terms)
+
+
+def test_service_terms_come_from_the_knowledge_base_tables(terms):
+    assert {"סתימות", "אקופונקטורה", "dental"} <= terms
+    # Generic words of the service names do not count as naming a service
+    assert "טיפולי" not in terms
+
+
+def test_history_messages_keep_the_newest_turns_within_budget():
+    history = [{"user": f"question {i}", "bot": f"answer {i} " + "word " * 30} for i in range(5)]
+    messages = history_messages(history, "older summary", token_budget=60, answer_max_tokens=20)
+    assert messages[-2:] == [
+        {"role": "user", "content": "question 4"},
+        {"role": "assistant", "content": messages[-1]["content"]},
+    ]
+    assert messages[-1]["content"].startswith("answer 4")
+    assert len([m for m in messages if m["role"] == "user"]) < 5
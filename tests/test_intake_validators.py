@@ -0,0 +1,71 @@
+import pytest
+
+from intake_validators import (
+    match_confirmation, is_valid_israeli_id, parse_age, match_hmo, match_tier, extract_nine_digits,
+    extract_valid_id_number, parse_field,
+)
+
+
+@pytest.mark.parametrize("text", ["yes", "Yes, it's all correct", "looks good", "all good", "כן תודה", "הכל בסדר", "ok"])
+def test_confirmations(text):
+    assert match_confirmation(text)
+
+
+@pytest.mark.parametrize("text", [
+    "is", "all", "right", "good", "הכל", "", "all good except my age", "yes but my age is 40", "correct my tier to gold",
+])
+def test_filler_words_and_corrections_are_not_confirmations(text):
+    assert not match_confirmation(text)
+
+
+@pytest.mark.parametrize("id_number, valid", [
+    ("123456782", True), ("039337423", True), ("000000018", True), ("18", True),
+    ("123456789", False), ("1234567890", False), ("12345678a", False), ("", False), (None, False),
+])
+def test_israeli_id_check_digit(id_number, valid):
+    assert is_valid_israeli_id(id_number) == valid
+
+
+def test_id_numbers_are_found_in_free_text():
+    assert extract_nine_digits("123-456-782") == "123456782"
+    # Two different 9-digit numbers are ambiguous
+    assert extract_nine_digits("123456782 and 987654321") is None
+    assert extract_valid_id_number("my id is 123 456 782") == "123456782"
+    assert extract_valid_id_number("123456789") is None
+
+
+@pytest.mark.parametrize("text, age", [
+    ("I am 42 years old", 42), ("thirty five", 35), ("thirty-five", 35), ("one hundred", 100),
+    ("שלושים וחמש", 35), ("עשרים ואחת", 21), ("שתים עשרה", 12), ("בן ארבעים", 40),
+    ("130", None), ("between 30 and 40", None), ("banana", None), ("seventy two and a half", None),
+])
+def test_parse_age_from_digits_and_number_words(text, age):
+    assert parse_age(text) == age
+
+
+@pytest.mark.parametrize("text, hmo", [
+    ("Maccabi", "מכבי"), ("makabi", "מכבי"), ("במכבי", "מכבי"), ("clallit", "כללית"), ("kllalit", "כללית"),
+    ("meuhedet", "מאוחדת"), ("maccabi or clalit", None), ("hello", None),
+])
+def test_match_hmo_accepts_transliterations_and_typos(text, hmo):
+    assert match_hmo(text) == hmo
+
+
+@pytest.mark.parametrize("text, tier", [
+    ("gold", "זהב"), ("zahav", "זהב"), ("בזהב", "זהב"), ("silvr", "כסף"), ("bronz", "ארד"),
+])
+def test_match_tier_accepts_transliterations_and_typos(text, tier):
+    assert match_tier(text) == tier
+
+
+@pytest.mark.parametrize("text", ["good", "I am old", "silvr"])
+def test_tiers_in_whole_messages_need_an_exact_spelling(text):
+    assert match_tier(text, fuzzy=False) is None
+
+
+def test_parse_field_dispatches_by_field_name():
+    assert parse_field("age", "fifty") == 50
+    assert parse_field("HMO name", "Klalit") == "כללית"
+    assert parse_field("insurance membership tier", "silver") == "כסף"
+    assert parse_field("unknown", "x") is None
+    assert parse_field("age", "") is None
@@ -0,0 +1,106 @@
+"""
+KnowledgeBaseIndexer over a small generated knowledge base, with a deterministic
+stand-in for the embedding API.
+"""
+import os
+import sys
+import zlib
+import subprocess
+
+import numpy as np
+
+from retrieval.kb_indexer import KnowledgeBaseIndexer
+
+
+def embed(texts):
+    return [np.random.default_rng(zlib.crc32(text.encode("utf-8"))).normal(size=16).tolist() for text in texts]
+
+
+def write_page(directory, name, sections, variant=""):
+    """A page of `sections` heading + paragraph records; `variant` changes the first one's text."""
+    body = "".join(
+        f"<h2>{name} section {i}</h2><p>{name} text {i} {variant if i == 0 else ''}</p>" for i in range(sections)
+    )
+    (directory / name).write_text(f"<html><head><title>{name}</title></head><body>{body}</body></html>", encoding="utf-8")
+
+
+def indexed_keys(index):
+    return {key for keys in index._list_keys for key in keys}
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_exact_files_of_exited_workers_are_removed_at_startup(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    stale = cache_dir / f"kb_exact_{dead_pid()}_v3.npy"
+    live = cache_dir / f"kb_exact_{os.getppid()}_v1.npy"
+    own = cache_dir / f"kb_exact_{os.getpid()}_v1.npy"
+    for path in (stale, live, own):
+        path.write_bytes(b"")
+
+    KnowledgeBaseIndexer(str(tmp_path), embed, cache_dir=str(cache_dir))
+
+    assert not stale.exists()
+    assert live.exists() and own.exists()
+
+
+def test_refresh_updates_the_ann_index_in_place_until_it_drifts(tmp_path):
+    kb_dir = tmp_path / "kb"
+    kb_dir.mkdir()
+    for name in ("a.html", "b.html", "c.html"):
+        write_page(kb_dir, name, 20)
+    indexer = KnowledgeBaseIndexer(
+        str(kb_dir), embed, cache_dir=str(tmp_path / "cache"), ann_min_records=10, ann_retrain_drift=0.2,
+    )
+    indexer.refresh()
+    first = indexer.snapshot
+    assert indexed_keys(first.index) == set(first.store.keys)
+
+    # One record changed and two added: applied to the trained index
+    write_page(kb_dir, "a.html", 22, variant="(updated)")
+    os.utime(kb_dir / "a.html", ns=(1, 1))
+    indexer.refresh()
+    second = indexer.snapshot
+    assert second.index is not first.index
+    assert second.index.centroids is first.index.centroids
+    assert indexed_keys(second.index) == set(second.store.keys)
+    assert second.index.updates_since_train == 3
+    # The previous snapshot's index is untouched
+    assert indexed_keys(first.index) == set(first.store.keys)
+    key = "a.html_para_21"
+    assert second.index.search(second.store.get(key), top_k=1)[0][1] == key
+
+    # Removing a whole file pushes the updates past the drift threshold: retrained
+    (kb_dir / "b.html").unlink()
+    indexer.refresh()
+    third = indexer.snapshot
+    assert third.index.centroids is not second.index.centroids
+    assert third.index.updates_since_train == 0
+    assert indexed_keys(third.index) == set(third.store.keys)
+
+
+def test_snapshot_key_depends_on_content_only(tmp_path):
+    kb_dir = tmp_path / "kb"
+    kb_dir.mkdir()
+    write_page(kb_dir, "a.html", 3)
+    first = KnowledgeBaseIndexer(str(kb_dir), embed, cache_dir=str(tmp_path / "cache"))
+    first.refresh()
+
+    # Another process reaching the same content at a different build count
+    second = KnowledgeBaseIndexer(str(kb_dir), embed, cache_dir=str(tmp_path / "cache"))
+    write_page(kb_dir, "a.html", 3, variant="(draft)")
+    second.refresh()
+    write_page(kb_dir, "a.html", 3)
+    os.utime(kb_dir / "a.html", ns=(1, 1))
+    second.refresh()
+
+    assert second.snapshot.version != first.snapshot.version
+    assert second.snapshot.key == first.snapshot.key
+    write_page(kb_dir, "a.html", 3, variant="(final)")
+    second.refresh()
+    assert second.snapshot.key != first.snapshot.key
@@ -0,0 +1,58 @@
+"""
+parse_html_document over the shipped phase2_data pages and a small inline page.
+"""
+import os
+from collections import Counter
+
+from retrieval.kb_parser import (
+    HMO_NAMES, INSURANCE_TIERS, parse_html_document, load_knowledge_base_dir, build_table_index,
+    matches_user_plan, split_tier_cell,
+)
+
+KB_DIR = os.path.join(os.path.dirname(__file__), "..", "Part2", "frontend", "phase2_data")
+
+PAGE = """<h2>מרפאות שיניים</h2>
+<p>טיפולי שיניים לכל המבוטחים.</p>
+<table>
+<tr><th>שירות</th><th>מכבי</th><th>כללית</th></tr>
+<tr><td>ניקוי אבנית</td><td>זהב: חינם<br>פעמיים בשנה<br>כסף: 50% הנחה</td><td>ללא הגבלה</td></tr>
+</table>
+<p>לפרטים נוספים פנו למוקד.</p>
+"""
+
+
+def test_phase2_pages_split_into_table_cells_and_prose_sections():
+    kb = load_knowledge_base_dir(KB_DIR)
+    kinds = Counter(record["metadata"]["type"] for record in kb.values())
+    assert kinds == {"table": 324, "prose": 18}
+
+    table = [record["metadata"] for record in kb.values() if record["metadata"]["type"] == "table"]
+    assert {metadata["hmo"] for metadata in table} == set(HMO_NAMES)
+    assert {metadata["tier"] for metadata in table} == set(INSURANCE_TIERS)
+    # One record per (service, fund, tier)
+    assert len(build_table_index(kb)) == 324
+
+
+def test_cells_become_one_record_per_fund_and_tier():
+    records = parse_html_document(PAGE, "dental.html")
+    assert [record["metadata"]["type"] for record in records.values()] == ["prose", "table", "table", "table", "prose"]
+    assert records["dental.html_row_0_מכבי_זהב"]["text"] == "מרפאות שיניים - ניקוי אבנית - מכבי (זהב): חינם פעמיים בשנה"
+    assert records["dental.html_row_0_מכבי_כסף"]["metadata"]["tier"] == "כסף"
+    # A cell without tier lines applies to every tier
+    assert records["dental.html_row_0_כללית_all"]["metadata"]["tier"] is None
+    assert records["dental.html_para_0"]["text"] == "מרפאות שיניים\nטיפולי שיניים לכל המבוטחים."
+
+
+def test_split_tier_cell():
+    assert split_tier_cell("זהב: חינם\nכסף: 20 ש\"ח\nלביקור") == [("זהב", "חינם"), ("כסף", "20 ש\"ח לביקור")]
+    assert split_tier_cell("ללא הגבלה") == [(None, "ללא הגבלה")]
+    assert split_tier_cell("  ") == []
+
+
+def test_only_the_users_own_cells_match_their_plan():
+    records = parse_html_document(PAGE, "dental.html")
+    matching = [key for key, record in records.items() if matches_user_plan(record, "מכבי", "כסף")]
+    assert matching == ["dental.html_para_0", "dental.html_row_0_מכבי_כסף", "dental.html_para_2"]
+    assert [key for key, record in records.items() if matches_user_plan(record, "כללית", "זהב")] == [
+        "dental.html_para_0", "dental.html_row_0_כללית_all", "dental.html_para_2",
+    ]
@@ -0,0 +1,31 @@
+from common import prompts
+from common.prompts import PromptTemplate, register, get_prompt, prompt_versions
+
+
+def template(user="Question: {question}", name="test.prompt"):
+    return PromptTemplate(name, 1, system="Answer briefly.", user=user)
+
+
+def test_registering_identical_text_returns_the_existing_template(monkeypatch):
+    monkeypatch.setattr(prompts, "_registry", {})
+    first = register(template())
+    first.calls = 3
+    assert register(template()) is first
+    assert get_prompt("test.prompt").calls == 3
+
+
+def test_edited_template_replaces_the_registered_one(monkeypatch, caplog):
+    monkeypatch.setattr(prompts, "_registry", {})
+    old = register(template())
+    caplog.set_level("INFO")
+    new = register(template(user="Q: {question}"))
+
+    assert new is not old and get_prompt("test.prompt") is new
+    assert prompt_versions() == {"test.prompt": new.version_id}
+    assert new.version_id in caplog.text and old.version_id in caplog.text
+
+
+def test_messages_keep_the_static_prefix_first():
+    messages = template().messages(history=[{"role": "assistant", "content": "hi"}], question="dental?")
+    assert [m["role"] for m in messages] == ["system", "assistant", "user"]
+    assert messages[-1]["content"] == "Question: dental?"
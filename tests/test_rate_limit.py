@@ -0,0 +1,190 @@
+"""
+DeploymentLimiter and RateLimitedClient against the local Azure OpenAI stand-in
+(common/mock_azure.py), talking to it over HTTP through the real OpenAI clients.
+"""
+import time
+import asyncio
+import threading
+import itertools
+
+import httpx
+import pytest
+from openai import AzureOpenAI, AsyncAzureOpenAI, RateLimitError
+
+from common import rate_limit
+from common.rate_limit import (
+    DeploymentLimiter, RateLimitedClient, RateLimitWaitTimeout, SharedBudgets,
+    PRIORITY_CHAT, PRIORITY_INTAKE, PRIORITY_BATCH, RECOVERY_STEP,
+)
+from common.mock_azure import MockAzureOpenAI, MockAzureServer
+
+API_VERSION = "2024-10-21"
+_deployments = itertools.count()
+
+
+@pytest.fixture
+def mock():
+    mock = MockAzureOpenAI()
+    server = MockAzureServer(mock)
+    mock.endpoint = f"http://127.0.0.1:{server.start()}"
+    yield mock
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def deployment(monkeypatch):
+    """A fresh deployment name with its own limiter (unlimited unless a test sets budgets)."""
+    name = f"test-deployment-{next(_deployments)}"
+    monkeypatch.setitem(rate_limit._limiters, name, DeploymentLimiter(name))
+    return name
+
+
+def sync_client(mock, max_retries=2):
+    return AzureOpenAI(
+        api_key="test", api_version=API_VERSION, azure_endpoint=mock.endpoint,
+        max_retries=max_retries, http_client=httpx.Client(),
+    )
+
+
+def ask(client, deployment):
+    return client.chat.completions.create(
+        model=deployment, messages=[{"role": "user", "content": "hello"}], max_tokens=10,
+    )
+
+
+def test_queued_calls_are_admitted_by_priority(mock, deployment):
+    limiter = rate_limit._limiters[deployment] = DeploymentLimiter(deployment, rpm=120)
+    # An empty bucket refills one request every 0.5s, so every caller below queues first
+    limiter.requests.level = 0
+    admitted = []
+    lock = threading.Lock()
+
+    def call(priority):
+        ask(RateLimitedClient(sync_client(mock), priority), deployment)
+        with lock:
+            admitted.append(priority)
+
+    threads = []
+    for priority in (PRIORITY_BATCH, PRIORITY_BATCH, PRIORITY_INTAKE, PRIORITY_CHAT):
+        threads.append(threading.Thread(target=call, args=(priority,)))
+        threads[-1].start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert admitted == [PRIORITY_CHAT, PRIORITY_INTAKE, PRIORITY_BATCH, PRIORITY_BATCH]
+
+
+def test_429_pauses_the_deployment_and_is_retried_by_the_wrapper(mock, deployment):
+    limiter = rate_limit._limiters[deployment]
+    client = RateLimitedClient(sync_client(mock), PRIORITY_CHAT)
+    mock.throttle_next(1, retry_after=0.3)
+    other_done = threading.Event()
+
+    start = time.monotonic()
+    first = threading.Thread(target=ask, args=(client, deployment))
+    first.start()
+    # A second caller arriving during the pause waits for it too
+    time.sleep(0.1)
+    threading.Thread(target=lambda: (ask(client, deployment), other_done.set())).start()
+    first.join(timeout=5)
+    assert other_done.wait(timeout=5)
+
+    statuses = [status for _, name, status in mock.calls if name == deployment]
+    assert statuses == [429, 200, 200]
+    # Nothing reached the deployment again before the Retry-After pause was over
+    assert all(at - start >= 0.3 for at, name, status in mock.calls if name == deployment and status == 200)
+    # The wrapped client made no retries of its own
+    assert client.client.max_retries == 0 and client.max_retries == 2
+    assert limiter.scale == pytest.approx(0.5 + 2 * RECOVERY_STEP)
+
+
+def test_retries_are_charged_to_the_budget(mock, deployment, monkeypatch):
+    limiter = rate_limit._limiters[deployment] = DeploymentLimiter(deployment, rpm=600)
+    taken = []
+    take = limiter.requests.take
+    monkeypatch.setattr(limiter.requests, "take", lambda amount: (taken.append(amount), take(amount)))
+    mock.throttle_next(1, retry_after=0.05)
+    ask(RateLimitedClient(sync_client(mock), PRIORITY_CHAT), deployment)
+    # Both attempts went through the limiter and took a request from the bucket
+    assert taken == [1, 1]
+
+
+def test_budget_recovers_after_successful_calls(mock, deployment):
+    limiter = rate_limit._limiters[deployment]
+    client = RateLimitedClient(sync_client(mock), PRIORITY_BATCH)
+    mock.throttle_next(1, retry_after=0.05)
+    ask(client, deployment)
+    assert limiter.scale < 1.0
+    for _ in range(int(0.5 / RECOVERY_STEP) + 1):
+        ask(client, deployment)
+    assert limiter.scale == 1.0
+    assert limiter.status()["paused_for"] == 0
+
+
+def test_gives_up_after_max_retries(mock, deployment):
+    mock.throttle_next(5, retry_after=0.05)
+    with pytest.raises(RateLimitError):
+        ask(RateLimitedClient(sync_client(mock, max_retries=1), PRIORITY_CHAT), deployment)
+    assert [status for _, name, status in mock.calls if name == deployment] == [429, 429]
+
+
+def test_pause_longer_than_max_wait_raises_wait_timeout(mock, deployment):
+    mock.throttle_next(1, retry_after=2)
+    client = RateLimitedClient(sync_client(mock), PRIORITY_CHAT, max_wait=0.5)
+    with pytest.raises(RateLimitWaitTimeout):
+        ask(client, deployment)
+    assert len([1 for _, name, _ in mock.calls if name == deployment]) == 1
+
+
+def test_async_client_retries_after_the_pause(mock, deployment):
+    async def run():
+        client = RateLimitedClient(
+            AsyncAzureOpenAI(
+                api_key="test", api_version=API_VERSION, azure_endpoint=mock.endpoint, http_client=httpx.AsyncClient(),
+            ),
+            PRIORITY_CHAT,
+        )
+        start = time.monotonic()
+        response = await client.chat.completions.create(
+            model=deployment, messages=[{"role": "user", "content": "hello"}], max_tokens=10,
+        )
+        return response, time.monotonic() - start
+
+    mock.throttle_next(1, retry_after=0.2)
+    response, elapsed = asyncio.run(run())
+    assert response.choices[0].message.content == mock.answer
+    assert elapsed >= 0.2
+
+
+def test_shared_budgets_are_drawn_by_every_process(tmp_path):
+    # Two limiters with their own SharedBudgets on one file stand in for two processes
+    path = str(tmp_path / "budgets.db")
+    first = DeploymentLimiter("gpt", rpm=2, shared=SharedBudgets(path))
+    second = DeploymentLimiter("gpt", rpm=2, shared=SharedBudgets(path))
+    first.acquire(1, PRIORITY_CHAT, timeout=0.1)
+    second.acquire(1, PRIORITY_CHAT, timeout=0.1)
+    # Both requests of the minute are spent
+    with pytest.raises(RateLimitWaitTimeout):
+        first.acquire(1, PRIORITY_CHAT, timeout=0.1)
+
+    # A 429 seen by one process pauses the other
+    second.record_rate_limited(5)
+    assert first.shared.try_admit(first, PRIORITY_CHAT, 1) > 4
+
+
+def test_shared_budgets_let_another_process_pre_empt_batch_work(tmp_path):
+    path = str(tmp_path / "budgets.db")
+    backend = DeploymentLimiter("gpt", rpm=600, tpm=1000, shared=SharedBudgets(path))
+    indexer = DeploymentLimiter("gpt", rpm=600, tpm=1000, shared=SharedBudgets(path))
+    # A chat call in the backend is waiting for tokens after another one emptied the bucket
+    assert backend.shared.try_admit(backend, PRIORITY_CHAT, 1000) == 0
+    assert backend.shared.try_admit(backend, PRIORITY_CHAT, 500) > 0
+
+    # The indexer's batch call is held back although its own cost fits the budget
+    with pytest.raises(RateLimitWaitTimeout):
+        indexer.acquire(1, PRIORITY_BATCH, timeout=0.3)
+    # A waiter that stopped polling (its process exited) no longer holds anyone back
+    time.sleep(rate_limit.SHARED_WAITER_TTL)
+    indexer.acquire(1, PRIORITY_BATCH, timeout=0.3)
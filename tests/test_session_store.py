@@ -0,0 +1,135 @@
+"""
+Session store round trips, with the Redis store talking RESP to the local
+stand-in (Part2/frontend/redis_standin.py).
+"""
+import time
+
+import pytest
+
+from chat_history import ChatHistory
+from redis_standin import RedisStandInServer
+from session_store import (
+    SessionStore, SessionSync, InMemorySessionStore, SQLiteSessionStore, RedisSessionStore,
+    REDIS_KEY_PREFIX, tab_session_id,
+)
+
+
+@pytest.fixture
+def redis_server():
+    server = RedisStandInServer(("127.0.0.1", 0))
+    server.url = f"redis://127.0.0.1:{server.start()}/0"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def make_store(request, tmp_path):
+    def make(ttl=3600):
+        if request.param == "memory":
+            return InMemorySessionStore(ttl=ttl)
+        if request.param == "sqlite":
+            return SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=ttl)
+        return RedisSessionStore(request.getfixturevalue("redis_server").url, ttl=ttl)
+    return make
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+    class Partial(SessionStore):
+        def load(self, session_id):
+            return {}
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_save_load_and_delete(make_store):
+    store = make_store()
+    store.save("a", {"phase": b"j\"chat\"", "blob": bytes(range(256))})
+    store.save("b", {"phase": b"j\"intake\""})
+    assert store.load("a") == {"phase": b"j\"chat\"", "blob": bytes(range(256))}
+
+    store.save("a", {"phase": b"j\"done\""}, removed=["blob"])
+    assert store.load("a") == {"phase": b"j\"done\""}
+
+    store.delete("a")
+    assert store.load("a") == {}
+    assert store.load("b") == {"phase": b"j\"intake\""}
+    assert store.load("unknown") == {}
+
+
+def test_idle_sessions_expire(make_store):
+    store = make_store(ttl=1)
+    store.save("a", {"phase": b"j1"})
+    time.sleep(1.2)
+    assert store.load("a") == {}
+
+
+def test_redis_store_keeps_one_hash_per_session(redis_server):
+    RedisSessionStore(redis_server.url).save("a", {"phase": b"j1", "user_info": b"j{}"})
+    stored = redis_server.storage._data[(REDIS_KEY_PREFIX + "a").encode()]
+    assert stored == {b"phase": b"j1", b"user_info": b"j{}"}
+    assert redis_server.storage._expires[(REDIS_KEY_PREFIX + "a").encode()] > time.time()
+
+
+def session_state(messages):
+    history = ChatHistory(cap=4, spill_chunk=2)
+    for i in range(messages):
+        history.append("user" if i % 2 == 0 else "assistant", f"message {i} " + "x" * 600)
+    return {
+        "phase": "chat",
+        "user_info": {"hmo_name": "מכבי", "insurance_tier": "זהב", "age": 34},
+        "chat_window": 20,
+        "chat_history": history,
+    }
+
+
+def test_session_sync_round_trip_with_archived_chat(redis_server):
+    store = RedisSessionStore(redis_server.url)
+    state = session_state(9)
+    assert state["chat_history"].archive
+
+    SessionSync(store, "a").save(state)
+    restored = SessionSync(store, "a").load(cap=4, spill_chunk=2)
+
+    assert restored["phase"] == "chat"
+    assert restored["user_info"] == state["user_info"]
+    assert restored["chat_window"] == 20
+    history = restored["chat_history"]
+    assert len(history) == 9
+    assert history.since(0) == state["chat_history"].since(0)
+    assert history.conversation() == state["chat_history"].conversation()
+
+
+def test_session_sync_writes_only_changed_fields(redis_server):
+    store = RedisSessionStore(redis_server.url)
+    state = session_state(9)
+    sync = SessionSync(store, "a")
+    written = sync.save(state)
+    assert sync.save(state) == 0
+
+    state["chat_history"].append("user", "one more")
+    # The new chat_history state only; archive chunks already written are skipped
+    assert sync.save(state) == 1
+    assert written > 1
+
+    # Clearing the chat drops the old generation's archive chunks from the store
+    state["chat_history"].clear()
+    sync.save(state)
+    assert not [field for field in store.load("a") if field.startswith("chat_archive:")]
+    assert len(SessionSync(store, "a").load(cap=4, spill_chunk=2)["chat_history"]) == 0
+
+
+def test_tabs_of_one_browser_keep_separate_sessions(make_store):
+    store = make_store()
+    first, second = session_state(3), session_state(5)
+    second["user_info"] = {"hmo_name": "כללית", "insurance_tier": "כסף", "age": 61}
+    SessionSync(store, tab_session_id("b" * 64, "1" * 16)).save(first)
+    SessionSync(store, tab_session_id("b" * 64, "2" * 16)).save(second)
+
+    restored = SessionSync(store, tab_session_id("b" * 64, "1" * 16)).load(cap=4, spill_chunk=2)
+    assert restored["user_info"] == first["user_info"]
+    assert len(restored["chat_history"]) == 3
@@ -0,0 +1,67 @@
+"""
+EmbeddingStore recall and memory per storage dtype, against exact float32 search.
+"""
+import pickle
+
+import numpy as np
+import pytest
+
+from retrieval.vector_store import EmbeddingStore
+
+DIM = 256
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    rng = np.random.default_rng(7)
+    centers = rng.normal(size=(20, DIM))
+    data = centers[rng.integers(20, size=1000)] + 0.6 * rng.normal(size=(1000, DIM))
+    embeddings = {f"para_{i}": row.tolist() for i, row in enumerate(data)}
+    queries = data[rng.integers(1000, size=50)] + 0.2 * rng.normal(size=(50, DIM))
+    exact = EmbeddingStore.from_embeddings(embeddings, dtype="float32")
+    truth = [[key for _, key in exact.search(query, top_k=5)] for query in queries]
+    return embeddings, queries, exact, truth
+
+
+def recall(store, queries, truth, rescore):
+    hits = sum(len(set(t) & {key for _, key in store.search(q, top_k=5, rescore=rescore)}) for q, t in zip(queries, truth))
+    return hits / (len(queries) * 5)
+
+
+@pytest.mark.parametrize("dtype, min_recall", [("float16", 0.99), ("int8", 0.9)])
+def test_quantized_recall_with_and_without_rescore(corpus, dtype, min_recall):
+    embeddings, queries, exact, truth = corpus
+    store = EmbeddingStore.from_embeddings(embeddings, dtype=dtype, keep_exact=True)
+    assert recall(store, queries, truth, rescore=False) >= min_recall
+    # Rescoring the candidates with the exact vectors restores the exact ranking
+    assert recall(store, queries, truth, rescore=True) == 1.0
+    assert [key for _, key in store.search(queries[0], top_k=5)] == truth[0]
+
+
+def test_quantized_vectors_take_a_fraction_of_the_memory(corpus, tmp_path):
+    embeddings, _, exact, _ = corpus
+    int8 = EmbeddingStore.from_embeddings(embeddings, dtype="int8", keep_exact=True, exact_path=str(tmp_path / "exact.npy"))
+    float16 = EmbeddingStore.from_embeddings(embeddings, dtype="float16")
+    # The exact vectors are memory-mapped and not counted
+    assert int8.nbytes < exact.nbytes / 3.5
+    assert float16.nbytes == exact.nbytes / 2
+
+
+def test_memory_mapped_store_survives_pickling(corpus, tmp_path):
+    embeddings, queries, _, truth = corpus
+    store = EmbeddingStore.from_embeddings(embeddings, dtype="int8", keep_exact=True, exact_path=str(tmp_path / "exact.npy"))
+    restored = pickle.loads(pickle.dumps(store))
+    assert isinstance(restored._exact, np.memmap)
+    assert [key for _, key in restored.search(queries[1], top_k=5)] == truth[1]
+    np.testing.assert_array_equal(restored.get("para_3"), store.get("para_3"))
+
+
+def test_key_filter_and_row_restriction(corpus):
+    embeddings, queries, _, _ = corpus
+    store = EmbeddingStore.from_embeddings(embeddings, dtype="int8", keep_exact=True)
+    even = store.search(queries[0], top_k=5, key_filter=lambda key: int(key.split("_")[1]) % 2 == 0)
+    assert len(even) == 5 and all(int(key.split("_")[1]) % 2 == 0 for _, key in even)
+
+    rows = store.rows([f"para_{i}" for i in range(0, 1000, 2)])
+    assert [key for _, key in store.search(queries[0], top_k=5, rows=rows)] == [key for _, key in even]
+    assert store.search(queries[0], top_k=5, rows=rows[:0]) == []